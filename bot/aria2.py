@@ -0,0 +1,170 @@
+"""
+aria2 JSON-RPC daemon manager
+"""
+
+import asyncio
+import logging
+import os
+import secrets
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import aiohttp
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+class Aria2Error(Exception):
+    """Error returned by the aria2 RPC interface"""
+
+class Aria2:
+    """Long-lived aria2c process driven over JSON-RPC"""
+    
+    def __init__(self, session: aiohttp.ClientSession):
+        self.session = session
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.secret = Config.ARIA2_RPC_SECRET or secrets.token_hex(16)
+        self.url = f"http://127.0.0.1:{Config.ARIA2_RPC_PORT}/jsonrpc"
+        self._request_id = 0
+        
+    async def start(self):
+        """Spawn the aria2 daemon and wait for its RPC endpoint"""
+        cmd = [
+            'aria2c',
+            '--enable-rpc',
+            '--rpc-listen-all=false',
+            f'--rpc-listen-port={Config.ARIA2_RPC_PORT}',
+            f'--rpc-secret={self.secret}',
+            '--dir', os.path.abspath(Config.DOWNLOAD_PATH),
+            f'--max-concurrent-downloads={Config.ARIA2_MAX_CONCURRENT}',
+            f'--max-connection-per-server={min(Config.ARIA2_CONNECTIONS, 16)}',
+            f'--split={Config.ARIA2_CONNECTIONS}',
+            '--min-split-size=1M',
+            '--continue=true',
+            '--seed-time=0',
+            '--follow-torrent=mem',
+            f'--stop-with-process={os.getpid()}',
+            '--quiet=true'
+        ]
+        
+        # Console output is disabled, nothing is piped so it can never block
+        self.process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        
+        for _ in range(50):
+            if self.process.returncode is not None:
+                break
+            try:
+                version = await self.call("getVersion")
+                logger.info(f"aria2 {version.get('version')} rpc listening on port {Config.ARIA2_RPC_PORT}")
+                return
+            except (aiohttp.ClientError, Aria2Error):
+                await asyncio.sleep(0.2)
+                
+        raise Aria2Error("aria2 rpc daemon failed to start")
+        
+    async def stop(self):
+        """Shut the aria2 daemon down"""
+        if not self.process or self.process.returncode is not None:
+            return
+        try:
+            await self.call("forceShutdown")
+            await asyncio.wait_for(self.process.wait(), timeout=10)
+        except Exception:
+            self.process.kill()
+            await self.process.wait()
+        logger.info("aria2 daemon stopped")
+        
+    @property
+    def running(self) -> bool:
+        """Whether the daemon process is alive"""
+        return self.process is not None and self.process.returncode is None
+        
+    async def call(self, method: str, *params) -> Any:
+        """Invoke an aria2 RPC method"""
+        self._request_id += 1
+        payload = {
+            "jsonrpc": "2.0",
+            "id": str(self._request_id),
+            "method": f"aria2.{method}",
+            "params": [f"token:{self.secret}", *params]
+        }
+        async with self.session.post(self.url, json=payload) as resp:
+            data = await resp.json(content_type=None)
+        if "error" in data:
+            raise Aria2Error(data["error"].get("message", "unknown error"))
+        return data["result"]
+        
+    async def add_uri(self, uris: List[str], options: Optional[Dict[str, str]] = None) -> str:
+        """Queue a new download and return its gid"""
+        return await self.call("addUri", uris, options or {})
+        
+    async def tell_status(self, gid: str, keys: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Get the status of a download"""
+        if keys:
+            return await self.call("tellStatus", gid, keys)
+        return await self.call("tellStatus", gid)
+        
+    async def tell_active(self) -> List[Dict[str, Any]]:
+        """List active downloads"""
+        return await self.call("tellActive")
+        
+    async def tell_waiting(self, offset: int = 0, num: int = 100) -> List[Dict[str, Any]]:
+        """List queued and paused downloads"""
+        return await self.call("tellWaiting", offset, num)
+        
+    async def pause(self, gid: str) -> str:
+        """Pause a download"""
+        return await self.call("forcePause", gid)
+        
+    async def unpause(self, gid: str) -> str:
+        """Resume a paused download"""
+        return await self.call("unpause", gid)
+        
+    async def change_position(self, gid: str, pos: int, how: str = 'POS_SET') -> int:
+        """Move a waiting download within the queue"""
+        return await self.call("changePosition", gid, pos, how)
+        
+    async def remove(self, gid: str) -> str:
+        """Cancel a download"""
+        return await self.call("forceRemove", gid)
+        
+    async def remove_result(self, gid: str):
+        """Drop a finished download from aria2 memory"""
+        try:
+            await self.call("removeDownloadResult", gid)
+        except Aria2Error:
+            pass
+            
+    async def global_stat(self) -> Dict[str, Any]:
+        """Get global download statistics"""
+        return await self.call("getGlobalStat")
+        
+    async def wait(self, gid: str, on_status: Optional[Callable[[Dict[str, Any]], Awaitable]] = None,
+                   interval: float = 1) -> Dict[str, Any]:
+        """Poll a download until it completes, errors or is removed, following magnet and torrent gids"""
+        try:
+            while True:
+                status = await self.tell_status(gid)
+                state = status.get('status')
+                followed = status.get('followedBy')
+                if state == 'complete' and followed:
+                    await self.remove_result(gid)
+                    gid = followed[0]
+                    continue
+                if state in ('complete', 'error', 'removed'):
+                    await self.remove_result(gid)
+                    return status
+                if on_status:
+                    await on_status(status)
+                await asyncio.sleep(interval)
+        except (asyncio.CancelledError, Exception):
+            # Whoever waited gave up, the download must not keep filling the disk
+            try:
+                await self.remove(gid)
+            except Exception:
+                pass
+            raise
\ No newline at end of file
@@ -3,14 +3,28 @@ Main bot client implementation
 """
 
 import logging
+import asyncio
+import os
+import sys
 from pathlib import Path
 from typing import Dict, Any
 
+import aiohttp
 from pyrogram import Client, filters
 from pyrogram.types import Message
 
+from .aria2 import Aria2
 from .config import Config
 from .database import Database
+from .diskspace import DiskManager
+from .driveindex import DriveIndex
+from .ffprobe import ProbeCache
+from .filestore import FileStore
+from .jobs import JobManager, JobStore
+from .rclone import Rclone
+from .scheduler import EditScheduler
+from .transfer import MediaDownloader, MediaUploader, SessionPool
+from .workers import WorkerPool, default_workers
 # from .plugins import load_plugins
 
 logger = logging.getLogger(__name__)
@@ -33,6 +47,19 @@ class MuxBot(Client):
         self.owner_id = Config.OWNER_ID
         self.auth_users = set(Config.AUTH_USERS)
         self.auth_groups = set(Config.AUTH_GROUPS)
+        self.http: aiohttp.ClientSession = None
+        self.aria2: Aria2 = None
+        self.rclone: Rclone = None
+        self.drive_index = DriveIndex(self)
+        self.disk = DiskManager()
+        self.store = FileStore()
+        self.transfer_sessions = SessionPool(self)
+        self.downloader = MediaDownloader(self, self.transfer_sessions)
+        self.uploader = MediaUploader(self, self.transfer_sessions)
+        self.edit_scheduler = EditScheduler()
+        self.jobs = JobManager(JobStore(self.db))
+        self.probe_cache = ProbeCache(self.db)
+        self.mux_pool = WorkerPool("mux", Config.MUX_WORKERS or default_workers(Config.DOWNLOAD_PATH))
         
     async def start(self):
         """Start the bot"""
@@ -41,8 +68,6 @@ class MuxBot(Client):
             logger.error(f"API_ID: {Config.API_ID}, API_HASH: {'set' if Config.API_HASH else 'not set'}, BOT_TOKEN: {'set' if Config.BOT_TOKEN else 'not set'}, OWNER_ID: {Config.OWNER_ID}")
             return
             
-        await super().start()
-        
         if self.db:
             await self.db.connect()
             
@@ -52,16 +77,61 @@ class MuxBot(Client):
             self.auth_users.update(auth_data.get("users", []))
             self.auth_groups.update(auth_data.get("groups", []))
             
+        self.edit_scheduler.start()
+        self.disk.start()
+        self.store.start()
+        
+        # Shared connection pool for local daemons and remote probes
+        self.http = aiohttp.ClientSession()
+        
+        self.aria2 = Aria2(self.http)
+        try:
+            await self.aria2.start()
+        except Exception as e:
+            logger.error(f"aria2 daemon failed to start: {e}")
+            
+        self.rclone = Rclone(self.http)
+        try:
+            await self.rclone.start()
+        except Exception as e:
+            logger.error(f"rclone daemon failed to start: {e}")
+            
+        self.drive_index.start()
+        
+        # Handlers only go live once the session and daemons they use exist
+        await super().start()
+        
+        # Pick up downloads, uploads and mux jobs the previous run left behind
+        await self.jobs.resume(self)
+        
         me = await self.get_me()
         logger.info(f"bot started as @{me.username}")
         
     async def stop(self):
         """Stop the bot"""
+        await self.jobs.suspend()
+        await self.edit_scheduler.stop()
+        await self.drive_index.stop()
+        await self.store.stop()
+        self.disk.stop()
+        if self.aria2:
+            await self.aria2.stop()
+        if self.rclone:
+            await self.rclone.stop()
+        if self.http:
+            await self.http.close()
+        await self.transfer_sessions.stop()
         if self.db:
             await self.db.close()
         await super().stop()
         logger.info("bot stopped")
         
+    async def reboot(self):
+        """Stop cleanly and replace the process with a fresh one, persisted jobs resume on start"""
+        logger.info("restarting bot")
+        await self.stop()
+        os.execv(sys.executable, [sys.executable, *sys.argv])
+        
     def is_authorized(self, user_id: int, chat_id: int = None) -> bool:
         """Check if user is authorized"""
         if user_id == self.owner_id:
@@ -70,4 +140,12 @@ class MuxBot(Client):
             return True
         if chat_id and chat_id in self.auth_groups:
             return True
-        return False
\ No newline at end of file
+        return False
+        
+    def schedule_edit(self, message: Message, text: str, **kwargs) -> asyncio.Future:
+        """Queue a rate limited status edit, only the latest text per message is sent"""
+        return self.edit_scheduler.schedule(message, text, **kwargs)
+        
+    async def cancel_edits(self, message: Message):
+        """Drop queued status edits for a message"""
+        await self.edit_scheduler.discard(message)
\ No newline at end of file
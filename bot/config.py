@@ -31,15 +31,77 @@ class Config:
     # Paths
     DOWNLOAD_PATH: str = os.environ.get("DOWNLOAD_PATH", "downloads")
     TEMP_PATH: str = os.environ.get("TEMP_PATH", "temp")
+    CACHE_PATH: str = os.environ.get("CACHE_PATH", "cache")
+    
+    # Disk admission, bytes always left free and seconds a job waits for room
+    DISK_RESERVE: int = int(os.environ.get("DISK_RESERVE", str(1024 * 1024 * 1024)))
+    DISK_WAIT_TIMEOUT: int = int(os.environ.get("DISK_WAIT_TIMEOUT", "3600"))
+    # Unpinned temp files unused this many seconds may be evicted for room, 0 never evicts
+    DISK_EVICT_AGE: int = int(os.environ.get("DISK_EVICT_AGE", "86400"))
+    # The same for downloads and mux outputs, off unless set since those are the users' files
+    DISK_EVICT_DOWNLOADS: int = int(os.environ.get("DISK_EVICT_DOWNLOADS", "0"))
+    
+    # Content addressed store of fetched files, 0 disables it
+    STORE_PATH: str = os.environ.get("STORE_PATH", os.path.join(CACHE_PATH, "store"))
+    STORE_SIZE: int = int(os.environ.get("STORE_SIZE", str(20 * 1024 * 1024 * 1024)))
     
     # Bot settings
     CMD_PREFIX: str = "/"
     MAX_MESSAGE_LENGTH: int = 4096
     WORKERS: int = int(os.environ.get("WORKERS", "4"))
     
+    # Bytes of /term output kept in memory before spilling to TEMP_PATH
+    TERM_SPOOL_SIZE: int = int(os.environ.get("TERM_SPOOL_SIZE", str(4 * 1024 * 1024)))
+    
+    # Default timeout in seconds of /eval -t, 0 waits forever
+    EVAL_TIMEOUT: int = int(os.environ.get("EVAL_TIMEOUT", "300"))
+    
+    # Aria2 RPC daemon
+    ARIA2_RPC_PORT: int = int(os.environ.get("ARIA2_RPC_PORT", "6800"))
+    ARIA2_RPC_SECRET: str = os.environ.get("ARIA2_RPC_SECRET", "")
+    ARIA2_MAX_CONCURRENT: int = int(os.environ.get("ARIA2_MAX_CONCURRENT", "5"))
+    ARIA2_CONNECTIONS: int = int(os.environ.get("ARIA2_CONNECTIONS", "16"))
+    
+    # rclone rc daemon
+    RCLONE_RC_PORT: int = int(os.environ.get("RCLONE_RC_PORT", "5572"))
+    RCLONE_TRANSFERS: int = int(os.environ.get("RCLONE_TRANSFERS", "8"))
+    RCLONE_CHECKERS: int = int(os.environ.get("RCLONE_CHECKERS", "16"))
+    RCLONE_DRIVE_CHUNK_SIZE: str = os.environ.get("RCLONE_DRIVE_CHUNK_SIZE", "64M")
+    
+    # MiB of telegram media downloaded ahead of a streamed drive upload
+    STREAM_BUFFER_CHUNKS: int = int(os.environ.get("STREAM_BUFFER_CHUNKS", "16"))
+    
+    # Media sessions per telegram datacenter, parts of one file are fetched over all of them at once
+    TG_TRANSFER_SESSIONS: int = int(os.environ.get("TG_TRANSFER_SESSIONS", "4"))
+    # Largest file sent to a chat in one piece, bigger mux outputs are split
+    TG_UPLOAD_LIMIT: int = int(os.environ.get("TG_UPLOAD_LIMIT", str(2000 * 1024 * 1024)))
+    
+    # Seconds between full walks of the drive folder for /glist
+    GLIST_REFRESH_INTERVAL: int = int(os.environ.get("GLIST_REFRESH_INTERVAL", "900"))
+    
+    # Mux worker pool, 0 picks a size from cores and disk type
+    MUX_WORKERS: int = int(os.environ.get("MUX_WORKERS", "0"))
+    
+    # ffprobe result cache
+    PROBE_CACHE_SIZE: int = int(os.environ.get("PROBE_CACHE_SIZE", "512"))
+    PROBE_CACHE_FILES: int = int(os.environ.get("PROBE_CACHE_FILES", "10000"))
+    
+    # Megabytes fetched from the start and end of telegram media before a full download
+    PROBE_HEAD_CHUNKS: int = int(os.environ.get("PROBE_HEAD_CHUNKS", "4"))
+    PROBE_TAIL_CHUNKS: int = int(os.environ.get("PROBE_TAIL_CHUNKS", "2"))
+    
+    # Remote probing limits for /mi <url>
+    PROBE_URL_TIMEOUT: int = int(os.environ.get("PROBE_URL_TIMEOUT", "30"))
+    PROBE_URL_MAX_BYTES: int = int(os.environ.get("PROBE_URL_MAX_BYTES", str(20 * 1024 * 1024)))
+    
     # Progress indicators
     FINISHED_PROGRESS: str = "█"
     UNFINISHED_PROGRESS: str = "░"
+    PROGRESS_INTERVAL: int = int(os.environ.get("PROGRESS_INTERVAL", "5"))
+    
+    # Status edit rate limits
+    EDIT_GLOBAL_RATE: float = float(os.environ.get("EDIT_GLOBAL_RATE", "20"))
+    EDIT_CHAT_RATE: float = float(os.environ.get("EDIT_CHAT_RATE", "20"))
     
     @classmethod
     def validate(cls) -> bool:
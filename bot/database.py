@@ -112,4 +112,55 @@ class Database:
             return True
         except Exception as e:
             logger.error(f"error updating settings: {e}")
+            return False
+            
+    async def get_probe(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get a cached ffprobe result"""
+        try:
+            doc = await self.db.probes.find_one({"_id": key})
+            return doc["info"] if doc else None
+        except Exception as e:
+            logger.error(f"error getting probe: {e}")
+            return None
+            
+    async def set_probe(self, key: str, info: Dict[str, Any]) -> bool:
+        """Cache an ffprobe result"""
+        try:
+            await self.db.probes.update_one(
+                {"_id": key},
+                {"$set": {"info": info}},
+                upsert=True
+            )
+            return True
+        except Exception as e:
+            logger.error(f"error caching probe: {e}")
+            return False
+            
+    async def get_jobs(self) -> List[Dict[str, Any]]:
+        """Get persisted job descriptors"""
+        try:
+            return [
+                {key: value for key, value in doc.items() if key != "_id"}
+                async for doc in self.db.jobs.find()
+            ]
+        except Exception as e:
+            logger.error(f"error getting jobs: {e}")
+            return []
+            
+    async def save_job(self, key: str, descriptor: Dict[str, Any]) -> bool:
+        """Persist a job descriptor"""
+        try:
+            await self.db.jobs.replace_one({"_id": key}, descriptor, upsert=True)
+            return True
+        except Exception as e:
+            logger.error(f"error saving job: {e}")
+            return False
+            
+    async def delete_job(self, key: str) -> bool:
+        """Forget a job descriptor"""
+        try:
+            await self.db.jobs.delete_one({"_id": key})
+            return True
+        except Exception as e:
+            logger.error(f"error deleting job: {e}")
             return False
\ No newline at end of file
@@ -0,0 +1,341 @@
+"""
+Disk space admission and eviction for the download and temp folders
+"""
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .config import Config
+from .progress import format_bytes
+
+logger = logging.getLogger(__name__)
+
+class DiskSpaceError(Exception):
+    """A job does not fit on its disk"""
+
+def content_length(headers: Dict[str, str]) -> int:
+    """Size of a remote file from HEAD or one byte range response headers, 0 if unknown"""
+    content_range = headers.get('Content-Range', '')
+    if '/' in content_range and content_range.rsplit('/', 1)[1].isdigit():
+        return int(content_range.rsplit('/', 1)[1])
+    length = headers.get('Content-Length', '')
+    return int(length) if length.isdigit() and not content_range else 0
+
+def existing_parent(path: str) -> str:
+    """Closest ancestor of a path that exists, reservations may target folders not created yet"""
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return path
+
+def entry_size(path: str) -> int:
+    """Bytes deleting a file or folder frees, files hardlinked elsewhere free nothing"""
+    if not os.path.isdir(path):
+        st = os.stat(path)
+        return st.st_size if st.st_nlink == 1 else 0
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                st = os.stat(os.path.join(root, name))
+                if st.st_nlink == 1:
+                    total += st.st_size
+            except OSError:
+                pass
+    return total
+
+def entry_used(path: str) -> float:
+    """Last access or change of a file or of anything below a folder"""
+    stat = os.stat(path)
+    used = max(stat.st_atime, stat.st_mtime)
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            for name in dirs + files:
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                    used = max(used, stat.st_atime, stat.st_mtime)
+                except OSError:
+                    pass
+    return used
+
+class Reservation:
+    """Space promised to one job until it is released"""
+    
+    def __init__(self, manager: 'DiskManager', path: str, size: int, name: str):
+        self.manager = manager
+        self.path = path
+        self.device = os.stat(existing_parent(path)).st_dev
+        self.size = size
+        self.name = name
+        self.written = 0
+        self.created = time.time()
+        
+    @property
+    def outstanding(self) -> int:
+        """Promised bytes the job has not written yet"""
+        return max(0, self.size - self.written)
+        
+    def update(self, written: int):
+        """Report how much of the reservation is already on disk"""
+        self.written = written
+        
+    async def grow(self, size: int, on_wait: Optional[Callable[[int], Awaitable]] = None):
+        """Wait until a larger estimate fits, e.g. once a download learnt its real size"""
+        if size <= self.size:
+            return
+        extra = await self.manager.reserve(self.path, size - self.size, self.name, on_wait)
+        extra.release()
+        self.size = size
+        
+    def release(self):
+        """Give the space back and let waiting jobs in"""
+        self.manager._release(self)
+
+class DiskManager:
+    """Admits jobs only when the space they need is free, queueing the rest
+    
+    Reservations on one filesystem are admitted in order. A job that would
+    never fit fails at once, one that only has to wait for others gets
+    queued until space is released. Top level entries of TEMP_PATH untouched
+    for DISK_EVICT_AGE, and of DOWNLOAD_PATH for DISK_EVICT_DOWNLOADS, are
+    deleted oldest first when that makes a waiting job fit, unless something
+    pinned lives in them.
+    """
+    
+    def __init__(self):
+        self.roots = [Config.DOWNLOAD_PATH, Config.TEMP_PATH]
+        self.reservations: List[Reservation] = []
+        self.pins_path = os.path.join(Config.CACHE_PATH, "disk_pins.json")
+        self.pins: set = set()
+        self._holds: Dict[str, int] = {}
+        self._waiters: List[Tuple[Reservation, asyncio.Future]] = []
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        
+    def start(self):
+        """Load the saved pins and start admitting queued jobs"""
+        try:
+            with open(self.pins_path, encoding="utf-8") as f:
+                self.pins = set(json.load(f))
+        except (OSError, ValueError):
+            pass
+        self._task = asyncio.create_task(self._run())
+        
+    def stop(self):
+        """Stop admitting queued jobs"""
+        if self._task:
+            self._task.cancel()
+            
+    async def reserve(self, path: str, size: int, name: str,
+                      on_wait: Optional[Callable[[int], Awaitable]] = None) -> Reservation:
+        """Reserve bytes on the filesystem of path, waits while other jobs hold the space
+        
+        on_wait gets the queue position once the job has to wait. Raises
+        DiskSpaceError when the job can never fit or waited DISK_WAIT_TIMEOUT.
+        """
+        reservation = Reservation(self, path, max(0, size), name)
+        capacity = shutil.disk_usage(existing_parent(path)).total - Config.DISK_RESERVE
+        if reservation.size > capacity:
+            raise DiskSpaceError(f"{name} needs {format_bytes(size)}, the disk only holds {format_bytes(max(0, capacity))}")
+            
+        # Nothing to wait for, the job only learns its size later and grows the reservation
+        if not reservation.size:
+            self.reservations.append(reservation)
+            return reservation
+            
+        async with self._lock:
+            if not self._queued(reservation.device) and await self._admit(reservation):
+                return reservation
+                
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((reservation, future))
+        logger.info(f"{name} waits for {format_bytes(size)} of disk space")
+        try:
+            if on_wait:
+                await on_wait(self._queued(reservation.device))
+            await asyncio.wait_for(asyncio.shield(future), Config.DISK_WAIT_TIMEOUT or None)
+        except BaseException as e:
+            self._waiters = [waiter for waiter in self._waiters if waiter[1] is not future]
+            # Admitted right as the wait ended, the space is not going to be used
+            if future.done():
+                self._release(reservation)
+            else:
+                future.cancel()
+            if isinstance(e, asyncio.TimeoutError):
+                raise DiskSpaceError(f"no room for {format_bytes(size)} of {name} after {Config.DISK_WAIT_TIMEOUT}s") from None
+            raise
+        return reservation
+        
+    def available(self, path: str) -> int:
+        """Free bytes on the filesystem of path that no reservation has claimed"""
+        path = existing_parent(path)
+        device = os.stat(path).st_dev
+        claimed = sum(r.outstanding for r in self.reservations if r.device == device)
+        return shutil.disk_usage(path).free - Config.DISK_RESERVE - claimed
+        
+    @property
+    def waiting(self) -> List[Reservation]:
+        """Reservations queued for space, in admission order"""
+        return [reservation for reservation, _ in self._waiters]
+        
+    def pin(self, path: str):
+        """Protect a path and everything below it from eviction until unpinned"""
+        self.pins.add(os.path.abspath(path))
+        self._save_pins()
+        
+    def unpin(self, path: str) -> bool:
+        """Drop a pin, returns False if the path was not pinned"""
+        path = os.path.abspath(path)
+        if path not in self.pins:
+            return False
+        self.pins.discard(path)
+        self._save_pins()
+        return True
+        
+    @contextmanager
+    def hold(self, *paths: str) -> Iterator[None]:
+        """Protect paths a job reads or writes for the duration of a block"""
+        paths = [os.path.abspath(path) for path in paths]
+        for path in paths:
+            self._holds[path] = self._holds.get(path, 0) + 1
+        try:
+            yield
+        finally:
+            for path in paths:
+                self._holds[path] -= 1
+                if not self._holds[path]:
+                    del self._holds[path]
+                    
+    def pinned(self, path: str) -> bool:
+        """Whether a path, something inside it or a folder it is in is pinned or held"""
+        path = os.path.abspath(path)
+        for pin in list(self.pins) + list(self._holds):
+            if pin == path or pin.startswith(path + os.sep) or path.startswith(pin + os.sep):
+                return True
+        return False
+        
+    def evictable(self, device: Optional[int] = None) -> List[Tuple[float, int, str]]:
+        """Entries eviction may delete as (last used, size, path), least recently used first"""
+        entries = []
+        # A folder shared by downloads and temp files follows the download setting
+        ages = {os.path.abspath(Config.TEMP_PATH): Config.DISK_EVICT_AGE}
+        ages[os.path.abspath(Config.DOWNLOAD_PATH)] = Config.DISK_EVICT_DOWNLOADS
+        for root in dict.fromkeys(os.path.abspath(root) for root in self.roots):
+            if not ages.get(root):
+                continue
+            cutoff = time.time() - ages[root]
+            try:
+                names = os.listdir(root)
+            except OSError:
+                continue
+            for name in names:
+                path = os.path.join(root, name)
+                # aria2 keeps a control file next to downloads it has not finished
+                if name.endswith('.aria2') or os.path.exists(path + '.aria2') or self.pinned(path):
+                    continue
+                try:
+                    if device is not None and os.stat(path).st_dev != device:
+                        continue
+                    used = entry_used(path)
+                    if used <= cutoff:
+                        entries.append((used, entry_size(path), path))
+                except OSError:
+                    continue
+        return sorted(entries)
+        
+    def _queued(self, device: int) -> int:
+        return sum(1 for reservation, _ in self._waiters if reservation.device == device)
+        
+    async def _admit(self, reservation: Reservation) -> bool:
+        missing = reservation.size - self.available(reservation.path)
+        if missing > 0 and not await self._evict(reservation.device, missing):
+            return False
+        self.reservations.append(reservation)
+        return True
+        
+    async def _evict(self, device: int, needed: int) -> bool:
+        loop = asyncio.get_running_loop()
+        entries = await loop.run_in_executor(None, self.evictable, device)
+        # Deleting only helps when it frees enough
+        if sum(size for _, size, _ in entries) < needed:
+            return False
+        freed = 0
+        for _, size, path in entries:
+            if freed >= needed:
+                break
+            try:
+                if os.path.isdir(path):
+                    await loop.run_in_executor(None, shutil.rmtree, path)
+                else:
+                    os.remove(path)
+            except OSError as e:
+                logger.error(f"error evicting {path}: {e}")
+                continue
+            freed += size
+            logger.info(f"evicted {path} ({format_bytes(size)}) for disk space")
+        return freed >= needed
+        
+    def _release(self, reservation: Reservation):
+        if reservation in self.reservations:
+            self.reservations.remove(reservation)
+            self._wakeup.set()
+            
+    async def _run(self):
+        # Space also frees up outside the bot, so queued jobs are retried on a timer too
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), 5)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self._admit_waiters()
+            except Exception as e:
+                logger.error(f"disk admission failed: {e}")
+                
+    async def _admit_waiters(self):
+        blocked = set()
+        async with self._lock:
+            for waiter in list(self._waiters):
+                reservation, future = waiter
+                if reservation.device in blocked or future.done():
+                    continue
+                if not await self._admit(reservation):
+                    # Later jobs on the same disk wait their turn so large ones are not starved
+                    blocked.add(reservation.device)
+                elif future.done():
+                    self._release(reservation)
+                else:
+                    future.set_result(None)
+                    self._waiters.remove(waiter)
+                    
+    def _save_pins(self):
+        try:
+            os.makedirs(Config.CACHE_PATH, exist_ok=True)
+            with open(self.pins_path, "w", encoding="utf-8") as f:
+                json.dump(sorted(self.pins), f)
+        except OSError as e:
+            logger.error(f"error saving disk pins: {e}")
+
+async def admit_download(aria2, gid: str, reservation: Reservation, size: int,
+                         on_wait: Optional[Callable[[int], Awaitable]] = None):
+    """Grow the reservation of an aria2 download to its real size, pausing it while it waits"""
+    paused = False
+    
+    async def pause(position):
+        nonlocal paused
+        paused = True
+        await aria2.pause(gid)
+        if on_wait:
+            await on_wait(position)
+            
+    await reservation.grow(size, pause)
+    if paused:
+        await aria2.unpause(gid)
\ No newline at end of file
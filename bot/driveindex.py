@@ -0,0 +1,195 @@
+"""
+Local index of the google drive upload folder
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# Seconds changes are collected before the index is written, a burst of uploads saves once
+SAVE_DELAY = 5
+
+# Sort key and whether it runs largest or newest first
+SORT_KEYS = {
+    "name": (lambda entry: entry["lower"], False),
+    "size": (lambda entry: entry["size"], True),
+    "date": (lambda entry: entry["modtime"], True)
+}
+
+class DriveIndex:
+    """Snapshot of the MuxBot drive folder, refreshed in the background"""
+    
+    def __init__(self, client):
+        self.client = client
+        self.remote: Optional[str] = None
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.refreshed_at = 0.0
+        self.path = os.path.join(Config.CACHE_PATH, "drive_index.json")
+        self._views: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._save_task: Optional[asyncio.Task] = None
+        
+    def start(self):
+        """Start the refresh loop, which loads the saved index first"""
+        self._task = asyncio.create_task(self._run())
+        
+    async def stop(self):
+        """Stop the refresh loop and write out a pending save"""
+        if self._task:
+            self._task.cancel()
+        if self._save_task and not self._save_task.done():
+            self._save_task.cancel()
+            await self._save()
+            
+    @property
+    def fs(self) -> str:
+        return f"{self.remote}:MuxBot"
+        
+    async def _run(self):
+        await self._load()
+        # A snapshot saved shortly before a restart is recent enough to serve until the next walk
+        age = time.time() - self.refreshed_at
+        if self.entries and 0 <= age < Config.GLIST_REFRESH_INTERVAL:
+            await asyncio.sleep(Config.GLIST_REFRESH_INTERVAL - age)
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"drive index refresh failed: {e}")
+            await asyncio.sleep(Config.GLIST_REFRESH_INTERVAL)
+            
+    async def _resolve_remote(self) -> bool:
+        rclone = self.client.rclone
+        if not rclone or not rclone.running:
+            return False
+        remotes = await rclone.remotes()
+        if not remotes:
+            return False
+        if remotes[0] != self.remote:
+            self.remote = remotes[0]
+            self.entries = {}
+        return True
+        
+    async def refresh(self):
+        """Walk the whole folder once and replace the index"""
+        async with self._lock:
+            if not await self._resolve_remote():
+                return
+            items = await self._list("")
+            self.entries = {item["path"]: item for item in items}
+            self.refreshed_at = time.time()
+            self._changed()
+        logger.info(f"drive index refreshed with {len(self.entries)} files")
+        
+    async def update(self, paths: List[str]):
+        """Re-read only the given folder-relative paths after a change"""
+        async with self._lock:
+            if not await self._resolve_remote():
+                return
+            for path in paths:
+                for key in [key for key in self.entries if key == path or key.startswith(path + "/")]:
+                    del self.entries[key]
+                try:
+                    data = await self.client.rclone.call("operations/stat", fs=self.fs, remote=path, opt={"noMimeType": True})
+                except Exception:
+                    continue
+                item = data.get("item")
+                if not item:
+                    continue
+                if item.get("IsDir"):
+                    for entry in await self._list(path):
+                        self.entries[entry["path"]] = entry
+                else:
+                    entry = self._entry(item, "")
+                    self.entries[entry["path"]] = entry
+            self._changed()
+            
+    async def _list(self, path: str) -> List[Dict[str, Any]]:
+        data = await self.client.rclone.call(
+            "operations/list",
+            fs=self.fs,
+            remote=path,
+            opt={"recurse": True, "filesOnly": True, "noMimeType": True}
+        )
+        return [self._entry(item, path) for item in data.get("list") or []]
+        
+    @staticmethod
+    def _entry(item: Dict[str, Any], parent: str) -> Dict[str, Any]:
+        # operations/list paths are relative to the listed directory
+        path = f"{parent}/{item['Path']}" if parent else item["Path"]
+        return {
+            "path": path,
+            "lower": path.lower(),
+            "size": item.get("Size", 0),
+            "modtime": item.get("ModTime", ""),
+            "id": item.get("ID", "")
+        }
+        
+    def query(self, text: str = "", sort: str = "name") -> List[Dict[str, Any]]:
+        """Filtered and sorted entries, memoised until the index changes"""
+        key = (text.lower(), sort)
+        view = self._views.get(key)
+        if view is None:
+            entries = self.entries.values()
+            if key[0]:
+                entries = [entry for entry in entries if key[0] in entry["lower"]]
+            key_func, reverse = SORT_KEYS.get(sort, SORT_KEYS["name"])
+            view = sorted(entries, key=key_func, reverse=reverse)
+            if len(self._views) > 32:
+                self._views.clear()
+            self._views[key] = view
+        return view
+        
+    def _changed(self):
+        self._views.clear()
+        if not self._save_task or self._save_task.done():
+            self._save_task = asyncio.create_task(self._save_later())
+            
+    async def _save_later(self):
+        await asyncio.sleep(SAVE_DELAY)
+        await self._save()
+        
+    async def _load(self):
+        try:
+            data = await asyncio.get_running_loop().run_in_executor(None, self._read)
+            async with self._lock:
+                # A refresh asked for while the file was read is newer
+                if data["refreshed_at"] <= self.refreshed_at:
+                    return
+                self.remote = data["remote"]
+                self.refreshed_at = data["refreshed_at"]
+                self.entries = {entry["path"]: entry for entry in data["entries"]}
+                self._views.clear()
+        except (OSError, ValueError, KeyError):
+            pass
+            
+    def _read(self) -> Dict[str, Any]:
+        with open(self.path, encoding="utf-8") as f:
+            return json.load(f)
+            
+    async def _save(self):
+        # The entries are copied here, the executor serialises a snapshot while the index moves on
+        data = {
+            "remote": self.remote,
+            "refreshed_at": self.refreshed_at,
+            "entries": list(self.entries.values())
+        }
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, data)
+        except OSError as e:
+            logger.error(f"error saving drive index: {e}")
+            
+    def _write(self, data: Dict[str, Any]):
+        os.makedirs(Config.CACHE_PATH, exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
\ No newline at end of file
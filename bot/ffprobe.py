@@ -0,0 +1,240 @@
+"""
+ffprobe runner with a two tier result cache
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+from .config import Config
+from .filestore import media_key, url_key
+
+logger = logging.getLogger(__name__)
+
+class ProbeError(Exception):
+    """ffprobe could not read the input"""
+
+async def run_ffprobe(source: str, extra_args: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Probe a file or url and return ffprobe's json output"""
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-print_format', 'json',
+        '-show_format',
+        '-show_streams',
+        *(extra_args or []),
+        source
+    ]
+    
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    
+    try:
+        stdout, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+        
+    if process.returncode != 0:
+        raise ProbeError(stderr.decode('utf-8', errors='ignore').strip() or "unknown error")
+        
+    info = json.loads(stdout.decode('utf-8', errors='ignore') or "{}")
+    if not info.get('streams'):
+        raise ProbeError("no media streams found")
+    return info
+
+def message_media(message):
+    """Get the downloadable media object of a message"""
+    if not message or not message.media:
+        return None
+    media = getattr(message, message.media.value, None)
+    return media if hasattr(media, 'file_unique_id') else None
+
+def probe_complete(info: Dict[str, Any]) -> bool:
+    """Whether a probe has everything /mi reports"""
+    return bool(info.get('streams')) and 'duration' in info.get('format', {})
+
+async def probe_partial(client, message, media) -> Optional[Dict[str, Any]]:
+    """Probe telegram media from its first and last chunks only
+    
+    The chunks are written at their real offsets into a sparse file of the
+    full size, so ffprobe sees correct positions without the middle being
+    downloaded. Returns None when the partial data is not enough.
+    """
+    chunk_size = 1024 * 1024
+    file_size = getattr(media, 'file_size', 0) or 0
+    head = Config.PROBE_HEAD_CHUNKS
+    tail = Config.PROBE_TAIL_CHUNKS
+    total_chunks = -(-file_size // chunk_size)
+    
+    if total_chunks <= head + tail:
+        return None
+        
+    os.makedirs(Config.TEMP_PATH, exist_ok=True)
+    path = os.path.join(Config.TEMP_PATH, f"probe_{media.file_unique_id}")
+    
+    try:
+        with open(path, 'wb') as f:
+            f.truncate(file_size)
+            async for chunk in client.stream_media(message, limit=head):
+                f.write(chunk)
+                
+        try:
+            info = await run_ffprobe(path)
+            if probe_complete(info):
+                return info
+        except ProbeError:
+            pass
+            
+        # Containers like mp4 may keep their index at the end of the file
+        with open(path, 'r+b') as f:
+            f.seek((total_chunks - tail) * chunk_size)
+            async for chunk in client.stream_media(message, limit=tail, offset=-tail):
+                f.write(chunk)
+                
+        try:
+            info = await run_ffprobe(path)
+            if probe_complete(info):
+                return info
+        except ProbeError:
+            pass
+        return None
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+async def url_headers(session: aiohttp.ClientSession, url: str) -> Dict[str, str]:
+    """Fetch the response headers of a remote file without its body"""
+    timeout = aiohttp.ClientTimeout(total=Config.PROBE_URL_TIMEOUT)
+    try:
+        async with session.head(url, allow_redirects=True, timeout=timeout) as resp:
+            status, headers = resp.status, dict(resp.headers)
+        if status in (403, 405):
+            # Some servers refuse HEAD, a one byte range costs the same
+            async with session.get(url, headers={'Range': 'bytes=0-0'}, timeout=timeout) as resp:
+                status, headers = resp.status, dict(resp.headers)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise ProbeError(f"url not reachable: {e or type(e).__name__}")
+        
+    if status >= 400:
+        raise ProbeError(f"url returned http {status}")
+    return headers
+
+async def probe_url(url: str, headers: Dict[str, str]) -> Dict[str, Any]:
+    """Probe remote media, ffprobe seeks with http range requests instead of downloading it"""
+    args = [
+        '-rw_timeout', str(Config.PROBE_URL_TIMEOUT * 1000000),
+        '-probesize', str(Config.PROBE_URL_MAX_BYTES)
+    ]
+    try:
+        info = await asyncio.wait_for(run_ffprobe(url, args), timeout=Config.PROBE_URL_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise ProbeError(f"probe timed out after {Config.PROBE_URL_TIMEOUT}s")
+        
+    # Content-Range carries the full size when the fallback range request was used
+    size = headers.get('Content-Range', '').rpartition('/')[2] or headers.get('Content-Length')
+    if size and size.isdigit() and 'size' not in info.get('format', {}):
+        info.setdefault('format', {})['size'] = size
+    return info
+
+class ProbeCache:
+    """In-memory LRU in front of a mongo or on-disk store of probe results"""
+    
+    def __init__(self, db=None):
+        self.db = db
+        self.size = Config.PROBE_CACHE_SIZE
+        self.path = os.path.join(Config.CACHE_PATH, "probe")
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        
+    @staticmethod
+    def file_key(path: str) -> str:
+        """Identity of a local file, changes whenever the file is rewritten"""
+        st = os.stat(path)
+        return f"file:{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+        
+    # The same keys as the store, see filestore.url_key
+    url_key = staticmethod(url_key)
+    media_key = staticmethod(media_key)
+    
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Look a probe result up, promoting persistent hits into memory"""
+        info = self._memory.get(key)
+        if info is not None:
+            self._memory.move_to_end(key)
+            return info
+            
+        if self.db and self.db.db is not None:
+            info = await self.db.get_probe(key)
+        else:
+            info = await asyncio.get_running_loop().run_in_executor(None, self._read, key)
+            
+        if info is not None:
+            self._remember(key, info)
+        return info
+        
+    async def set(self, key: str, info: Dict[str, Any]):
+        """Store a probe result in every tier"""
+        self._remember(key, info)
+        if self.db and self.db.db is not None:
+            await self.db.set_probe(key, info)
+        else:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, key, info)
+            
+    async def probe(self, path: str, key: Optional[str] = None) -> Dict[str, Any]:
+        """Probe a local file, reusing a cached result when the file is unchanged"""
+        key = key or self.file_key(path)
+        info = await self.get(key)
+        if info is None:
+            info = await run_ffprobe(path)
+            await self.set(key, info)
+        return info
+        
+    def _remember(self, key: str, info: Dict[str, Any]):
+        self._memory[key] = info
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.size:
+            self._memory.popitem(last=False)
+            
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, hashlib.sha1(key.encode()).hexdigest() + ".json")
+        
+    def _read(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._file(key), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+            
+    def _write(self, key: str, info: Dict[str, Any]):
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            tmp = self._file(key) + ".tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(info, f)
+            os.replace(tmp, self._file(key))
+            self._prune()
+        except OSError as e:
+            logger.error(f"error writing probe cache: {e}")
+            
+    def _prune(self):
+        """Drop the oldest on-disk entries beyond the persistent limit"""
+        entries = os.listdir(self.path)
+        if len(entries) <= Config.PROBE_CACHE_FILES:
+            return
+        paths = [os.path.join(self.path, name) for name in entries]
+        paths.sort(key=lambda p: os.stat(p).st_mtime)
+        for path in paths[:len(paths) - Config.PROBE_CACHE_FILES]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
\ No newline at end of file
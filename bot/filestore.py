@@ -0,0 +1,262 @@
+"""
+Content addressed store of fetched files
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# Seconds changes are collected before the index is written, a burst of hits saves once
+SAVE_DELAY = 5
+
+DEFAULT_PORTS = {'http': 80, 'https': 443, 'ftp': 21}
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a url, case of scheme and host, default ports, query order and fragments don't matter"""
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    if parts.username:
+        host = f"{parts.username}@{host}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, parts.path or '/', query, ''))
+
+def url_key(url: str, headers: Dict[str, str]) -> Optional[str]:
+    """Identity of a remote file, None when the server gives no validator to trust
+    
+    Shared by the store and the probe cache so one download has one key.
+    """
+    validator = headers.get('ETag') or headers.get('Last-Modified')
+    if not validator:
+        return None
+    return f"url:{normalize_url(url)}:{validator}"
+
+def media_key(media) -> str:
+    """Identity of a telegram file"""
+    return f"tg:{media.file_unique_id}"
+
+def sha256_file(path: str) -> str:
+    """Hash a file in 1 MiB blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def link_or_copy(source: str, destination: str):
+    """Hardlink a file, copying only when both sides are on different filesystems"""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+def free_name(directory: str, name: str) -> str:
+    """A path for name in directory that does not exist yet"""
+    stem, extension = os.path.splitext(name)
+    path = os.path.join(directory, name)
+    counter = 1
+    while os.path.lexists(path):
+        path = os.path.join(directory, f"{stem}.{counter}{extension}")
+        counter += 1
+    return path
+
+class FileStore:
+    """Fetched files kept by sha256 and found again by url or telegram file id
+    
+    Objects live under STORE_PATH/objects named by their hash and are
+    hardlinked into job folders, so a hit copies nothing while both are on
+    one filesystem. An object whose size or mtime changed was written to
+    through a link and is dropped. The store holds at most STORE_SIZE bytes,
+    least recently used objects are evicted first.
+    """
+    
+    def __init__(self):
+        self.path = Config.STORE_PATH
+        self.objects_path = os.path.join(self.path, "objects")
+        self.index_path = os.path.join(self.path, "index.json")
+        self.keys: Dict[str, str] = {}
+        self.objects: Dict[str, Dict[str, Any]] = {}
+        self._lock = asyncio.Lock()
+        self._save_task: Optional[asyncio.Task] = None
+        
+    @property
+    def enabled(self) -> bool:
+        return Config.STORE_SIZE > 0
+        
+    @property
+    def size(self) -> int:
+        """Bytes held by stored objects"""
+        return sum(obj['size'] for obj in self.objects.values())
+        
+    def start(self):
+        """Load the index"""
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                data = json.load(f)
+            self.keys = data['keys']
+            self.objects = data['objects']
+        except (OSError, ValueError, KeyError):
+            pass
+            
+    async def stop(self):
+        """Write out a pending index save"""
+        if self._save_task and not self._save_task.done():
+            self._save_task.cancel()
+            await self._save()
+            
+    url_key = staticmethod(url_key)
+    media_key = staticmethod(media_key)
+    
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """Stored object for a key, None on a miss or when the object was modified"""
+        if not self.enabled or key not in self.keys:
+            return None
+        digest = self.keys[key]
+        obj = self.objects.get(digest)
+        if not obj or not self._intact(digest, obj):
+            self._drop(digest)
+            self._changed()
+            return None
+        return dict(obj, sha256=digest)
+        
+    async def materialize(self, key: str, directory: str, name: Optional[str] = None,
+                          reuse: bool = False) -> Optional[str]:
+        """Link a stored object into a folder and return its path, None on a miss
+        
+        With reuse an existing link to the same object is handed back instead
+        of a new one, only for callers that never delete or move the result.
+        """
+        obj = self.lookup(key)
+        if not obj:
+            return None
+        source = self._object(obj['sha256'])
+        target = os.path.join(directory, name or obj['name'])
+        
+        def place():
+            os.makedirs(directory, exist_ok=True)
+            if reuse and os.path.exists(target) and os.path.samefile(source, target):
+                return target
+            path = free_name(directory, name or obj['name'])
+            link_or_copy(source, path)
+            return path
+            
+        try:
+            path = await asyncio.get_running_loop().run_in_executor(None, place)
+        except OSError as e:
+            logger.error(f"error materializing {key}: {e}")
+            return None
+        self.objects[obj['sha256']]['used'] = time.time()
+        self._changed()
+        logger.info(f"store hit for {key}")
+        return path
+        
+    async def add(self, key: str, path: str, name: Optional[str] = None) -> Optional[str]:
+        """Hash a finished file and keep it under key, returns its sha256"""
+        if not self.enabled or not os.path.isfile(path):
+            return None
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            try:
+                digest = await loop.run_in_executor(None, sha256_file, path)
+                obj = self.objects.get(digest)
+                if not obj or not self._intact(digest, obj):
+                    obj = await loop.run_in_executor(None, self._insert, digest, path)
+                    self.objects[digest] = obj
+            except OSError as e:
+                logger.error(f"error storing {path}: {e}")
+                return None
+            obj['name'] = name or os.path.basename(path)
+            obj['used'] = time.time()
+            self.keys[key] = digest
+            self._evict()
+            self._changed()
+        return digest
+        
+    async def verify(self) -> Tuple[int, int]:
+        """Rehash every object, drops the ones whose content changed and returns (checked, dropped)"""
+        loop = asyncio.get_running_loop()
+        dropped = 0
+        async with self._lock:
+            for digest in list(self.objects):
+                try:
+                    intact = await loop.run_in_executor(None, sha256_file, self._object(digest)) == digest
+                except OSError:
+                    intact = False
+                if not intact:
+                    logger.warning(f"store object {digest} is corrupt")
+                    self._drop(digest)
+                    dropped += 1
+            self._changed()
+        return len(self.objects) + dropped, dropped
+        
+    def _object(self, digest: str) -> str:
+        return os.path.join(self.objects_path, digest[:2], digest)
+        
+    def _insert(self, digest: str, path: str) -> Dict[str, Any]:
+        target = self._object(digest)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.lexists(target):
+            os.remove(target)
+        link_or_copy(path, target)
+        st = os.stat(target)
+        return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        
+    def _intact(self, digest: str, obj: Dict[str, Any]) -> bool:
+        try:
+            st = os.stat(self._object(digest))
+        except OSError:
+            return False
+        return st.st_size == obj['size'] and st.st_mtime_ns == obj['mtime_ns']
+        
+    def _drop(self, digest: str):
+        self.objects.pop(digest, None)
+        for key in [key for key, value in self.keys.items() if value == digest]:
+            del self.keys[key]
+        try:
+            os.remove(self._object(digest))
+        except OSError:
+            pass
+            
+    def _evict(self):
+        total = self.size
+        for digest, obj in sorted(self.objects.items(), key=lambda item: item[1].get('used', 0)):
+            if total <= Config.STORE_SIZE:
+                break
+            total -= obj['size']
+            self._drop(digest)
+            logger.info(f"evicted {obj.get('name')} from the store")
+            
+    def _changed(self):
+        if not self._save_task or self._save_task.done():
+            self._save_task = asyncio.create_task(self._save_later())
+            
+    async def _save_later(self):
+        await asyncio.sleep(SAVE_DELAY)
+        await self._save()
+        
+    async def _save(self):
+        # Objects are copied here, the executor serialises a snapshot while the index moves on
+        data = {'keys': dict(self.keys), 'objects': {digest: dict(obj) for digest, obj in self.objects.items()}}
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, data)
+        except OSError as e:
+            logger.error(f"error saving store index: {e}")
+            
+    def _write(self, data: Dict[str, Any]):
+        os.makedirs(self.path, exist_ok=True)
+        tmp = self.index_path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp, self.index_path)
\ No newline at end of file
@@ -0,0 +1,289 @@
+"""
+Registry of running work across plugins
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import secrets
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# Resume handlers by descriptor kind, plugins add theirs with @resumable
+RESUMERS: Dict[str, Callable[[Any, Dict[str, Any]], Awaitable]] = {}
+
+def resumable(kind: str):
+    """Register the coroutine that picks a persisted job of this kind up after a restart"""
+    def decorator(func):
+        RESUMERS[kind] = func
+        return func
+    return decorator
+
+async def resume_message(client, descriptor: Dict[str, Any], text: str):
+    """Status message of a resumed job, a new one is sent when the old one is gone"""
+    message = await client.get_messages(descriptor["chat_id"], descriptor["message_id"])
+    if message.empty:
+        message = await client.send_message(descriptor["chat_id"], text)
+        descriptor["message_id"] = message.id
+    else:
+        client.schedule_edit(message, text)
+    return message
+
+class JobStore:
+    """Persisted job descriptors, kept in mongo when configured and in a json file otherwise"""
+    
+    def __init__(self, db=None):
+        self.db = db
+        self.path = os.path.join(Config.CACHE_PATH, "jobs.json")
+        self.descriptors: Dict[str, Dict[str, Any]] = {}
+        self._lock = asyncio.Lock()
+        self._writes = set()
+        
+    async def load(self) -> List[Dict[str, Any]]:
+        """Read every descriptor left by the previous run"""
+        if self.db:
+            descriptors = await self.db.get_jobs()
+        else:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    descriptors = json.load(f)
+            except (OSError, ValueError):
+                descriptors = []
+        self.descriptors = {descriptor["key"]: descriptor for descriptor in descriptors if "key" in descriptor}
+        return list(self.descriptors.values())
+        
+    def put(self, descriptor: Dict[str, Any]):
+        """Save or replace a descriptor"""
+        self.descriptors[descriptor["key"]] = descriptor
+        self._schedule(descriptor["key"])
+        
+    def delete(self, key: str):
+        """Forget a descriptor"""
+        if self.descriptors.pop(key, None) is not None:
+            self._schedule(key)
+            
+    async def flush(self):
+        """Wait for pending writes"""
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+            
+    def _schedule(self, key: str):
+        # Writes queue on the lock in order, each one stores the latest state of its key
+        task = asyncio.create_task(self._write(key))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+        
+    async def _write(self, key: str):
+        async with self._lock:
+            if self.db:
+                descriptor = self.descriptors.get(key)
+                if descriptor is not None:
+                    await self.db.save_job(key, dict(descriptor))
+                else:
+                    await self.db.delete_job(key)
+                return
+            try:
+                os.makedirs(Config.CACHE_PATH, exist_ok=True)
+                tmp = self.path + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(list(self.descriptors.values()), f)
+                os.replace(tmp, self.path)
+            except (OSError, TypeError, ValueError) as e:
+                logger.error(f"error saving jobs: {e}")
+
+class Job:
+    """A unit of work some plugin started, with whatever control it offers"""
+    
+    def __init__(self, job_id: int, kind: str, name: str, owner: Optional[int] = None,
+                 cancel: Optional[Callable[[], Any]] = None,
+                 set_priority: Optional[Callable[[int], Any]] = None,
+                 descriptor: Optional[Dict[str, Any]] = None):
+        self.id = job_id
+        self.kind = kind
+        self.name = name
+        self.owner = owner
+        self.state = "running"
+        self.started = time.time()
+        self.bytes_done = 0
+        self.bytes_total = 0
+        self.pid: Optional[int] = None
+        self.priority = 0
+        self.detail = ""
+        self.descriptor = descriptor
+        self._cancel = cancel
+        self._set_priority = set_priority
+        
+    @property
+    def can_cancel(self) -> bool:
+        return self._cancel is not None
+        
+    @property
+    def can_prioritize(self) -> bool:
+        return self._set_priority is not None
+        
+    def update(self, **fields):
+        """Set progress fields such as bytes_done, bytes_total, pid, state or detail"""
+        for key, value in fields.items():
+            setattr(self, key, value)
+
+class JobManager:
+    """Keeps every running job so it can be listed, cancelled, reprioritized or resumed
+    
+    Jobs registered with a descriptor are persisted until they finish. The
+    descriptor holds whatever its resumer needs to start the work again and
+    is handed to the resumer of its kind on the next start.
+    """
+    
+    def __init__(self, store: Optional[JobStore] = None):
+        self.store = store or JobStore()
+        self._jobs: Dict[int, Job] = {}
+        self._ids = itertools.count(1)
+        self._suspended = False
+        self._resumed = set()
+        
+    def register(self, kind: str, name: str, owner: Optional[int] = None,
+                 cancel: Optional[Callable[[], Any]] = None,
+                 set_priority: Optional[Callable[[int], Any]] = None,
+                 descriptor: Optional[Dict[str, Any]] = None) -> Job:
+        """Add a job, the caller must finish() it"""
+        job = Job(next(self._ids), kind, name, owner, cancel, set_priority, descriptor)
+        if descriptor is not None:
+            # A resumed job keeps the key it was stored under
+            if not descriptor.get("key"):
+                descriptor["key"] = secrets.token_hex(8)
+            descriptor.setdefault("kind", kind)
+            self.store.put(descriptor)
+        self._jobs[job.id] = job
+        return job
+        
+    def persist(self, job: Job, **changes):
+        """Update the stored descriptor of a job, e.g. once a stage completed"""
+        if job.descriptor is None or self._suspended:
+            return
+        job.descriptor.update(changes)
+        self.store.put(job.descriptor)
+        
+    def finish(self, job: Job, state: str = "done"):
+        """Drop a job from the registry"""
+        job.state = state
+        self._jobs.pop(job.id, None)
+        # Work torn down by a shutdown stays stored so the next start resumes it
+        if job.descriptor is not None and not self._suspended:
+            self.store.delete(job.descriptor["key"])
+            
+    @contextmanager
+    def track(self, kind: str, name: str, owner: Optional[int] = None,
+              cancel: Optional[Callable[[], Any]] = None,
+              set_priority: Optional[Callable[[int], Any]] = None) -> Iterator[Job]:
+        """Register a job for the duration of a block, the final state follows how the block exits"""
+        job = self.register(kind, name, owner, cancel, set_priority)
+        state = "done"
+        try:
+            yield job
+        except asyncio.CancelledError:
+            state = "cancelled"
+            raise
+        except Exception:
+            state = "failed"
+            raise
+        finally:
+            self.finish(job, state)
+            
+    async def run(self, func: Callable[[Job], Awaitable[Any]], kind: str, name: str,
+                  owner: Optional[int] = None, descriptor: Optional[Dict[str, Any]] = None) -> Any:
+        """Run func(job) in its own task so /cancel never cancels the calling handler
+        
+        Returns None when the job was cancelled through the manager.
+        """
+        task: Optional[asyncio.Task] = None
+        job = self.register(kind, name, owner, cancel=lambda: task.cancel(), descriptor=descriptor)
+        task = asyncio.create_task(func(job))
+        state = "done"
+        try:
+            return await task
+        except asyncio.CancelledError:
+            state = "cancelled"
+            if asyncio.current_task().cancelling():
+                task.cancel()
+                raise
+            return None
+        except Exception:
+            state = "failed"
+            raise
+        finally:
+            self.finish(job, state)
+            
+    def get(self, job_id: int) -> Optional[Job]:
+        """Find a running job by id"""
+        return self._jobs.get(job_id)
+        
+    def list(self, owner: Optional[int] = None) -> List[Job]:
+        """Running jobs, oldest first"""
+        return [job for job in self._jobs.values() if owner is None or job.owner == owner]
+        
+    async def cancel(self, job_id: int) -> bool:
+        """Ask a job to stop"""
+        job = self._jobs.get(job_id)
+        if not job or not job.can_cancel:
+            return False
+        result = job._cancel()
+        if asyncio.iscoroutine(result):
+            result = await result
+        job.state = "cancelling"
+        return result is not False
+        
+    async def set_priority(self, job_id: int, priority: int) -> bool:
+        """Move a job within whatever queue it waits in"""
+        job = self._jobs.get(job_id)
+        if not job or not job.can_prioritize:
+            return False
+        result = job._set_priority(priority)
+        if asyncio.iscoroutine(result):
+            result = await result
+        if result is False:
+            return False
+        job.priority = priority
+        return True
+        
+    async def resume(self, client):
+        """Hand every descriptor of the previous run to its resumer"""
+        descriptors = await self.store.load()
+        for descriptor in descriptors:
+            task = asyncio.create_task(self._resume(client, descriptor))
+            self._resumed.add(task)
+            task.add_done_callback(self._resumed.discard)
+        if descriptors:
+            logger.info(f"resuming {len(descriptors)} jobs")
+            
+    async def _resume(self, client, descriptor: Dict[str, Any]):
+        key = descriptor["key"]
+        resumer = RESUMERS.get(descriptor.get("kind"))
+        try:
+            if resumer:
+                await resumer(client, descriptor)
+            else:
+                logger.warning(f"no resumer for {descriptor.get('kind')} job {key}")
+        except Exception as e:
+            logger.error(f"resuming {descriptor.get('kind')} job {key} failed: {e}")
+        finally:
+            # Resumers re-register their work under the same key, anything else is done
+            live = any(job.descriptor and job.descriptor.get("key") == key for job in self._jobs.values())
+            if not live and not self._suspended:
+                self.store.delete(key)
+                
+    @property
+    def suspended(self) -> bool:
+        """Whether the bot is shutting down, jobs torn down now resume on the next start"""
+        return self._suspended
+        
+    async def suspend(self):
+        """Stop forgetting descriptors before a shutdown tears running work down"""
+        self._suspended = True
+        await self.store.flush()
\ No newline at end of file
@@ -0,0 +1,98 @@
+"""
+mkvmerge runner with machine readable progress
+"""
+
+import asyncio
+import logging
+import os
+import re
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_PROGRESS_RE = re.compile(r"#GUI#progress\s+(\d+)%")
+_LINE_SPLIT_RE = re.compile(rb"[\r\n]+")
+
+class MkvmergeError(Exception):
+    """mkvmerge exited with an error"""
+
+async def run_mkvmerge(cmd: List[str], on_progress: Optional[Callable[[int], Awaitable]] = None,
+                       on_start: Optional[Callable[[int], Any]] = None) -> Tuple[int, str]:
+    """Run mkvmerge in gui mode, returns the exit code and the last message lines"""
+    if '--gui-mode' not in cmd:
+        cmd = [cmd[0], '--gui-mode', *cmd[1:]]
+        
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT
+    )
+    if on_start:
+        on_start(process.pid)
+        
+    # Only the tail of the log is kept, progress lines are consumed as they arrive
+    messages = deque(maxlen=20)
+    last_percent = -1
+    pending = b''
+    
+    try:
+        while True:
+            chunk = await process.stdout.read(4096)
+            if not chunk:
+                break
+            lines = _LINE_SPLIT_RE.split(pending + chunk)
+            pending = lines.pop()
+            for raw in lines:
+                line = raw.decode('utf-8', errors='ignore').strip()
+                if not line:
+                    continue
+                match = _PROGRESS_RE.match(line)
+                if not match:
+                    messages.append(line.replace('#GUI#', ''))
+                    continue
+                percent = int(match.group(1))
+                if percent != last_percent and on_progress:
+                    last_percent = percent
+                    await on_progress(percent)
+        if pending.strip():
+            messages.append(pending.decode('utf-8', errors='ignore').strip())
+        await process.wait()
+    except asyncio.CancelledError:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+        
+    return process.returncode, '\n'.join(messages)
+
+def split_name(output: str, index: int) -> str:
+    """Name mkvmerge gives the index-th file of a split output, counting from 1"""
+    stem, extension = os.path.splitext(output)
+    return f"{stem}-{index:03d}{extension}"
+
+async def split_parts(source: str, output: str, size: int) -> AsyncIterator[str]:
+    """Split a file at key frames into parts of at most size bytes
+    
+    Each part is yielded as soon as mkvmerge has moved on to the next one,
+    so callers can consume early parts while later ones are still written.
+    """
+    task = asyncio.create_task(run_mkvmerge(['mkvmerge', '-o', output, '--split', f'size:{size}', source]))
+    index = 1
+    try:
+        while True:
+            if os.path.exists(split_name(output, index + 1)) or (task.done() and os.path.exists(split_name(output, index))):
+                # A failed split leaves nothing worth handing out
+                if task.done() and task.result()[0] not in (0, 1):
+                    break
+                yield split_name(output, index)
+                index += 1
+            elif task.done():
+                break
+            else:
+                await asyncio.sleep(1)
+        returncode, log = await task
+        if returncode not in (0, 1):
+            raise MkvmergeError(log.splitlines()[-1] if log else f"mkvmerge exited with {returncode}")
+    finally:
+        task.cancel()
\ No newline at end of file
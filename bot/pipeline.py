@@ -0,0 +1,178 @@
+"""
+Stage graph runner for multi step jobs
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+STATE_ICONS = {
+    "waiting": "⏳",
+    "running": "🔄",
+    "done": "✅",
+    "failed": "❌",
+    "skipped": "⏭",
+    "cancelled": "🚫"
+}
+
+class StageError(Exception):
+    """A stage failed with a message meant for the user"""
+
+class Stage:
+    """One step of a pipeline, runs once all of its dependencies are done"""
+    
+    def __init__(self, pipeline: 'Pipeline', name: str, func: Callable[..., Awaitable[Any]],
+                 deps: Sequence[str] = (), label: Optional[str] = None):
+        self.pipeline = pipeline
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.label = label or name
+        self.state = "waiting"
+        self.detail = ""
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        
+    async def report(self, detail: str):
+        """Update the progress line of the stage"""
+        self.detail = detail
+        await self.pipeline.notify()
+        
+    def render(self) -> str:
+        """Status line of the stage"""
+        line = f"{STATE_ICONS[self.state]} {self.label}"
+        if self.detail:
+            line += f" - {self.detail}"
+        return line
+
+class Pipeline:
+    """Runs a graph of stages, each one starts as soon as the stages it needs are done
+    
+    Stage functions get the stage followed by the results of their dependencies
+    in declaration order. Stages of different pipelines share nothing, so their
+    downloads, muxes and uploads overlap freely.
+    """
+    
+    _ids = itertools.count(1)
+    
+    def __init__(self, name: str, on_update: Optional[Callable[['Pipeline'], Awaitable]] = None):
+        self.id = next(self._ids)
+        self.name = name
+        self.on_update = on_update
+        self.stages: Dict[str, Stage] = {}
+        self.started: Optional[float] = None
+        
+    def add(self, name: str, func: Callable[..., Awaitable[Any]], deps: Sequence[str] = (),
+            label: Optional[str] = None) -> Stage:
+        """Declare a stage, dependencies must already be declared"""
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"unknown stage dependency {dep}")
+        stage = Stage(self, name, func, deps, label)
+        self.stages[name] = stage
+        return stage
+        
+    def restore(self, results: Dict[str, Any]):
+        """Mark stages done with results of an earlier run, a stage is only restored with all its inputs"""
+        for name, stage in self.stages.items():
+            if name in results and all(self.stages[dep].state == "done" for dep in stage.deps):
+                stage.state = "done"
+                stage.result = results[name]
+                stage.detail = "done before restart"
+                
+    @property
+    def state(self) -> str:
+        """Overall state derived from the stages"""
+        states = {stage.state for stage in self.stages.values()}
+        for state in ("running", "waiting", "failed", "cancelled"):
+            if state in states:
+                return state
+        return "done"
+        
+    async def run(self) -> Dict[str, Any]:
+        """Run every stage and return their results, raises the first stage error"""
+        self.started = time.monotonic()
+        for stage in self.stages.values():
+            stage.task = asyncio.create_task(self._run_stage(stage))
+        try:
+            await asyncio.gather(*(stage.task for stage in self.stages.values()), return_exceptions=True)
+        except asyncio.CancelledError:
+            self.cancel()
+            await asyncio.gather(*(stage.task for stage in self.stages.values()), return_exceptions=True)
+            raise
+        finally:
+            # A task cancelled before its first step never ran _run_stage
+            for stage in self.stages.values():
+                if stage.state == "waiting":
+                    stage.state = "cancelled"
+            await self.notify()
+            
+        failed = [stage for stage in self.stages.values() if stage.state == "failed"]
+        if failed:
+            raise StageError(f"{failed[0].label}: {failed[0].error}")
+        if any(stage.state == "cancelled" for stage in self.stages.values()):
+            raise asyncio.CancelledError()
+        return {name: stage.result for name, stage in self.stages.items()}
+        
+    def cancel(self):
+        """Cancel every stage that has not finished"""
+        for stage in self.stages.values():
+            if stage.task and not stage.task.done():
+                stage.task.cancel()
+                
+    async def notify(self):
+        """Tell the owner something changed"""
+        if self.on_update:
+            try:
+                await self.on_update(self)
+            except Exception as e:
+                logger.error(f"pipeline {self.id} update failed: {e}")
+                
+    def render(self) -> str:
+        """Status lines of all stages"""
+        return "\n".join(stage.render() for stage in self.stages.values())
+        
+    def _abort(self, failed: Stage):
+        # The result can no longer be produced, stop the remaining work early
+        for stage in self.stages.values():
+            if stage is not failed and stage.task and not stage.task.done():
+                stage.task.cancel()
+                
+    async def _run_stage(self, stage: Stage):
+        if stage.state == "done":
+            return
+        try:
+            deps = [self.stages[dep] for dep in stage.deps]
+            if deps:
+                # wait() rather than gather() so cancelling this stage leaves its inputs alone
+                await asyncio.wait([dep.task for dep in deps])
+            if any(dep.state != "done" for dep in deps):
+                stage.state = "skipped" if all(dep.state != "cancelled" for dep in deps) else "cancelled"
+                return
+                
+            stage.state = "running"
+            stage.started = time.monotonic()
+            await self.notify()
+            stage.result = await stage.func(stage, *(dep.result for dep in deps))
+            stage.state = "done"
+        except asyncio.CancelledError:
+            stage.state = "cancelled"
+        except StageError as e:
+            stage.state = "failed"
+            stage.error = str(e)
+            self._abort(stage)
+        except Exception as e:
+            logger.error(f"pipeline {self.id} stage {stage.name} failed: {e}")
+            stage.state = "failed"
+            stage.error = str(e) or type(e).__name__
+            self._abort(stage)
+        finally:
+            stage.finished = time.monotonic()
+        await self.notify()
\ No newline at end of file
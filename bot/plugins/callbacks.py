@@ -2,6 +2,7 @@
 Callback query handlers
 """
 
+import asyncio
 import os
 import platform
 import psutil
@@ -9,6 +10,11 @@ from pyrogram import Client, filters
 from pyrogram.types import CallbackQuery
 
 from bot.config import Config
+from bot.jobs import resumable
+from bot.plugins.gdrive import glist_callback
+
+# Holds the restart task so it isn't garbage collected
+_RESTART = set()
 
 @Client.on_callback_query()
 async def callback_handler(client: Client, callback_query: CallbackQuery):
@@ -22,7 +28,14 @@ async def callback_handler(client: Client, callback_query: CallbackQuery):
         await callback_query.answer("owner only", show_alert=True)
         return
         
-    if data == "help":
+    if data.startswith("glist_"):
+        if not client.is_authorized(user_id, callback_query.message.chat.id):
+            await callback_query.answer("unauthorized access", show_alert=True)
+            return
+        await glist_callback(client, callback_query)
+        return
+        
+    elif data == "help":
         help_text = """**available commands:**
 
 **terminal & system:**
@@ -32,10 +45,26 @@ async def callback_handler(client: Client, callback_query: CallbackQuery):
 **media processing:**
 • `/mi <file/url>` - get media information
 • `/mux` - video muxing operations
+• `/batchmux <video_dir> <tracks_dir>` - mux a season, episodes paired by number
+• `/muxqueue` - list mux jobs, `/muxcancel <id>` to cancel
+• `/pipe <video> [tracks] [-o out.mkv] [-up] [-tg]` - fetch, mux and upload in one go
+• `/pipecancel <id>` - cancel a pipeline
 
 **download & upload:**
 • `/dl <url>` - download with aria2
-• `/gup <file>` - upload to google drive
+• `/dlpause`, `/dlresume`, `/dlcancel <gid>` - control a download
+• `/gup <files/dirs/globs>` - upload to google drive
+• `/tgup <file>` - send a file to this chat, split if too large
+• `/glist [filter]` - browse uploaded files
+
+**disk:**
+• `/disk` - free space, reservations and queued jobs
+• `/pin`, `/unpin <path>` - keep a download from being evicted
+• `/store [verify]` - files reused across downloads
+
+**jobs:**
+• `/jobs` - list running downloads, muxes, uploads and commands
+• `/cancel <id>` - stop a job, `/prio <id> <n>` - reorder a queued one
 
 **authorization (owner only):**
 • `/auth` - manage authorized users/groups
@@ -141,9 +170,34 @@ use /help to see available commands"""
         await callback_query.edit_message_text(system_text)
         
     elif data == "settings_restart":
-        await callback_query.answer("restart functionality not implemented", show_alert=True)
+        if _RESTART:
+            await callback_query.answer("restart already in progress", show_alert=True)
+            return
+        await callback_query.answer("restarting...")
+        await callback_query.edit_message_text(
+            f"**restarting bot...**\n\n"
+            f"`{len([job for job in client.jobs.list() if job.descriptor])}` running jobs resume after the restart"
+        )
+        # The marker is picked up by resume_restart once the new process is up
+        client.jobs.store.put({
+            'key': 'restart',
+            'kind': 'restart',
+            'chat_id': callback_query.message.chat.id,
+            'message_id': callback_query.message.id
+        })
+        # Stopping waits for handlers to return, so it can't run in this one
+        _RESTART.add(asyncio.create_task(client.reboot()))
+        return
         
     else:
         await callback_query.answer("unknown callback", show_alert=True)
         
-    await callback_query.answer()
\ No newline at end of file
+    await callback_query.answer()
+
+@resumable("restart")
+async def resume_restart(client: Client, descriptor):
+    """Confirm a restart requested from /settings"""
+    try:
+        await client.edit_message_text(descriptor['chat_id'], descriptor['message_id'], "**bot restarted**")
+    except Exception:
+        pass
\ No newline at end of file
@@ -0,0 +1,130 @@
+"""
+Disk space status and eviction pins
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import time
+from pyrogram import Client, filters
+from pyrogram.types import Message
+
+from bot.config import Config
+from bot.diskspace import existing_parent
+from bot.progress import format_eta
+
+logger = logging.getLogger(__name__)
+
+def auth_required(func):
+    """Decorator to check authorization"""
+    async def wrapper(client: Client, message: Message):
+        if not client.is_authorized(message.from_user.id, message.chat.id):
+            await message.reply_text("unauthorized access")
+            return
+        return await func(client, message)
+    return wrapper
+
+@Client.on_message(filters.command("disk"))
+@auth_required
+async def disk_command(client: Client, message: Message):
+    """Show free space, reservations, queued jobs and eviction candidates"""
+    
+    disk = client.disk
+    result = "**disk space**\n\n"
+    
+    for label, path in (("downloads", Config.DOWNLOAD_PATH), ("temp", Config.TEMP_PATH)):
+        usage = shutil.disk_usage(existing_parent(path))
+        result += (
+            f"**{label}:** `{path}`\n"
+            f"    `{format_bytes(usage.free)}` free of `{format_bytes(usage.total)}`, "
+            f"`{format_bytes(max(0, disk.available(path)))}` unclaimed\n"
+        )
+        
+    if disk.reservations:
+        result += f"\n**reserved** (`{len(disk.reservations)}`):\n"
+        for reservation in disk.reservations[:10]:
+            result += f"• `{reservation.name[:50]}` - `{format_bytes(reservation.outstanding)}` left of `{format_bytes(reservation.size)}`\n"
+            
+    waiting = disk.waiting
+    if waiting:
+        result += f"\n**waiting for space** (`{len(waiting)}`):\n"
+        for position, reservation in enumerate(waiting[:10], 1):
+            result += f"{position}. `{reservation.name[:50]}` - `{format_bytes(reservation.size)}`, {format_eta(time.time() - reservation.created)}\n"
+            
+    entries = await asyncio.get_running_loop().run_in_executor(None, disk.evictable)
+    if entries:
+        result += f"\n**evictable** (`{format_bytes(sum(size for _, size, _ in entries))}`):\n"
+        for used, size, path in entries[:10]:
+            result += f"• `{os.path.basename(path)[:50]}` - `{format_bytes(size)}`, unused {format_eta(time.time() - used)}\n"
+    elif not Config.DISK_EVICT_AGE:
+        result += "\n**eviction:** `disabled`\n"
+        
+    if disk.pins:
+        result += f"\n**pinned** (`{len(disk.pins)}`):\n"
+        for path in sorted(disk.pins)[:10]:
+            result += f"• `{path}`\n"
+            
+    await message.reply_text(result[:Config.MAX_MESSAGE_LENGTH])
+
+@Client.on_message(filters.command(["pin", "unpin"]))
+@auth_required
+async def pin_command(client: Client, message: Message):
+    """Protect a path from eviction or release it again"""
+    
+    action = message.command[0]
+    if len(message.command) < 2:
+        await message.reply_text(f"usage: `/{action} <path>`")
+        return
+        
+    path = message.text.split(None, 1)[1].strip()
+    
+    if action == "pin":
+        if not os.path.exists(path):
+            await message.reply_text(f"path not found: `{path}`")
+            return
+        client.disk.pin(path)
+        await message.reply_text(f"pinned `{os.path.abspath(path)}`\nit won't be evicted for disk space")
+    elif client.disk.unpin(path):
+        await message.reply_text(f"unpinned `{os.path.abspath(path)}`")
+    else:
+        await message.reply_text(f"`{path}` is not pinned")
+
+@Client.on_message(filters.command("store"))
+@auth_required
+async def store_command(client: Client, message: Message):
+    """Show the content store or rehash its objects"""
+    
+    store = client.store
+    if not store.enabled:
+        await message.reply_text("the content store is disabled, set `STORE_SIZE` to enable it")
+        return
+        
+    if len(message.command) > 1 and message.command[1] == "verify":
+        status_msg = await message.reply_text(f"verifying `{len(store.objects)}` stored files...")
+        checked, dropped = await store.verify()
+        await status_msg.edit_text(f"**store verified**\n\n**checked:** `{checked}`\n**corrupt, dropped:** `{dropped}`")
+        return
+        
+    result = (
+        f"**content store**\n\n"
+        f"**path:** `{store.path}`\n"
+        f"**files:** `{len(store.objects)}` under `{len(store.keys)}` keys\n"
+        f"**size:** `{format_bytes(store.size)}` of `{format_bytes(Config.STORE_SIZE)}`\n"
+    )
+    recent = sorted(store.objects.items(), key=lambda item: item[1].get('used', 0), reverse=True)[:10]
+    if recent:
+        result += "\n**recently used:**\n"
+        for digest, obj in recent:
+            result += f"• `{obj.get('name', digest)[:50]}` - `{format_bytes(obj['size'])}`, `{digest[:12]}`\n"
+    result += "\n`/store verify` rehashes every file"
+    
+    await message.reply_text(result)
+
+def format_bytes(bytes_size):
+    """Format bytes to human readable format"""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if bytes_size < 1024.0:
+            return f"{bytes_size:.1f} {unit}"
+        bytes_size /= 1024.0
+    return f"{bytes_size:.1f} TB"
\ No newline at end of file
@@ -3,13 +3,17 @@ Download manager plugin using aria2
 """
 
 import asyncio
-import json
 import logging
 import os
 from pyrogram import Client, filters
 from pyrogram.types import Message
 
+from bot.aria2 import Aria2Error
 from bot.config import Config
+from bot.diskspace import DiskSpaceError, admit_download, content_length
+from bot.ffprobe import ProbeError, url_headers
+from bot.jobs import resumable, resume_message
+from bot.progress import ProgressMessage, progress_text
 
 logger = logging.getLogger(__name__)
 
@@ -22,66 +26,306 @@ def auth_required(func):
         return await func(client, message)
     return wrapper
 
+# Keep references to background monitors so they aren't garbage collected
+_MONITORS = set()
+
 @Client.on_message(filters.command("dl"))
 @auth_required
 async def download_command(client: Client, message: Message):
-    """Download files using aria2"""
+    """Queue a download on the aria2 daemon"""
     
     if len(message.command) < 2:
-        await message.reply_text("usage: `/dl <url>`")
+        await message.reply_text("usage: `/dl [-c<connections>] <url>`")
+        return
+        
+    args = message.text.split()[1:]
+    connections = Config.ARIA2_CONNECTIONS
+    if args[0].startswith('-c') and args[0][2:].isdigit():
+        connections = int(args[0][2:])
+        args = args[1:]
+        
+    if not args:
+        await message.reply_text("usage: `/dl [-c<connections>] <url>`")
         return
         
-    url = message.text.split(None, 1)[1]
+    url = args[0]
     
     # Validate URL
     if not url.startswith(('http://', 'https://', 'ftp://', 'magnet:')):
         await message.reply_text("invalid url format")
         return
         
+    if not client.aria2 or not client.aria2.running:
+        await message.reply_text("aria2 daemon is not running")
+        return
+        
     status_msg = await message.reply_text(f"starting download...\n`{url}`")
     
-    try:
-        # Create aria2 command
-        cmd = [
-            'aria2c',
-            '--dir', Config.DOWNLOAD_PATH,
-            '--max-connection-per-server=16',
-            '--max-concurrent-downloads=1',
-            '--split=16',
-            '--min-split-size=1M',
-            '--continue=true',
-            '--summary-interval=1',
-            '--progress-summary-interval=1',
-            url
-        ]
-        
-        # Start aria2 process
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
+    options = {
+        'split': str(connections),
+        'max-connection-per-server': str(min(connections, 16))
+    }
+    
+    # Monitor in the background so the handler worker is freed immediately
+    task = asyncio.create_task(queue_download(client, status_msg, url, options, message.from_user.id))
+    _MONITORS.add(task)
+    task.add_done_callback(_MONITORS.discard)
+
+async def queue_download(client: Client, status_msg: Message, url: str, options: dict, owner: int = None):
+    """Wait until the download fits on disk, then hand it to aria2"""
+    
+    # Sizes a HEAD request reveals are admitted up front, the rest once aria2 learns them
+    size = 0
+    store_key = None
+    if url.startswith(('http://', 'https://')):
+        try:
+            headers = await url_headers(client.http, url)
+            size = content_length(headers)
+            store_key = client.store.url_key(url, headers)
+        except ProbeError:
+            pass
+            
+    # An unchanged file fetched before is linked from the store instead
+    path = await client.store.materialize(store_key, Config.DOWNLOAD_PATH, reuse=True) if store_key else None
+    if path:
+        await status_msg.edit_text(
+            f"**download completed** (from store)\n\n"
+            f"**file:** `{os.path.basename(path)}`\n"
+            f"**size:** `{format_bytes(os.path.getsize(path))}`\n"
+            f"**location:** `{Config.DOWNLOAD_PATH}`"
+        )
+        return
+        
+        
+    async def on_wait(position):
+        job.update(state="waiting for disk")
+        await client.schedule_edit(
+            status_msg,
+            f"**waiting for disk space**\n`{url}`\n\n"
+            f"**needs:** `{format_bytes(size)}`\n"
+            f"**position:** `{position}`"
         )
         
-        # Monitor download progress
-        while process.returncode is None:
-            try:
-                # Check if process is still running
-                await asyncio.wait_for(process.wait(), timeout=5)
-                break
-            except asyncio.TimeoutError:
-                # Update status message
-                await status_msg.edit_text(f"downloading...\n`{url}`")
+    try:
+        with client.jobs.track("download", url, owner, cancel=asyncio.current_task().cancel) as job:
+            job.update(bytes_total=size)
+            reservation = await client.disk.reserve(Config.DOWNLOAD_PATH, size, url, on_wait)
+    except DiskSpaceError as e:
+        await status_msg.edit_text(f"download failed\n`{str(e)}`")
+        return
+    except asyncio.CancelledError:
+        await status_msg.edit_text(f"download cancelled\n`{url}`")
+        return
+        
+    try:
+        gid = await client.aria2.add_uri([url], options)
+    except Exception as e:
+        reservation.release()
+        await status_msg.edit_text(f"download error: `{str(e)}`")
+        return
+        
+    await monitor_download(client, status_msg, gid, url, owner, options, reservation=reservation, store_key=store_key)
+
+async def monitor_download(client: Client, status_msg: Message, gid: str, url: str, owner: int = None,
+                           options: dict = None, key: str = None, reservation=None, store_key: str = None):
+    """Follow a download until aria2 reports a final state"""
+    
+    progress = ProgressMessage(client, status_msg)
+    reservation = reservation or await client.disk.reserve(Config.DOWNLOAD_PATH, 0, url)
+    
+    waiting = None
+    
+    def cancel():
+        # A download paused for disk space stops waiting as well
+        if waiting:
+            waiting.cancel()
+        return client.aria2.remove(gid)
+        
+    # The lambdas read gid when called, so they follow magnet and torrent hand-overs
+    job = client.jobs.register(
+        "download", url, owner,
+        cancel=cancel,
+        set_priority=lambda priority: prioritize_download(client, gid, priority),
+        descriptor={
+            'key': key,
+            'url': url,
+            'options': dict(options or {}),
+            'owner': owner,
+            'store_key': store_key,
+            'chat_id': status_msg.chat.id,
+            'message_id': status_msg.id
+        }
+    )
+    try:
+        while True:
+            status = await client.aria2.tell_status(gid)
+            state = status.get('status')
+            
+            # Magnets and .torrent urls continue under a new gid
+            followed = status.get('followedBy')
+            if state == 'complete' and followed:
+                await client.aria2.remove_result(gid)
+                gid = followed[0]
+                continue
+                
+            name = download_name(status) or url
+            
+            # Pin the file name so a resumed download continues into the same file
+            files = status.get('files', [])
+            if 'out' not in job.descriptor['options'] and is_plain_url(url) and files and files[0].get('path'):
+                job.descriptor['options']['out'] = os.path.relpath(files[0]['path'], status.get('dir') or Config.DOWNLOAD_PATH)
+                client.jobs.persist(job)
+                
+            if state == 'complete':
+                await client.aria2.remove_result(gid)
+                await progress.finish(
+                    f"**download completed**\n\n"
+                    f"**file:** `{name}`\n"
+                    f"**size:** `{format_bytes(int(status.get('totalLength', 0)))}`\n"
+                    f"**location:** `{Config.DOWNLOAD_PATH}`"
+                )
+                if store_key and is_plain_url(url) and files:
+                    await client.store.add(store_key, files[0]['path'])
+                return
+                
+            job.update(
+                name=name,
+                state={'waiting': 'queued', 'paused': 'paused'}.get(state, 'running'),
+                bytes_done=int(status.get('completedLength', 0)),
+                bytes_total=int(status.get('totalLength', 0))
+            )
+            
+            # The real size can exceed the estimate, the download pauses until that fits too
+            if job.bytes_total > reservation.size and state in ('active', 'waiting'):
+                async def on_wait(position):
+                    job.update(state="waiting for disk")
+                    await progress.finish(
+                        f"**waiting for disk space**\n`{name}`\n\n"
+                        f"**needs:** `{format_bytes(job.bytes_total)}`\n"
+                        f"**position:** `{position}`\n"
+                        f"**gid:** `{gid}`"
+                    )
+                waiting = asyncio.create_task(admit_download(client.aria2, gid, reservation, job.bytes_total, on_wait))
+                await asyncio.wait([waiting])
+                admitted, waiting = waiting, None
+                if admitted.cancelled():
+                    continue
+                admitted.result()
+            reservation.update(job.bytes_done)
+            
+            if state == 'error':
+                await client.aria2.remove_result(gid)
+                await progress.finish(f"download failed\n`{status.get('errorMessage', 'unknown error')[:500]}`")
+                return
+                
+            if state == 'removed':
+                await client.aria2.remove_result(gid)
+                await progress.finish(f"download cancelled\n`{name}`")
+                return
                 
-        stdout, stderr = await process.communicate()
+            await progress.update(download_progress(status, name, gid))
+            await asyncio.sleep(1)
+            
+    except DiskSpaceError as e:
+        try:
+            await client.aria2.remove(gid)
+        except Aria2Error:
+            pass
+        await progress.finish(f"download failed\n`{str(e)}`")
+    except Exception as e:
+        logger.error(f"download monitor for {gid} failed: {e}")
+        await progress.finish(f"download error: `{str(e)}`")
+    finally:
+        reservation.release()
+        client.jobs.finish(job)
+
+@resumable("download")
+async def resume_download(client: Client, descriptor):
+    """Add a download again after a restart, aria2 continues it from its control file"""
+    status_msg = await resume_message(client, descriptor, f"resuming download...\n`{descriptor['url']}`")
+    gid = await client.aria2.add_uri([descriptor['url']], descriptor['options'])
+    await monitor_download(
+        client, status_msg, gid, descriptor['url'], descriptor['owner'],
+        descriptor['options'], descriptor['key'], store_key=descriptor.get('store_key')
+    )
+
+def is_plain_url(url):
+    """Whether aria2 saves the url as a single file it lets us name"""
+    return not url.startswith('magnet:') and not url.split('?')[0].endswith(('.torrent', '.metalink', '.meta4'))
+
+async def prioritize_download(client: Client, gid: str, priority: int):
+    """Move a queued download to the front for a positive priority or the back for a negative one"""
+    if priority == 0:
+        return True
+    try:
+        await client.aria2.change_position(gid, 0, 'POS_SET' if priority > 0 else 'POS_END')
+    except Aria2Error:
+        # Only waiting downloads have a queue position
+        return False
+    return True
+
+def download_progress(status, name, gid):
+    """Render the status text for an aria2 download"""
+    state = status.get('status')
+    completed = int(status.get('completedLength', 0))
+    total = int(status.get('totalLength', 0))
+    speed = int(status.get('downloadSpeed', 0))
+    
+    if state == 'waiting':
+        title = "queued"
+    elif state == 'paused':
+        title = "paused"
+        speed = 0
+    elif not total:
+        title = "fetching metadata..."
+    else:
+        title = "downloading..."
         
-        if process.returncode == 0:
-            await status_msg.edit_text(f"download completed\n`{url}`")
+    text = progress_text(title, name, completed, total, speed)
+    text += f"\n**connections:** `{status.get('connections', 0)}`"
+    if 'numSeeders' in status:
+        text += f" | **seeders:** `{status['numSeeders']}`"
+    return text + f"\n**gid:** `{gid}`"
+
+def download_name(status):
+    """Get a display name from an aria2 status"""
+    bittorrent = status.get('bittorrent', {})
+    if bittorrent.get('info', {}).get('name'):
+        return bittorrent['info']['name']
+    files = status.get('files', [])
+    if files and files[0].get('path'):
+        return os.path.basename(files[0]['path'])
+    return None
+
+@Client.on_message(filters.command(["dlpause", "dlresume", "dlcancel"]))
+@auth_required
+async def download_control_command(client: Client, message: Message):
+    """Pause, resume or cancel a download by gid"""
+    
+    action = message.command[0]
+    
+    if len(message.command) < 2:
+        await message.reply_text(f"usage: `/{action} <gid>`")
+        return
+        
+    gid = message.command[1]
+    
+    if not client.aria2 or not client.aria2.running:
+        await message.reply_text("aria2 daemon is not running")
+        return
+        
+    try:
+        if action == "dlpause":
+            await client.aria2.pause(gid)
+            await message.reply_text(f"download `{gid}` paused")
+        elif action == "dlresume":
+            await client.aria2.unpause(gid)
+            await message.reply_text(f"download `{gid}` resumed")
         else:
-            error_msg = stderr.decode('utf-8', errors='ignore')
-            await status_msg.edit_text(f"download failed\n`{error_msg[:500]}`")
-            
+            await client.aria2.remove(gid)
+            await message.reply_text(f"download `{gid}` cancelled")
     except Exception as e:
-        await status_msg.edit_text(f"download error: `{str(e)}`")
+        await message.reply_text(f"error: `{str(e)}`")
 
 @Client.on_message(filters.command("downloads"))
 @auth_required
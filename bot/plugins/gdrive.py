@@ -3,16 +3,35 @@ Google Drive upload plugin using rclone
 """
 
 import asyncio
+import glob
 import logging
+import mimetypes
 import os
+import re
+import shlex
+import time
+from collections import OrderedDict
 from pathlib import Path
 from pyrogram import Client, filters
-from pyrogram.types import Message
+from pyrogram.errors import MessageNotModified
+from pyrogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
 
 from bot.config import Config
+from bot.ffprobe import message_media
+from bot.jobs import resumable, resume_message
+from bot.progress import ProgressMessage, progress_text
 
 logger = logging.getLogger(__name__)
 
+GLIST_PAGE_SIZE = 20
+
+# Filter text of recent /glist messages by (chat id, message id)
+_VIEWS: "OrderedDict[tuple, str]" = OrderedDict()
+
+# Keep references to background uploads and index updates so they aren't garbage collected
+_UPLOADS = set()
+_INDEX_UPDATES = set()
+
 def auth_required(func):
     """Decorator to check authorization"""
     async def wrapper(client: Client, message: Message):
@@ -22,176 +41,390 @@ def auth_required(func):
         return await func(client, message)
     return wrapper
 
+def start_upload(coro):
+    """Run an upload in the background so the handler returns at once"""
+    task = asyncio.create_task(coro)
+    _UPLOADS.add(task)
+    task.add_done_callback(_UPLOADS.discard)
+
+def update_index(client: Client, paths):
+    """Re-read changed paths of the drive index in the background"""
+    task = asyncio.create_task(client.drive_index.update(paths))
+    _INDEX_UPDATES.add(task)
+    task.add_done_callback(_INDEX_UPDATES.discard)
+
 @Client.on_message(filters.command("gup"))
 @auth_required
 async def gdrive_upload_command(client: Client, message: Message):
     """Upload files to Google Drive using rclone"""
     
-    file_path = None
-    
-    # Check if replying to a media message
-    if message.reply_to_message and message.reply_to_message.media:
-        status_msg = await message.reply_text("downloading file...")
+    # Replied media is piped to drive without touching the disk
+    media = message_media(message.reply_to_message)
+    if media:
+        status_msg = await message.reply_text("preparing upload...")
+        name = media_name(message.reply_to_message, media)
         
-        try:
-            file_path = await message.reply_to_message.download(
-                file_name=f"{Config.TEMP_PATH}/"
-            )
-        except Exception as e:
-            await status_msg.edit_text(f"download failed: `{str(e)}`")
+        # Media fetched before is uploaded from the store instead of telegram
+        path = await client.store.materialize(client.store.media_key(media), Config.TEMP_PATH, name)
+        if path:
+            start_upload(stored_upload(client, path, name, status_msg, message.from_user.id))
             return
             
-    # Check if file path provided
-    elif len(message.command) > 1:
-        input_path = message.text.split(None, 1)[1]
-        file_path = input_path
+        start_upload(client.jobs.run(
+            lambda job: stream_upload(client, message.reply_to_message, media, status_msg, job),
+            "upload", name, message.from_user.id,
+            descriptor={
+                'kind': 'stream_upload',
+                'media_chat_id': message.reply_to_message.chat.id,
+                'media_id': message.reply_to_message.id,
+                'owner': message.from_user.id,
+                'chat_id': status_msg.chat.id,
+                'message_id': status_msg.id
+            }
+        ))
+        return
+        
+    # Check if file paths provided
+    if len(message.command) > 1:
+        paths, missing = resolve_paths(message.text.split(None, 1)[1])
+        if missing:
+            await message.reply_text(f"files not found: `{', '.join(missing)}`")
+            return
         status_msg = await message.reply_text("preparing upload...")
     else:
-        await message.reply_text("usage: `/gup <file_path>` or reply to media")
+        await message.reply_text("usage: `/gup <path|dir|glob> [...]` or reply to media")
         return
         
-    if not file_path or not os.path.exists(file_path):
+    if not paths or not all(os.path.exists(path) for path in paths):
         await status_msg.edit_text("file not found")
         return
         
+    label = Path(paths[0]).name if len(paths) == 1 else f"{len(paths)} items"
+    start_upload(client.jobs.run(
+        lambda job: path_upload(client, paths, label, status_msg, job),
+        "upload", label, message.from_user.id,
+        descriptor={
+            'paths': paths,
+            'label': label,
+            'owner': message.from_user.id,
+            'chat_id': status_msg.chat.id,
+            'message_id': status_msg.id
+        }
+    ))
+
+async def stored_upload(client: Client, path, name, status_msg: Message, owner):
+    """Upload a file linked from the store, the link is removed afterwards"""
     try:
-        # Check if rclone is configured
-        check_cmd = ['rclone', 'listremotes']
-        check_process = await asyncio.create_subprocess_exec(
-            *check_cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
+        await client.jobs.run(
+            lambda job: path_upload(client, [path], name, status_msg, job),
+            "upload", name, owner
         )
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+@resumable("upload")
+async def resume_path_upload(client: Client, descriptor):
+    """Copy the same paths again after a restart, rclone skips files that already made it"""
+    paths = [path for path in descriptor['paths'] if os.path.exists(path)]
+    if not paths:
+        return
+    status_msg = await resume_message(client, descriptor, f"resuming upload...\n`{descriptor['label']}`")
+    await client.jobs.run(
+        lambda job: path_upload(client, paths, descriptor['label'], status_msg, job),
+        "upload", descriptor['label'], descriptor['owner'], descriptor=descriptor
+    )
+
+@resumable("stream_upload")
+async def resume_stream_upload(client: Client, descriptor):
+    """Stream replied media again after a restart, a partial upload cannot be continued"""
+    media_msg = await client.get_messages(descriptor['media_chat_id'], descriptor['media_id'])
+    media = message_media(media_msg)
+    if not media:
+        return
+    status_msg = await resume_message(client, descriptor, f"resuming upload...\n`{media_name(media_msg, media)}`")
+    await client.jobs.run(
+        lambda job: stream_upload(client, media_msg, media, status_msg, job),
+        "upload", media_name(media_msg, media), descriptor['owner'], descriptor=descriptor
+    )
+
+async def path_upload(client: Client, paths, label, status_msg: Message, job):
+    """Copy local files and directories to drive with one rc job per source folder"""
+    try:
+        remote = await get_remote(client, status_msg)
+        if not remote:
+            return
+            
+        total_size = await asyncio.get_running_loop().run_in_executor(None, paths_size, paths)
+        job.update(bytes_total=total_size)
         
-        stdout, stderr = await check_process.communicate()
+        progress = ProgressMessage(client, status_msg)
+        await progress.finish(f"uploading to google drive...\n`{label}`")
         
-        if check_process.returncode != 0:
-            await status_msg.edit_text("rclone not configured. run `rclone config` first")
-            return
+        async def on_stats(stats):
+            text = progress_text(
+                "uploading to google drive...",
+                label,
+                stats.get('bytes', 0),
+                stats.get('totalBytes') or total_size,
+                stats.get('speed', 0),
+                stats.get('eta')
+            )
+            text += f"\n**files:** `{stats.get('transfers', 0)}` of `{stats.get('totalTransfers', 0)}`"
+            job.update(bytes_done=stats.get('bytes', 0), bytes_total=stats.get('totalBytes') or total_size)
+            await progress.update(text)
             
-        remotes = stdout.decode().strip().split('\n')
-        if not remotes or not remotes[0]:
-            await status_msg.edit_text("no rclone remotes found. configure google drive first")
-            return
+        # Every source becomes an async rc job in one stats group
+        group = f"gup/{status_msg.chat.id}/{status_msg.id}"
+        jobids = []
+        for params in upload_jobs(paths, f'{remote}:MuxBot'):
+            jobids.append(await client.rclone.start_job('sync/copy', _group=group, **params))
             
-        # Use first remote (assuming it's Google Drive)
-        remote = remotes[0].rstrip(':')
-        
-        await status_msg.edit_text(f"uploading to google drive...\n`{Path(file_path).name}`")
-        
-        # Upload using rclone
-        upload_cmd = [
-            'rclone',
-            'copy',
-            file_path,
-            f'{remote}:MuxBot/',
-            '--progress',
-            '--stats', '1s'
-        ]
-        
-        process = await asyncio.create_subprocess_exec(
-            *upload_cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
+        started = time.monotonic()
+        statuses = await client.rclone.wait_jobs(jobids, group, on_stats)
+        elapsed = max(time.monotonic() - started, 0.001)
+        await client.rclone.call('core/stats-delete', group=group)
         
-        # Monitor upload progress
-        while process.returncode is None:
-            try:
-                await asyncio.wait_for(process.wait(), timeout=10)
-                break
-            except asyncio.TimeoutError:
-                await status_msg.edit_text(f"uploading to google drive...\n`{Path(file_path).name}`")
-                
-        stdout, stderr = await process.communicate()
+        errors = [str(status.get('error')) for status in statuses if not status.get('success')]
+        # Only the uploaded names are re-read, not the whole folder
+        update_index(client, [os.path.basename(os.path.normpath(path)) for path in paths])
         
-        if process.returncode == 0:
-            file_size = os.path.getsize(file_path)
-            await status_msg.edit_text(
+        if not errors:
+            await progress.finish(
                 f"**upload completed**\n\n"
-                f"**file:** `{Path(file_path).name}`\n"
-                f"**size:** `{format_bytes(file_size)}`\n"
+                f"**files:** `{label}`\n"
+                f"**size:** `{format_bytes(total_size)}`\n"
+                f"**speed:** `{format_bytes(total_size / elapsed)}/s`\n"
                 f"**location:** `{remote}:MuxBot/`"
             )
         else:
-            error_msg = stderr.decode('utf-8', errors='ignore')
-            await status_msg.edit_text(f"upload failed\n`{error_msg[:500]}`")
+            await progress.finish(f"upload failed\n`{'; '.join(errors)[:500]}`")
             
+    except asyncio.CancelledError:
+        await client.schedule_edit(status_msg, f"upload cancelled\n`{label}`")
+        raise
     except Exception as e:
         await status_msg.edit_text(f"upload error: `{str(e)}`")
-    finally:
-        # Clean up downloaded file if it was from Telegram
-        if message.reply_to_message and message.reply_to_message.media:
-            if os.path.exists(file_path):
-                os.remove(file_path)
 
-@Client.on_message(filters.command("glist"))
-@auth_required
-async def gdrive_list_command(client: Client, message: Message):
-    """List files in Google Drive"""
+async def stream_upload(client: Client, media_msg: Message, media, status_msg: Message, job):
+    """Upload telegram media to drive while it downloads, memory use is bounded by the buffer"""
+    name = media_name(media_msg, media)
+    total_size = getattr(media, 'file_size', 0) or 0
+    job.update(bytes_total=total_size)
     
     try:
-        # Check rclone remotes
-        check_cmd = ['rclone', 'listremotes']
-        check_process = await asyncio.create_subprocess_exec(
-            *check_cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        
-        stdout, stderr = await check_process.communicate()
-        
-        if check_process.returncode != 0:
-            await message.reply_text("rclone not configured")
+        remote = await get_remote(client, status_msg)
+        if not remote:
             return
             
-        remotes = stdout.decode().strip().split('\n')
-        if not remotes or not remotes[0]:
-            await message.reply_text("no rclone remotes found")
-            return
-            
-        remote = remotes[0].rstrip(':')
+        progress = ProgressMessage(client, status_msg)
+        await progress.finish(f"uploading to google drive...\n`{name}`")
         
-        status_msg = await message.reply_text("listing google drive files...")
+        started = time.monotonic()
+        done = 0
         
-        # List files
-        list_cmd = ['rclone', 'ls', f'{remote}:MuxBot/']
+        async def counted():
+            nonlocal done
+            # Up to STREAM_BUFFER_CHUNKS parts are fetched at once over the pooled media sessions
+            async for chunk in client.downloader.stream(media_msg, media, Config.STREAM_BUFFER_CHUNKS):
+                yield chunk
+                done += len(chunk)
+                job.update(bytes_done=done)
+                speed = done / max(time.monotonic() - started, 0.001)
+                await progress.update(progress_text("uploading to google drive...", name, done, total_size, speed))
+                
+        await client.rclone.upload_stream(f'{remote}:MuxBot', '', name, counted())
+        elapsed = max(time.monotonic() - started, 0.001)
+        update_index(client, [name])
         
-        process = await asyncio.create_subprocess_exec(
-            *list_cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
+        await progress.finish(
+            f"**upload completed**\n\n"
+            f"**files:** `{name}`\n"
+            f"**size:** `{format_bytes(done)}`\n"
+            f"**speed:** `{format_bytes(done / elapsed)}/s`\n"
+            f"**location:** `{remote}:MuxBot/`"
         )
         
-        stdout, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        await client.schedule_edit(status_msg, f"upload cancelled\n`{name}`")
+        raise
+    except Exception as e:
+        await status_msg.edit_text(f"upload error: `{str(e)}`")
+
+def media_name(message: Message, media):
+    """File name for telegram media, photos and voice notes have none"""
+    name = getattr(media, 'file_name', None)
+    if name:
+        return name
+    extension = mimetypes.guess_extension(getattr(media, 'mime_type', None) or '') or '.jpg'
+    return f"{message.media.value}_{media.file_unique_id}{extension}"
+
+def resolve_paths(text):
+    """Expand /gup arguments into existing paths, returns the paths and unmatched arguments"""
+    text = text.strip()
+    if os.path.exists(text):
+        return [text], []
         
-        if process.returncode == 0:
-            files_output = stdout.decode('utf-8', errors='ignore')
+    try:
+        args = shlex.split(text)
+    except ValueError:
+        args = text.split()
+        
+    paths = []
+    missing = []
+    for arg in args:
+        matches = sorted(glob.glob(arg)) if any(c in arg for c in '*?[') else [arg]
+        matches = [match for match in matches if os.path.exists(match)]
+        if not matches:
+            missing.append(arg)
+        for match in matches:
+            if match not in paths:
+                paths.append(match)
+    return paths, missing
+
+def paths_size(paths):
+    """Total size of files and directory trees"""
+    total = 0
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in files:
+                    try:
+                        total += os.path.getsize(os.path.join(root, name))
+                    except OSError:
+                        pass
+        else:
+            total += os.path.getsize(path)
+    return total
+
+def upload_jobs(paths, destination):
+    """Build sync/copy parameters, one job per directory and one per folder of loose files"""
+    jobs = []
+    files_by_dir = {}
+    
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            jobs.append({'srcFs': path, 'dstFs': f"{destination}/{os.path.basename(path)}"})
+        else:
+            files_by_dir.setdefault(os.path.dirname(path), []).append(os.path.basename(path))
             
-            if not files_output.strip():
-                await status_msg.edit_text("no files found in MuxBot folder")
+    for directory, names in files_by_dir.items():
+        rules = ['/' + re.sub(r'([\\*?\[\]{}])', r'\\\1', name) for name in names]
+        jobs.append({
+            'srcFs': directory,
+            'dstFs': destination,
+            '_filter': {'IncludeRule': rules},
+            '_config': {'MaxDepth': 1}
+        })
+        
+    return jobs
+
+@Client.on_message(filters.command("glist"))
+@auth_required
+async def gdrive_list_command(client: Client, message: Message):
+    """List files in Google Drive from the local index"""
+    
+    query = message.text.split(None, 1)[1].strip() if len(message.command) > 1 else ""
+    status_msg = await message.reply_text("listing google drive files...")
+    
+    try:
+        index = client.drive_index
+        if not index.refreshed_at:
+            # First use before the background walk finished
+            if not await get_remote(client, status_msg):
                 return
-                
-            lines = files_output.strip().split('\n')
-            result = f"**google drive files** (`{len(lines)}` files)\n\n"
-            
-            for line in lines[:20]:  # Limit to 20 files
-                parts = line.strip().split(None, 1)
-                if len(parts) == 2:
-                    size_str = format_bytes(int(parts[0]))
-                    filename = parts[1]
-                    result += f"📄 `{filename}` ({size_str})\n"
-                    
-            if len(lines) > 20:
-                result += f"\n... and {len(lines) - 20} more files"
-                
-            await status_msg.edit_text(result)
-        else:
-            error_msg = stderr.decode('utf-8', errors='ignore')
-            await status_msg.edit_text(f"list failed\n`{error_msg[:500]}`")
+            await index.refresh()
             
+        remember_view(status_msg, query)
+        text, keyboard = render_list(index, query, "name", 0)
+        await status_msg.edit_text(text, reply_markup=keyboard)
+        
     except Exception as e:
-        await message.reply_text(f"error listing files: `{str(e)}`")
+        await status_msg.edit_text(f"error listing files: `{str(e)}`")
+
+async def glist_callback(client: Client, callback_query: CallbackQuery):
+    """Page, sort or refresh a /glist message, data is glist_<page>_<sort> or glist_refresh_<sort>"""
+    _, action, sort = callback_query.data.split("_", 2)
+    query = _VIEWS.get((callback_query.message.chat.id, callback_query.message.id), "")
+    index = client.drive_index
+    
+    if action == "refresh":
+        await callback_query.answer("refreshing index...")
+        try:
+            await index.refresh()
+        except Exception as e:
+            await callback_query.edit_message_text(f"error listing files: `{str(e)}`")
+            return
+        page = 0
+    else:
+        await callback_query.answer()
+        page = int(action)
+        
+    text, keyboard = render_list(index, query, sort, page)
+    try:
+        await callback_query.edit_message_text(text, reply_markup=keyboard)
+    except MessageNotModified:
+        pass
+
+def remember_view(message: Message, query: str):
+    """Keep the filter of a listing message, callback data is too small to carry it"""
+    _VIEWS[(message.chat.id, message.id)] = query
+    while len(_VIEWS) > 200:
+        _VIEWS.popitem(last=False)
+
+def render_list(index, query: str, sort: str, page: int):
+    """Build the text and keyboard for one page of the index"""
+    entries = index.query(query, sort)
+    pages = max(1, -(-len(entries) // GLIST_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    
+    if not entries:
+        text = f"no files matching `{query}`" if query else "no files found in MuxBot folder"
+    else:
+        text = f"**google drive files** (`{len(entries)}` files"
+        text += f", filter `{query}`)\n" if query else ")\n"
+        text += f"sorted by {sort} · page {page + 1}/{pages}"
+        if index.refreshed_at:
+            text += f" · indexed {format_age(time.time() - index.refreshed_at)} ago"
+        text += "\n\n"
+        for entry in entries[page * GLIST_PAGE_SIZE:(page + 1) * GLIST_PAGE_SIZE]:
+            text += f"📄 `{entry['path']}` ({format_bytes(entry['size'])})\n"
+            
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("« prev", callback_data=f"glist_{page - 1}_{sort}"))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton("next »", callback_data=f"glist_{page + 1}_{sort}"))
+    sorts = [
+        InlineKeyboardButton(f"• {key}" if key == sort else key, callback_data=f"glist_0_{key}")
+        for key in ("name", "size", "date")
+    ]
+    rows = [nav, sorts] if nav else [sorts]
+    rows.append([InlineKeyboardButton("refresh", callback_data=f"glist_refresh_{sort}")])
+    return text[:Config.MAX_MESSAGE_LENGTH], InlineKeyboardMarkup(rows)
+
+def format_age(seconds):
+    """Format a duration as a short age"""
+    if seconds < 60:
+        return f"{int(seconds)}s"
+    if seconds < 3600:
+        return f"{int(seconds // 60)}m"
+    return f"{int(seconds // 3600)}h"
+
+async def get_remote(client: Client, status_msg: Message):
+    """Get the drive remote from the rc daemon, reporting problems on the status message"""
+    if not client.rclone or not client.rclone.running:
+        await status_msg.edit_text("rclone daemon is not running")
+        return None
+        
+    remotes = await client.rclone.remotes()
+    if not remotes:
+        await status_msg.edit_text("no rclone remotes found. configure google drive first")
+        return None
+        
+    # Use first remote (assuming it's Google Drive)
+    return remotes[0]
 
 def format_bytes(bytes_size):
     """Format bytes to human readable format"""
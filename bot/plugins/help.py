@@ -20,10 +20,26 @@ async def help_command(client: Client, message: Message):
 **media processing:**
 • `/mi <file/url>` - get media information
 • `/mux` - video muxing operations
+• `/batchmux <video_dir> <tracks_dir>` - mux a season, episodes paired by number
+• `/muxqueue` - list mux jobs, `/muxcancel <id>` to cancel
+• `/pipe <video> [tracks] [-o out.mkv] [-up] [-tg]` - fetch, mux and upload in one go
+• `/pipecancel <id>` - cancel a pipeline
 
 **download & upload:**
 • `/dl <url>` - download with aria2
-• `/gup <file>` - upload to google drive
+• `/dlpause`, `/dlresume`, `/dlcancel <gid>` - control a download
+• `/gup <files/dirs/globs>` - upload to google drive
+• `/tgup <file>` - send a file to this chat, split if too large
+• `/glist [filter]` - browse uploaded files
+
+**disk:**
+• `/disk` - free space, reservations and queued jobs
+• `/pin`, `/unpin <path>` - keep a download from being evicted
+• `/store [verify]` - files reused across downloads
+
+**jobs:**
+• `/jobs` - list running downloads, muxes, uploads and commands
+• `/cancel <id>` - stop a job, `/prio <id> <n>` - reorder a queued one
 
 **authorization (owner only):**
 • `/auth` - manage authorized users/groups
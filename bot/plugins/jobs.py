@@ -0,0 +1,133 @@
+"""
+Job listing and control plugin
+"""
+
+import logging
+import time
+from pyrogram import Client, filters
+from pyrogram.types import Message
+
+from bot.config import Config
+from bot.progress import format_eta
+
+logger = logging.getLogger(__name__)
+
+def auth_required(func):
+    """Decorator to check authorization"""
+    async def wrapper(client: Client, message: Message):
+        if not client.is_authorized(message.from_user.id, message.chat.id):
+            await message.reply_text("unauthorized access")
+            return
+        return await func(client, message)
+    return wrapper
+
+@Client.on_message(filters.command("jobs"))
+@auth_required
+async def jobs_command(client: Client, message: Message):
+    """List running jobs of every plugin"""
+    
+    # Everyone but the owner only sees their own work
+    owner = None if message.from_user.id == Config.OWNER_ID else message.from_user.id
+    jobs = client.jobs.list(owner)
+    
+    if not jobs:
+        await message.reply_text("no running jobs")
+        return
+        
+    result = f"**running jobs** (`{len(jobs)}`)\n\n"
+    for job in jobs[:30]:
+        result += f"`{job.id}` **{job.kind}** {job.state} · `{job.name[:60]}`\n"
+        details = [format_eta(time.time() - job.started)]
+        if job.bytes_total:
+            details.append(f"{format_bytes(job.bytes_done)} / {format_bytes(job.bytes_total)}")
+        elif job.bytes_done:
+            details.append(format_bytes(job.bytes_done))
+        if job.pid:
+            details.append(f"pid {job.pid}")
+        if job.priority:
+            details.append(f"prio {job.priority}")
+        if job.owner and owner is None:
+            details.append(f"owner {job.owner}")
+        result += f"    {' · '.join(details)}\n"
+        
+    if len(jobs) > 30:
+        result += f"\n... and {len(jobs) - 30} more"
+    result += "\n`/cancel <id>` to stop a job, `/prio <id> <n>` to reorder a queued one"
+    
+    await message.reply_text(result[:Config.MAX_MESSAGE_LENGTH])
+
+@Client.on_message(filters.command("cancel"))
+@auth_required
+async def cancel_job_command(client: Client, message: Message):
+    """Cancel a job by id"""
+    
+    if len(message.command) < 2 or not message.command[1].isdigit():
+        await message.reply_text("usage: `/cancel <job_id>`")
+        return
+        
+    job = await find_job(client, message, int(message.command[1]))
+    if not job:
+        return
+        
+    if not job.can_cancel:
+        await message.reply_text(f"{job.kind} jobs cannot be cancelled")
+        return
+        
+    try:
+        cancelled = await client.jobs.cancel(job.id)
+    except Exception as e:
+        await message.reply_text(f"cancel failed: `{str(e)}`")
+        return
+        
+    if cancelled:
+        await message.reply_text(f"job `{job.id}` cancelled\n`{job.name[:100]}`")
+    else:
+        await message.reply_text(f"job `{job.id}` could not be cancelled")
+
+@Client.on_message(filters.command("prio"))
+@auth_required
+async def priority_job_command(client: Client, message: Message):
+    """Change the priority of a queued job"""
+    
+    args = message.command[1:]
+    if len(args) < 2 or not args[0].isdigit() or not args[1].lstrip('-').isdigit():
+        await message.reply_text(
+            "usage: `/prio <job_id> <priority>`\n\n"
+            "higher runs sooner, downloads move to the front or the back of the aria2 queue"
+        )
+        return
+        
+    job = await find_job(client, message, int(args[0]))
+    if not job:
+        return
+        
+    if not job.can_prioritize:
+        await message.reply_text(f"{job.kind} jobs have no queue to reorder")
+        return
+        
+    try:
+        changed = await client.jobs.set_priority(job.id, int(args[1]))
+    except Exception as e:
+        await message.reply_text(f"priority change failed: `{str(e)}`")
+        return
+        
+    if changed:
+        await message.reply_text(f"job `{job.id}` priority set to `{args[1]}`")
+    else:
+        await message.reply_text(f"job `{job.id}` is not queued anymore")
+
+async def find_job(client: Client, message: Message, job_id: int):
+    """Look a job up, only the owner may touch other users' jobs"""
+    job = client.jobs.get(job_id)
+    if not job or (message.from_user.id != Config.OWNER_ID and job.owner != message.from_user.id):
+        await message.reply_text(f"no running job with id `{job_id}`")
+        return None
+    return job
+
+def format_bytes(bytes_size):
+    """Format bytes to human readable format"""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if bytes_size < 1024.0:
+            return f"{bytes_size:.1f} {unit}"
+        bytes_size /= 1024.0
+    return f"{bytes_size:.1f} TB"
\ No newline at end of file
@@ -3,18 +3,25 @@ Media info plugin
 """
 
 import asyncio
-import json
 import logging
 import os
-import subprocess
+import time
 from pathlib import Path
+from urllib.parse import unquote, urlparse
 from pyrogram import Client, filters
 from pyrogram.types import Message
 
 from bot.config import Config
+from bot.ffprobe import ProbeCache, ProbeError, message_media, probe_partial, probe_url, url_headers
+from bot.filestore import free_name
+from bot.progress import ProgressMessage, progress_text
 
 logger = logging.getLogger(__name__)
 
+# Keep references to background probes and store inserts so they aren't garbage collected
+_PROBES = set()
+_STORING = set()
+
 def auth_required(func):
     """Decorator to check authorization"""
     async def wrapper(client: Client, message: Message):
@@ -29,67 +36,113 @@ def auth_required(func):
 async def media_info_command(client: Client, message: Message):
     """Get media information"""
     
+    # Probes run as cancellable jobs, a slow url or download shows up in /jobs
+    target = message.text.split(None, 1)[1] if len(message.command) > 1 else "replied media"
+    task = asyncio.create_task(
+        client.jobs.run(lambda job: analyze_media(client, message, job), "probe", target, message.from_user.id)
+    )
+    _PROBES.add(task)
+    task.add_done_callback(_PROBES.discard)
+
+async def analyze_media(client: Client, message: Message, job=None):
+    """Probe replied media, a url or a local path and reply with the report"""
+    
     file_path = None
+    cache_key = None
+    info = None
+    reservation = None
+    downloaded = False
     
     # Check if replying to a media message
-    if message.reply_to_message and message.reply_to_message.media:
-        status_msg = await message.reply_text("downloading media...")
+    media = message_media(message.reply_to_message)
+    if media:
+        status_msg = await message.reply_text("analyzing media...")
+        cache_key = ProbeCache.media_key(media)
+        display_name = getattr(media, 'file_name', None) or media.file_unique_id
+        info = await client.probe_cache.get(cache_key)
         
-        try:
-            file_path = await message.reply_to_message.download(
-                file_name=f"{Config.TEMP_PATH}/"
-            )
-        except Exception as e:
-            await status_msg.edit_text(f"download failed: `{str(e)}`")
-            return
+        if info is None:
+            await status_msg.edit_text("probing media...")
+            try:
+                info = await probe_partial(client, message.reply_to_message, media)
+            except Exception as e:
+                logger.error(f"partial probe failed: {e}")
+            if info is not None:
+                await client.probe_cache.set(cache_key, info)
+                
+        if info is None:
+            # A file fetched before comes from the store, a new one is kept there afterwards
+            file_path = await client.store.materialize(cache_key, Config.TEMP_PATH)
+            
+        if info is None and not file_path:
+            async def on_wait(position):
+                await status_msg.edit_text(f"waiting for disk space...\n\n**position:** `{position}`")
+                
+            progress = ProgressMessage(client, status_msg)
+            
+            async def on_progress(done, total):
+                reservation.update(done)
+                if job:
+                    job.update(bytes_done=done, bytes_total=total)
+                speed = done / max(time.monotonic() - started, 0.001)
+                await progress.update(progress_text("downloading media...", display_name, done, total, speed))
+                
+            try:
+                reservation = await client.disk.reserve(Config.TEMP_PATH, media.file_size or 0, display_name, on_wait)
+                await status_msg.edit_text("downloading media...")
+                started = time.monotonic()
+                # Parts come in over several media sessions at once
+                file_path = await client.downloader.download(
+                    message.reply_to_message, media,
+                    free_name(Config.TEMP_PATH, Path(display_name).name),
+                    on_progress
+                )
+            except Exception as e:
+                if reservation:
+                    reservation.release()
+                await status_msg.edit_text(f"download failed: `{str(e)}`")
+                return
+            downloaded = bool(file_path)
             
     # Check if file path or URL provided
     elif len(message.command) > 1:
         input_path = message.text.split(None, 1)[1]
         
         if input_path.startswith(('http://', 'https://')):
-            status_msg = await message.reply_text("downloading from url...")
-            # For URLs, we'd need to implement download logic
-            await status_msg.edit_text("url download not implemented yet")
-            return
+            status_msg = await message.reply_text("probing url...")
+            display_name = unquote(os.path.basename(urlparse(input_path).path)) or input_path
+            try:
+                headers = await url_headers(client.http, input_path)
+                cache_key = ProbeCache.url_key(input_path, headers)
+                if cache_key:
+                    info = await client.probe_cache.get(cache_key)
+                if info is None:
+                    info = await probe_url(input_path, headers)
+                    if cache_key:
+                        await client.probe_cache.set(cache_key, info)
+            except ProbeError as e:
+                await status_msg.edit_text(f"ffprobe error: `{str(e)}`")
+                return
         else:
             file_path = input_path
+            display_name = file_path
             status_msg = await message.reply_text("analyzing media...")
     else:
         await message.reply_text("usage: `/mi <file_path>` or reply to media")
         return
         
-    if not file_path or not os.path.exists(file_path):
+    if info is None and (not file_path or not os.path.exists(file_path)):
+        if reservation:
+            reservation.release()
         await status_msg.edit_text("file not found")
         return
         
     try:
-        # Use ffprobe to get media info
-        cmd = [
-            'ffprobe',
-            '-v', 'quiet',
-            '-print_format', 'json',
-            '-show_format',
-            '-show_streams',
-            file_path
-        ]
-        
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        
-        stdout, stderr = await process.communicate()
-        
-        if process.returncode != 0:
-            await status_msg.edit_text(f"ffprobe error: `{stderr.decode()}`")
-            return
+        if info is None:
+            info = await client.probe_cache.probe(file_path, cache_key)
             
-        media_info = json.loads(stdout.decode())
-        
         # Format the output
-        result = format_media_info(media_info, file_path)
+        result = format_media_info(info, display_name)
         
         # Send as file if too long
         if len(result) > Config.MAX_MESSAGE_LENGTH:
@@ -100,19 +153,43 @@ async def media_info_command(client: Client, message: Message):
             await status_msg.delete()
             await message.reply_document(
                 output_file,
-                caption=f"media info for: `{Path(file_path).name}`"
+                caption=f"media info for: `{Path(display_name).name}`"
             )
             os.remove(output_file)
         else:
             await status_msg.edit_text(result)
             
+    except ProbeError as e:
+        await status_msg.edit_text(f"ffprobe error: `{str(e)}`")
     except Exception as e:
         await status_msg.edit_text(f"error analyzing media: `{str(e)}`")
     finally:
-        # Clean up downloaded file
-        if message.reply_to_message and message.reply_to_message.media:
-            if os.path.exists(file_path):
+        if downloaded and os.path.exists(file_path):
+            # Hashing a new download into the store waits until the report is out
+            task = asyncio.create_task(
+                store_download(client, cache_key, file_path, getattr(media, 'file_name', None), reservation)
+            )
+            _STORING.add(task)
+            task.add_done_callback(_STORING.discard)
+        else:
+            # Clean up downloaded file
+            if media and file_path and os.path.exists(file_path):
                 os.remove(file_path)
+            if reservation:
+                reservation.release()
+
+async def store_download(client: Client, cache_key, file_path, name, reservation):
+    """Keep a downloaded file in the store, then delete it and free its space"""
+    try:
+        with client.disk.hold(file_path):
+            await client.store.add(cache_key, file_path, name)
+    except Exception as e:
+        logger.error(f"error storing {file_path}: {e}")
+    finally:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        if reservation:
+            reservation.release()
 
 def format_media_info(info, file_path):
     """Format media info for display"""
@@ -136,7 +213,7 @@ def format_media_info(info, file_path):
         bitrate = format_info.get('bit_rate')
         if bitrate:
             result += f"**bitrate:** `{int(bitrate)//1000} kbps`\n"
-    
+            
     result += "\n**streams:**\n"
     
     # Stream info
@@ -171,7 +248,7 @@ def format_media_info(info, file_path):
             channels = stream.get('channels')
             if channels:
                 result += f"**channels:** `{channels}`\n"
-    
+                
     return result
 
 def format_duration(seconds):
@@ -5,11 +5,17 @@ Video muxing plugin using mkvmerge
 import asyncio
 import logging
 import os
+import re
+import time
 from pathlib import Path
 from pyrogram import Client, filters
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 
 from bot.config import Config
+from bot.ffprobe import ProbeError
+from bot.jobs import resumable, resume_message
+from bot.mkvmerge import run_mkvmerge
+from bot.progress import ProgressMessage, format_eta, progress_bar, progress_text
 
 logger = logging.getLogger(__name__)
 
@@ -48,7 +54,7 @@ select an operation to perform:
 
 • **merge videos** - combine multiple video files
 • **add subtitles** - add subtitle tracks to video
-• **add audio** - add audio tracks to video  
+• **add audio** - add audio tracks to video
 • **extract streams** - extract video/audio/subtitle streams
 
 **tools used:**
@@ -61,19 +67,37 @@ select an operation to perform:
         reply_markup=keyboard
     )
 
+# Keep references to background followers so they aren't garbage collected
+_FOLLOWERS = set()
+
+def parse_options(args):
+    """Strip leading -p<n> priority and -tg send flags from command arguments"""
+    priority, send = 0, False
+    while args:
+        if args[0].startswith('-p') and args[0][2:].lstrip('-').isdigit():
+            priority = int(args[0][2:])
+        elif args[0] == '-tg':
+            send = True
+        else:
+            break
+        args = args[1:]
+    return priority, send, args
+
 @Client.on_message(filters.command("merge"))
 @auth_required
 async def merge_videos_command(client: Client, message: Message):
     """Merge multiple video files"""
     
-    if len(message.command) < 3:
+    priority, send, args = parse_options(message.text.split()[1:])
+    
+    if len(args) < 3:
         await message.reply_text(
-            "usage: `/merge <output_name> <file1> <file2> [file3...]`\n\n"
+            "usage: `/merge [-p<priority>] [-tg] <output_name> <file1> <file2> [file3...]`\n\n"
+            "`-tg` sends the result to this chat\n"
             "example: `/merge merged.mkv video1.mp4 video2.mp4`"
         )
         return
         
-    args = message.text.split()[1:]
     output_name = args[0]
     input_files = args[1:]
     
@@ -87,58 +111,42 @@ async def merge_videos_command(client: Client, message: Message):
         await message.reply_text(f"files not found: `{', '.join(missing_files)}`")
         return
         
+    invalid_files = await probe_inputs(client, input_files)
+    if invalid_files:
+        await message.reply_text(f"not readable media: `{', '.join(invalid_files)}`")
+        return
+        
     status_msg = await message.reply_text(f"merging {len(input_files)} files...")
     
-    try:
-        # Build mkvmerge command
-        output_path = os.path.join(Config.DOWNLOAD_PATH, output_name)
-        
-        cmd = ['mkvmerge', '-o', output_path]
-        
-        # Add input files
-        for i, file in enumerate(input_files):
-            if i == 0:
-                cmd.append(file)
-            else:
-                cmd.extend(['+', file])
-                
-        # Execute merge
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        
-        stdout, stderr = await process.communicate()
-        
-        if process.returncode == 0:
-            file_size = os.path.getsize(output_path)
-            await status_msg.edit_text(
-                f"**merge completed**\n\n"
-                f"**output:** `{output_name}`\n"
-                f"**size:** `{format_bytes(file_size)}`\n"
-                f"**location:** `{Config.DOWNLOAD_PATH}`"
-            )
+    # Build mkvmerge command
+    output_path = os.path.join(Config.DOWNLOAD_PATH, output_name)
+    
+    cmd = ['mkvmerge', '-o', output_path]
+    
+    # Add input files
+    for i, file in enumerate(input_files):
+        if i == 0:
+            cmd.append(file)
         else:
-            error_msg = stderr.decode('utf-8', errors='ignore')
-            await status_msg.edit_text(f"merge failed\n`{error_msg[:500]}`")
+            cmd.extend(['+', file])
             
-    except Exception as e:
-        await status_msg.edit_text(f"merge error: `{str(e)}`")
+    submit_mux(client, status_msg, cmd, output_path, "merge", priority, message.from_user.id, send=send)
 
 @Client.on_message(filters.command("addsubs"))
 @auth_required
 async def add_subtitles_command(client: Client, message: Message):
     """Add subtitles to video"""
     
-    if len(message.command) < 4:
+    priority, send, args = parse_options(message.text.split()[1:])
+    
+    if len(args) < 3:
         await message.reply_text(
-            "usage: `/addsubs <video_file> <subtitle_file> <output_name>`\n\n"
+            "usage: `/addsubs [-p<priority>] [-tg] <video_file> <subtitle_file> <output_name>`\n\n"
+            "`-tg` sends the result to this chat\n"
             "example: `/addsubs video.mp4 subs.srt output.mkv`"
         )
         return
         
-    args = message.text.split()[1:]
     video_file = args[0]
     subtitle_file = args[1]
     output_name = args[2]
@@ -152,41 +160,547 @@ async def add_subtitles_command(client: Client, message: Message):
         await message.reply_text(f"subtitle file not found: `{subtitle_file}`")
         return
         
+    invalid_files = await probe_inputs(client, [video_file, subtitle_file])
+    if invalid_files:
+        await message.reply_text(f"not readable media: `{', '.join(invalid_files)}`")
+        return
+        
     status_msg = await message.reply_text("adding subtitles...")
     
-    try:
-        output_path = os.path.join(Config.DOWNLOAD_PATH, output_name)
-        
-        # Build mkvmerge command
-        cmd = [
-            'mkvmerge',
-            '-o', output_path,
-            video_file,
-            subtitle_file
-        ]
+    output_path = os.path.join(Config.DOWNLOAD_PATH, output_name)
+    
+    # Build mkvmerge command
+    cmd = [
+        'mkvmerge',
+        '-o', output_path,
+        video_file,
+        subtitle_file
+    ]
+    
+    submit_mux(client, status_msg, cmd, output_path, "add subtitles", priority, message.from_user.id, send=send)
+
+async def probe_inputs(client: Client, files):
+    """Return the inputs ffprobe cannot read, results come from the probe cache"""
+    invalid = []
+    for file in files:
+        try:
+            await client.probe_cache.probe(file)
+        except (ProbeError, OSError):
+            invalid.append(file)
+    return invalid
+
+def submit_mux(client: Client, status_msg: Message, cmd, output_path, operation, priority=0, owner=None, key=None,
+               send=False):
+    """Queue an mkvmerge run on the mux worker pool, send uploads the output to the chat afterwards"""
+    
+    output_name = os.path.basename(output_path)
+    progress = ProgressMessage(client, status_msg)
+    # The output is about as large as everything muxed into it
+    inputs = [arg for arg in cmd[3:] if os.path.isfile(arg)]
+    size = sum(os.path.getsize(path) for path in inputs)
+    
+    async def admit():
+        # Space is reserved before the job queues for a worker, so waiting for it holds no slot
+        async def on_wait(position):
+            tracked.update(state="waiting for disk")
+            await progress.finish(
+                f"**{operation} waiting for disk space**\n`{output_name}`\n\n"
+                f"**needs:** `{format_bytes(size)}`\n"
+                f"**position:** `{position}`\n"
+                f"**job id:** `{job.id}`"
+            )
+            
+        reservation = await client.disk.reserve(os.path.dirname(output_path), size, output_name, on_wait)
+        tracked.update(state="queued")
+        return reservation
+        
+    async def run():
+        reservation = job.admission
+        started = time.monotonic()
+        tracked.update(state="running")
         
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
+        async def on_progress(percent):
+            reservation.update(size * percent // 100)
+            elapsed = time.monotonic() - started
+            eta = elapsed * (100 - percent) / percent if percent else None
+            await progress.update(
+                f"**{operation} running**\n`{output_name}`\n\n"
+                f"`{progress_bar(percent, 100)}` `{percent}%`\n"
+                f"**elapsed:** `{format_eta(elapsed)}`\n"
+                f"**eta:** `{format_eta(eta)}`\n"
+                f"**job id:** `{job.id}`"
+            )
+            
+        with client.disk.hold(output_path, *inputs):
+            await progress.finish(f"**{operation} running**\n`{output_name}`\n\n**job id:** `{job.id}`")
+            return await run_mkvmerge(cmd, on_progress, lambda pid: tracked.update(pid=pid))
+            
+    def on_position(job, position):
+        client.schedule_edit(
+            status_msg,
+            f"**{operation} queued**\n`{output_name}`\n\n"
+            f"**position:** `{position}`\n"
+            f"**job id:** `{job.id}`"
         )
         
-        stdout, stderr = await process.communicate()
+    def cancel():
+        # Once mkvmerge is done the follower may still be sending the output
+        return client.mux_pool.cancel(job.id) or task.cancel()
+        
+    job = client.mux_pool.submit(run, f"{operation}: {output_name}", priority, on_position, admit, owner)
+    tracked = client.jobs.register(
+        "mux", output_name, owner,
+        cancel=cancel,
+        set_priority=lambda priority: client.mux_pool.set_priority(job.id, priority),
+        descriptor={
+            'key': key,
+            'cmd': cmd,
+            'output_path': output_path,
+            'operation': operation,
+            'priority': priority,
+            'send': send,
+            'owner': owner,
+            'chat_id': status_msg.chat.id,
+            'message_id': status_msg.id
+        }
+    )
+    tracked.update(state=job.state, priority=priority)
+    
+    def discard():
+        # Only an output this job's mkvmerge started writing goes, never one of its inputs
+        if tracked.pid and os.path.abspath(output_path) not in map(os.path.abspath, inputs) and os.path.exists(output_path):
+            os.remove(output_path)
+            
+    task = asyncio.create_task(follow_mux(client, progress, job, output_path, operation, tracked if send else None, discard))
+    task.add_done_callback(lambda _: client.jobs.finish(tracked))
+    _FOLLOWERS.add(task)
+    task.add_done_callback(_FOLLOWERS.discard)
+
+@resumable("mux")
+async def resume_mux(client: Client, descriptor):
+    """Queue an interrupted mux again, mkvmerge starts the output over"""
+    inputs = [arg for arg in descriptor['cmd'][3:] if arg != '+']
+    if not all(os.path.exists(path) for path in inputs):
+        return
+    output_name = os.path.basename(descriptor['output_path'])
+    status_msg = await resume_message(client, descriptor, f"resuming {descriptor['operation']}...\n`{output_name}`")
+    submit_mux(
+        client, status_msg, descriptor['cmd'], descriptor['output_path'], descriptor['operation'],
+        descriptor['priority'], descriptor['owner'], descriptor['key'], descriptor.get('send', False)
+    )
+
+async def follow_mux(client: Client, progress: ProgressMessage, job, output_path, operation, send_job=None,
+                     discard=None):
+    """Report the outcome of a queued mux job and send the output when a job to track it is given
+    
+    discard removes a partial output once the job is cancelled.
+    """
+    
+    output_name = os.path.basename(output_path)
+    
+    try:
+        returncode, log = await job.wait()
+    except asyncio.CancelledError:
+        if discard:
+            discard()
+        await progress.finish(f"{operation} cancelled\n`{output_name}`")
+        return
+    except Exception as e:
+        await progress.finish(f"{operation} error: `{str(e)}`")
+        return
+        
+    # mkvmerge exits with 1 when it only emitted warnings
+    if returncode in (0, 1) and os.path.exists(output_path):
+        file_size = os.path.getsize(output_path)
+        if send_job:
+            await send_output(client, progress, output_path, operation, send_job)
+            return
+        await progress.finish(
+            f"**{operation} completed**\n\n"
+            f"**output:** `{output_name}`\n"
+            f"**size:** `{format_bytes(file_size)}`\n"
+            f"**location:** `{Config.DOWNLOAD_PATH}`"
+        )
+    else:
+        await progress.finish(f"{operation} failed\n`{log[-500:]}`")
+
+async def send_output(client: Client, progress: ProgressMessage, output_path, operation, job):
+    """Upload a finished mux to the chat of its status message"""
+    
+    output_name = os.path.basename(output_path)
+    file_size = os.path.getsize(output_path)
+    started = time.monotonic()
+    job.update(state="sending", bytes_total=file_size)
+    
+    async def on_progress(name, done, total):
+        job.update(bytes_done=done)
+        speed = done / max(time.monotonic() - started, 0.001)
+        await progress.update(progress_text(f"{operation} completed, sending...", name, done, total, speed))
         
-        if process.returncode == 0:
-            file_size = os.path.getsize(output_path)
-            await status_msg.edit_text(
-                f"**subtitles added**\n\n"
-                f"**output:** `{output_name}`\n"
-                f"**size:** `{format_bytes(file_size)}`\n"
-                f"**location:** `{Config.DOWNLOAD_PATH}`"
+    try:
+        with client.disk.hold(output_path):
+            parts = await client.uploader.send(
+                progress.message.chat.id, output_path, output_name, progress.message.id, on_progress
             )
+    except asyncio.CancelledError:
+        await progress.finish(f"sending cancelled\n`{output_name}`\n\nthe output is kept in `{Config.DOWNLOAD_PATH}`")
+        raise
+    except Exception as e:
+        await progress.finish(f"{operation} completed, sending failed: `{str(e)}`\n`{output_name}` is kept in `{Config.DOWNLOAD_PATH}`")
+        return
+        
+    await progress.finish(
+        f"**{operation} completed**\n\n"
+        f"**output:** `{output_name}`\n"
+        f"**size:** `{format_bytes(file_size)}`\n"
+        f"**sent:** `{parts}` {'message' if parts == 1 else 'messages'}\n"
+        f"**location:** `{Config.DOWNLOAD_PATH}`"
+    )
+
+VIDEO_EXTENSIONS = ('.mkv', '.mp4', '.m4v', '.avi', '.mov', '.webm', '.ts', '.m2ts')
+TRACK_EXTENSIONS = (
+    '.srt', '.ass', '.ssa', '.vtt', '.sup', '.sub',
+    '.mka', '.aac', '.ac3', '.eac3', '.dts', '.thd', '.flac', '.opus', '.m4a', '.mp3'
+)
+
+# Tags that look like numbers but are not episodes, e.g. 1080p, x264, 10bit, a crc, a year,
+# a v2 release, HDR10 or an audio codec with its channels like AAC2.0, DDP5.1 or E-AC3
+_NOISE_RE = re.compile(
+    r'\[[0-9a-f]{8}\]|\b\d{3,4}[pi]\b|[xh]\.?26[45]|\b(?:8|10|12)[ -]?bit|\bhi10p?\b|\bhdr10\+?'
+    r'|\b(?:19|20)\d{2}\b|(?:(?<=\d)|\b)v\d{1,2}\b|\bav1\b|\b[1-8]ch\b'
+    r'|\b(?:e-?ac-?3|ac-?3|ddp?|aac(?:-lc)?|flac|opus|dts(?:-?hd)?(?: ma)?|truehd|mp3)(?:[ .]?\d\.\d)?\b'
+    r'|\b\d\.\d\b',
+    re.I
+)
+_SEASON_EPISODE_RE = re.compile(r'\bs(\d{1,2})[ .-]?e(\d{1,4})\b', re.I)
+_EPISODE_RE = re.compile(r'\b(?:e|ep|episode)[ .-]?(\d{1,4})\b', re.I)
+_DASH_EPISODE_RE = re.compile(r'\s-\s*(\d{1,4})\b')
+_NUMBER_RE = re.compile(r'\b\d{1,4}\b')
+# A second episode straight after the first, S01E01E02, S01E01-02, S01E01.E02 or S01E01_E02
+_MULTI_EPISODE_RE = re.compile(r'(?:[ .-]*e|-)\d{1,4}\b', re.I)
+
+# Running batches by job id, the tasks are kept so they aren't garbage collected
+_BATCHES = set()
+
+def episode_key(name):
+    """(season, episode) of a file name, season is 0 when the name only numbers episodes
+    
+    None when the name has no episode or could mean more than one, e.g. a
+    double episode or two bare numbers, such a file is left unmatched.
+    """
+    stem = _NOISE_RE.sub(' ', Path(name).stem.replace('_', ' '))
+    matches = list(_SEASON_EPISODE_RE.finditer(stem))
+    if matches:
+        keys = {(int(match.group(1)), int(match.group(2))) for match in matches}
+        if len(keys) > 1 or _MULTI_EPISODE_RE.match(stem, matches[0].end()):
+            return None
+        return keys.pop()
+    for pattern in (_EPISODE_RE, _DASH_EPISODE_RE):
+        episodes = {int(number) for number in pattern.findall(stem)}
+        if episodes:
+            return (0, episodes.pop()) if len(episodes) == 1 else None
+    # Otherwise a lone number, with more than one there is no telling which is the episode
+    numbers = _NUMBER_RE.findall(stem)
+    return (0, int(numbers[0])) if len(numbers) == 1 else None
+
+def episode_label(key):
+    """S01E05 or E05"""
+    season, episode = key
+    return f"S{season:02d}E{episode:02d}" if season else f"E{episode:02d}"
+
+def pair_episodes(video_dir, tracks_dir):
+    """Match videos to tracks by episode, returns (label, video, tracks) pairs and unmatched names"""
+    def listing(folder, extensions):
+        return sorted(
+            os.path.join(folder, name) for name in os.listdir(folder)
+            if name.lower().endswith(extensions) and os.path.isfile(os.path.join(folder, name))
+        )
+        
+    videos = {}
+    unmatched = []
+    for path in listing(video_dir, VIDEO_EXTENSIONS):
+        videos.setdefault(episode_key(os.path.basename(path)), []).append(path)
+    # Videos that claim the same episode are all left out rather than picking one
+    for key in [key for key, paths in videos.items() if key is None or len(paths) > 1]:
+        unmatched += [os.path.basename(path) for path in videos.pop(key)]
+    videos = {key: paths[0] for key, paths in videos.items()}
+    
+    tracks = {}
+    for path in listing(tracks_dir, TRACK_EXTENSIONS):
+        key = episode_key(os.path.basename(path))
+        if key and key not in videos:
+            # Tracks often carry no season or a different one, a unique episode number is enough
+            same = [video_key for video_key in videos if video_key[1] == key[1]]
+            if len(same) == 1:
+                key = same[0]
+        if key in videos:
+            tracks.setdefault(key, []).append(path)
         else:
-            error_msg = stderr.decode('utf-8', errors='ignore')
-            await status_msg.edit_text(f"operation failed\n`{error_msg[:500]}`")
+            unmatched.append(os.path.basename(path))
             
-    except Exception as e:
-        await status_msg.edit_text(f"error: `{str(e)}`")
+    pairs = [(episode_label(key), videos[key], tracks[key]) for key in sorted(videos) if key in tracks]
+    unmatched += [os.path.basename(videos[key]) for key in sorted(videos) if key not in tracks]
+    return pairs, unmatched
+
+@Client.on_message(filters.command("batchmux"))
+@auth_required
+async def batch_mux_command(client: Client, message: Message):
+    """Mux a folder of episodes with a folder of subtitles or audio tracks"""
+    
+    priority, send, args = parse_options(message.text.split()[1:])
+    if send:
+        await message.reply_text("`-tg` is not supported for batches, send single outputs with `/tgup`")
+        return
+        
+    output_dir = None
+    if len(args) >= 2 and args[-2] == '-o':
+        output_dir, args = args[-1], args[:-2]
+        
+    if len(args) != 2:
+        await message.reply_text(
+            "usage: `/batchmux [-p<priority>] <video_dir> <tracks_dir> [-o <output_dir>]`\n\n"
+            "videos and tracks are paired by episode number, e.g. `S01E05`, `E05` or `- 05`\n"
+            "names that could mean more than one episode are left unmatched\n"
+            "example: `/batchmux downloads/show downloads/show/subs`"
+        )
+        return
+        
+    video_dir, tracks_dir = args
+    for folder in (video_dir, tracks_dir):
+        if not os.path.isdir(folder):
+            await message.reply_text(f"directory not found: `{folder}`")
+            return
+            
+    pairs, unmatched = pair_episodes(video_dir, tracks_dir)
+    if not pairs:
+        await message.reply_text("no episodes could be paired with tracks")
+        return
+        
+    # Bad tracks are caught up front like /mux inputs, not as mkvmerge errors halfway through
+    files = [path for _, video, tracks in pairs for path in (video, *tracks)]
+    status_msg = await message.reply_text(f"checking {len(files)} files...")
+    invalid_files = await probe_inputs(client, files)
+    if invalid_files:
+        await status_msg.edit_text(f"not readable media: `{', '.join(os.path.basename(path) for path in invalid_files)}`")
+        return
+        
+    output_dir = output_dir or os.path.join(Config.DOWNLOAD_PATH, f"{Path(os.path.abspath(video_dir)).name}_muxed")
+    await status_msg.edit_text(f"muxing {len(pairs)} episodes...")
+    start_batch(client, status_msg, {
+        'name': Path(os.path.abspath(video_dir)).name,
+        'pairs': [
+            [label, video, tracks, os.path.join(output_dir, f"{Path(video).stem}.mkv")]
+            for label, video, tracks in pairs
+        ],
+        'unmatched': unmatched,
+        'priority': priority,
+        'owner': message.from_user.id,
+        'chat_id': status_msg.chat.id,
+        'message_id': status_msg.id,
+        'results': {}
+    })
+
+def start_batch(client: Client, status_msg: Message, descriptor):
+    """Queue every pair of a batch on the mux pool behind one status message"""
+    job = client.jobs.register("batch_mux", descriptor['name'], descriptor['owner'], cancel=lambda: task.cancel(), descriptor=descriptor)
+    job.update(state="running")
+    task = asyncio.create_task(run_batch(client, status_msg, descriptor, job))
+    task.add_done_callback(lambda _: client.jobs.finish(job))
+    _BATCHES.add(task)
+    task.add_done_callback(_BATCHES.discard)
+    return task
+
+@resumable("batch_mux")
+async def resume_batch(client: Client, descriptor):
+    """Mux the episodes a restart interrupted, finished ones whose output exists are kept"""
+    descriptor['results'] = {
+        label: result for label, result in descriptor['results'].items()
+        if result[0] == "done" and os.path.exists(result[2])
+    }
+    status_msg = await resume_message(client, descriptor, f"resuming batch mux...\n`{descriptor['name']}`")
+    # The batch runs on its own, awaiting it would hold up the resumers after this one
+    return start_batch(client, status_msg, descriptor)
+
+async def run_batch(client: Client, status_msg: Message, descriptor, job):
+    """Run all pairs concurrently on the mux pool and finish with a result table"""
+    
+    progress = ProgressMessage(client, status_msg)
+    results = descriptor['results']
+    states = {}
+    started = time.monotonic()
+    
+    async def report():
+        await progress.update(batch_text(descriptor, states, started))
+        
+    async def mux_pair(label, video, tracks, output_path):
+        inputs = [video, *tracks]
+        # Set once mkvmerge runs, a cancelled episode only removes an output it started writing
+        writing = False
+        
+        async def on_wait(position):
+            states[label] = f"waiting for disk at {position}"
+            await report()
+            
+        async def on_progress(percent):
+            states[label] = f"{percent}%"
+            await report()
+            
+        async def admit():
+            # Episodes wait for disk space before queueing, so they don't hold mux workers meanwhile
+            size = sum(os.path.getsize(path) for path in inputs)
+            reservation = await client.disk.reserve(os.path.dirname(output_path), size, os.path.basename(output_path), on_wait)
+            states[label] = "queued"
+            return reservation
+            
+        def on_start(pid):
+            nonlocal writing
+            writing = True
+            
+        async def work():
+            with client.disk.hold(output_path, *inputs):
+                states[label] = "running"
+                await report()
+                return await run_mkvmerge(['mkvmerge', '-o', output_path, *inputs], on_progress, on_start)
+                
+        states[label] = "queued"
+        pool_job = client.mux_pool.submit(
+            work, f"batch: {os.path.basename(output_path)}", descriptor['priority'], admit=admit, owner=descriptor['owner']
+        )
+        try:
+            returncode, log = await pool_job.wait()
+            # mkvmerge exits with 1 when it only emitted warnings
+            if returncode in (0, 1) and os.path.exists(output_path):
+                result = ["done", format_bytes(os.path.getsize(output_path)), output_path]
+            else:
+                result = ["failed", (log.splitlines()[-1] if log else f"exit {returncode}")[:60], output_path]
+        except asyncio.CancelledError:
+            client.mux_pool.cancel(pool_job.id)
+            source = os.path.abspath(output_path) in map(os.path.abspath, inputs)
+            if writing and not source and os.path.exists(output_path):
+                os.remove(output_path)
+            # A single episode cancelled with /muxcancel does not stop the batch
+            if asyncio.current_task().cancelling():
+                raise
+            result = ["cancelled", "", output_path]
+        except Exception as e:
+            result = ["failed", str(e)[:60], output_path]
+        states.pop(label, None)
+        results[label] = result
+        client.jobs.persist(job, results=results)
+        await report()
+        
+    os.makedirs(os.path.dirname(descriptor['pairs'][0][3]), exist_ok=True)
+    pending = [pair for pair in descriptor['pairs'] if pair[0] not in results or results[pair[0]][0] != "done"]
+    await progress.finish(batch_text(descriptor, states, started))
+    try:
+        await asyncio.gather(*(mux_pair(*pair) for pair in pending))
+    except asyncio.CancelledError:
+        await progress.finish(f"batch mux cancelled\n`{descriptor['name']}`\n\n{result_table(descriptor)}")
+        raise
+        
+    text = batch_text(descriptor, states, started, final=True)
+    if len(text) <= Config.MAX_MESSAGE_LENGTH:
+        await progress.finish(text)
+        return
+        
+    # Long seasons get the table as a file
+    output_file = os.path.join(Config.TEMP_PATH, f"batchmux_{status_msg.id}.txt")
+    os.makedirs(Config.TEMP_PATH, exist_ok=True)
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write(result_table(descriptor, fenced=False))
+    await progress.finish(batch_text(descriptor, states, started, final=True, table=False))
+    await status_msg.reply_document(output_file, caption=f"batch mux results for `{descriptor['name']}`")
+    os.remove(output_file)
+
+def batch_text(descriptor, states, started, final=False, table=True):
+    """Aggregate status of a batch, running episodes while it runs and the result table at the end"""
+    results = descriptor['results']
+    total = len(descriptor['pairs'])
+    done = sum(1 for result in results.values() if result[0] == "done")
+    failed = sum(1 for result in results.values() if result[0] != "done")
+    
+    if final:
+        title = "batch mux completed" if not failed else f"batch mux finished with {failed} failed"
+    else:
+        title = "batch mux running"
+    text = (
+        f"**{title}**\n`{descriptor['name']}`\n\n"
+        f"`{progress_bar(done + failed, total)}` `{done + failed}/{total}`\n"
+        f"**done:** `{done}` **failed:** `{failed}`\n"
+    )
+    if not final:
+        for label, state in sorted(states.items()):
+            text += f"• `{label}` {state}\n"
+    elif table:
+        text += f"\n{result_table(descriptor)}\n"
+    if final and descriptor.get('unmatched'):
+        text += f"\n**unpaired:** `{', '.join(descriptor['unmatched'])[:500]}`\n"
+    text += f"\n**elapsed:** `{format_eta(time.monotonic() - started)}`"
+    if final and done:
+        text += f"\n**location:** `{os.path.dirname(descriptor['pairs'][0][3])}`"
+    return text
+
+def result_table(descriptor, fenced=True):
+    """One line per episode with its outcome"""
+    lines = []
+    for label, video, tracks, output_path in descriptor['pairs']:
+        state, detail, _ = descriptor['results'].get(label, ["pending", "", output_path])
+        lines.append(f"{label:<8} {state:<9} {detail:<10} {os.path.basename(output_path)[:40]}")
+    table = "\n".join(lines)
+    return f"```\n{table}\n```" if fenced else table
+
+@Client.on_message(filters.command("muxqueue"))
+@auth_required
+async def mux_queue_command(client: Client, message: Message):
+    """List running and queued mux jobs"""
+    
+    pool = client.mux_pool
+    running = pool.running
+    queued = pool.queued
+    admitting = pool.admitting
+    
+    if not running and not queued and not admitting:
+        await message.reply_text("no mux jobs")
+        return
+        
+    result = f"**mux jobs** (`{pool.size}` workers)\n\n"
+    
+    if running:
+        result += "**running:**\n"
+        for job in running:
+            result += f"• `{job.id}` - {job.name}\n"
+            
+    if queued:
+        result += "\n**queued:**\n"
+        for position, job in enumerate(queued, 1):
+            result += f"{position}. `{job.id}` - {job.name} (prio `{job.priority}`)\n"
+            
+    if admitting:
+        result += "\n**waiting for disk space:**\n"
+        for job in admitting:
+            result += f"• `{job.id}` - {job.name}\n"
+            
+    await message.reply_text(result)
+
+@Client.on_message(filters.command("muxcancel"))
+@auth_required
+async def mux_cancel_command(client: Client, message: Message):
+    """Cancel a running or queued mux job"""
+    
+    if len(message.command) < 2 or not message.command[1].isdigit():
+        await message.reply_text("usage: `/muxcancel <job_id>`")
+        return
+        
+    job_id = int(message.command[1])
+    job = client.mux_pool.get(job_id)
+    
+    # Only the owner may cancel other users' muxes, like /cancel
+    if job and message.from_user.id != Config.OWNER_ID and job.owner != message.from_user.id:
+        job = None
+    if job and client.mux_pool.cancel(job_id):
+        await message.reply_text(f"mux job `{job_id}` cancelled")
+    else:
+        await message.reply_text(f"mux job `{job_id}` not found")
 
 def format_bytes(bytes_size):
     """Format bytes to human readable format"""
@@ -0,0 +1,529 @@
+"""
+Download, probe, mux and upload pipelines
+"""
+
+import asyncio
+import logging
+import os
+import secrets
+import shutil
+import time
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+from pyrogram import Client, filters
+from pyrogram.types import Message
+
+from bot.config import Config
+from bot.diskspace import DiskSpaceError, admit_download, entry_size
+from bot.ffprobe import ProbeError, url_headers
+from bot.filestore import link_or_copy
+from bot.jobs import resumable, resume_message
+from bot.mkvmerge import run_mkvmerge
+from bot.pipeline import Pipeline, Stage, StageError
+from bot.progress import ProgressMessage, format_eta
+
+logger = logging.getLogger(__name__)
+
+URL_SCHEMES = ('http://', 'https://', 'ftp://', 'magnet:')
+
+# Running pipelines by id, the tasks are kept so they aren't garbage collected
+_PIPELINES = {}
+_RUNNERS = set()
+# Background drive index updates and queue position reports, held for the same reason
+_INDEX_UPDATES = set()
+_REPORTS = set()
+
+def auth_required(func):
+    """Decorator to check authorization"""
+    async def wrapper(client: Client, message: Message):
+        if not client.is_authorized(message.from_user.id, message.chat.id):
+            await message.reply_text("unauthorized access")
+            return
+        return await func(client, message)
+    return wrapper
+
+@Client.on_message(filters.command("pipe"))
+@auth_required
+async def pipe_command(client: Client, message: Message):
+    """Fetch, probe, mux and optionally upload in one job"""
+    
+    usage = (
+        "usage: `/pipe [-p<priority>] [-up] [-tg] [-k] [-o <output_name>] <video> [track...]`\n\n"
+        "sources are urls or local paths, tracks are muxed into the first source\n"
+        "`-up` uploads the result to google drive, `-tg` sends it to this chat\n"
+        "fetched sources are deleted once muxed, `-k` keeps them in the download folder\n"
+        "example: `/pipe -up -o ep01.mkv https://host/ep01.mkv https://host/ep01.ass`"
+    )
+    
+    try:
+        options = parse_pipe_args(message.text.split()[1:])
+    except ValueError:
+        await message.reply_text(usage)
+        return
+    if not options['sources']:
+        await message.reply_text(usage)
+        return
+        
+    sources = options['sources']
+    missing = [source for source in sources if not source.startswith(URL_SCHEMES) and not os.path.exists(source)]
+    if missing:
+        await message.reply_text(f"files not found: `{', '.join(missing)}`")
+        return
+        
+    if any(source.startswith(URL_SCHEMES) for source in sources) and not (client.aria2 and client.aria2.running):
+        await message.reply_text("aria2 daemon is not running")
+        return
+        
+    if options['upload'] and not (client.rclone and client.rclone.running):
+        await message.reply_text("rclone daemon is not running")
+        return
+        
+    output_name = options['output'] or f"{Path(source_name(sources[0])).stem}.mkv"
+    clashes = len(sources) > 1 and overwrites_source(sources, output_name, options['keep'])
+    if clashes and options['output']:
+        await message.reply_text(f"`{output_name}` would overwrite a source, pick another name with `-o`")
+        return
+    if clashes:
+        output_name = f"{Path(output_name).stem}_muxed.mkv"
+        
+    status_msg = await message.reply_text(f"starting pipeline...\n`{output_name}`")
+    start_pipeline(client, status_msg, {
+        'sources': sources,
+        'output_name': output_name,
+        'priority': options['priority'],
+        'upload': options['upload'],
+        'send': options['send'],
+        'keep': options['keep'],
+        # Sources are fetched into a folder of their own, only files in it are ever consumed
+        'work_dir': None if options['keep'] else os.path.join(Config.DOWNLOAD_PATH, f".pipe_{secrets.token_hex(4)}"),
+        'owner': message.from_user.id,
+        'chat_id': status_msg.chat.id,
+        'message_id': status_msg.id,
+        'results': {}
+    })
+
+def start_pipeline(client: Client, status_msg: Message, descriptor):
+    """Run a pipeline in the background, completed stages are stored so a restart can skip them"""
+    output_name = descriptor['output_name']
+    work_dir = descriptor.get('work_dir')
+    progress = ProgressMessage(client, status_msg)
+    
+    def checkpoint(pipeline):
+        results = {name: stage.result for name, stage in pipeline.stages.items() if stage.state == "done"}
+        if results != descriptor['results']:
+            client.jobs.persist(job, results=results)
+            
+    pipeline = build_pipeline(
+        client, progress, descriptor['sources'], output_name,
+        descriptor['priority'], descriptor['upload'], checkpoint, descriptor.get('send', False), work_dir,
+        descriptor['owner']
+    )
+    pipeline.restore(descriptor['results'])
+    _PIPELINES[pipeline.id] = pipeline
+    job = client.jobs.register("pipeline", output_name, descriptor['owner'], cancel=pipeline.cancel, descriptor=descriptor)
+    task = asyncio.create_task(run_pipeline(progress, pipeline, output_name))
+    
+    def finished(_):
+        client.jobs.finish(job)
+        # A shutdown keeps fetched sources for the resumed run
+        if work_dir and not client.jobs.suspended:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            
+    task.add_done_callback(finished)
+    _RUNNERS.add(task)
+    task.add_done_callback(_RUNNERS.discard)
+    return task
+
+@resumable("pipeline")
+async def resume_pipeline(client: Client, descriptor):
+    """Rerun a pipeline from its last completed stages, results whose files are gone are redone"""
+    # Fetched sources are deleted once muxed, a finished mux still counts for them and
+    # keeps the upload and send results too, so a sent file is not sent again
+    results = descriptor['results']
+    muxed = isinstance(results.get('mux'), str) and os.path.exists(results['mux'])
+    descriptor['results'] = {
+        name: result for name, result in results.items()
+        if muxed or (isinstance(result, str) and os.path.exists(result))
+    }
+    status_msg = await resume_message(client, descriptor, f"resuming pipeline...\n`{descriptor['output_name']}`")
+    # The pipeline runs on its own, awaiting it would hold up the resumers after this one
+    return start_pipeline(client, status_msg, descriptor)
+
+def parse_pipe_args(args):
+    """Split /pipe arguments into flags and sources"""
+    options = {'priority': 0, 'upload': False, 'send': False, 'keep': False, 'output': None, 'sources': []}
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg == '-up':
+            options['upload'] = True
+        elif arg == '-tg':
+            options['send'] = True
+        elif arg == '-k':
+            options['keep'] = True
+        elif arg == '-o':
+            if not args:
+                raise ValueError("missing output name")
+            options['output'] = args.pop(0)
+        elif arg.startswith('-p') and arg[2:].lstrip('-').isdigit():
+            options['priority'] = int(arg[2:])
+        else:
+            options['sources'].append(arg)
+    return options
+
+def overwrites_source(sources, output_name, keep):
+    """Whether the output would land on a local source or on where a kept fetch is saved
+    
+    mkvmerge refuses to write over one of its inputs, so such an output
+    would always fail.
+    """
+    output_path = os.path.abspath(os.path.join(Config.DOWNLOAD_PATH, output_name))
+    for source in sources:
+        if not source.startswith(URL_SCHEMES):
+            path = source
+        elif keep:
+            path = os.path.join(Config.DOWNLOAD_PATH, source_name(source))
+        else:
+            continue
+        if os.path.abspath(path) == output_path:
+            return True
+    return False
+
+def source_name(source):
+    """Display name of a url or path"""
+    if source.startswith(URL_SCHEMES):
+        return unquote(os.path.basename(urlparse(source).path)) or source
+    return os.path.basename(source)
+
+def build_pipeline(client: Client, progress: ProgressMessage, sources, output_name, priority=0, upload=False,
+                   on_checkpoint=None, send=False, work_dir=None, owner=None):
+    """Declare the stages, every source is fetched and probed on its own branch
+    
+    Sources are fetched into work_dir, which belongs to this pipeline, and are
+    consumed by the mux. Without one they land in DOWNLOAD_PATH and are kept.
+    """
+    
+    async def on_update(pipeline):
+        if on_checkpoint:
+            on_checkpoint(pipeline)
+        await progress.update(pipeline_text(pipeline, output_name))
+        
+    pipeline = Pipeline(output_name, on_update)
+    
+    probes = []
+    fetched = []
+    for index, source in enumerate(sources):
+        name = source_name(source)
+        deps = []
+        if source.startswith(URL_SCHEMES):
+            pipeline.add(f"fetch{index}", fetch_stage(client, source, work_dir or Config.DOWNLOAD_PATH), label=f"fetch `{name}`")
+            deps = [f"fetch{index}"]
+            fetched.append(index)
+        pipeline.add(f"probe{index}", probe_stage(client, source), deps, label=f"probe `{name}`")
+        probes.append(f"probe{index}")
+        
+    output_path = os.path.join(Config.DOWNLOAD_PATH, output_name)
+    consumed = fetched if work_dir else []
+    pipeline.add("mux", mux_stage(client, output_path, priority, consumed, work_dir, owner), probes, label=f"mux `{output_name}`")
+    if upload:
+        pipeline.add("upload", upload_stage(client), ["mux"], label="upload to google drive")
+    if send:
+        pipeline.add("send", send_stage(client, progress.message), ["mux"], label="send to chat")
+    return pipeline
+
+def fetch_stage(client: Client, url, directory):
+    """Download a url with aria2 into directory, returns the local path"""
+    async def run(stage: Stage):
+        os.makedirs(directory, exist_ok=True)
+        store_key = None
+        if url.startswith(('http://', 'https://')):
+            try:
+                store_key = client.store.url_key(url, await url_headers(client.http, url))
+            except ProbeError:
+                pass
+        path = await client.store.materialize(store_key, directory) if store_key else None
+        if path:
+            await stage.report(f"`{format_bytes(os.path.getsize(path))}` from store")
+            return path
+            
+        reservation = await client.disk.reserve(directory, 0, url)
+        try:
+            path = await fetch(stage, reservation)
+        except DiskSpaceError as e:
+            raise StageError(str(e))
+        finally:
+            reservation.release()
+        if store_key:
+            await client.store.add(store_key, path)
+        return path
+        
+    async def fetch(stage: Stage, reservation):
+        gid = await client.aria2.add_uri([url], {'dir': os.path.abspath(directory)})
+        
+        async def on_wait(position):
+            await stage.report(f"waiting for disk space at `{position}`")
+            
+        async def on_status(status):
+            completed = int(status.get('completedLength', 0))
+            total = int(status.get('totalLength', 0))
+            if total > reservation.size and status.get('status') in ('active', 'waiting'):
+                await admit_download(client.aria2, status['gid'], reservation, total, on_wait)
+            reservation.update(completed)
+            if status.get('status') == 'waiting':
+                await stage.report("queued")
+            elif total:
+                await stage.report(
+                    f"`{completed * 100 // total}%` of `{format_bytes(total)}` "
+                    f"at `{format_bytes(int(status.get('downloadSpeed', 0)))}/s`"
+                )
+                
+        status = await client.aria2.wait(gid, on_status)
+        if status.get('status') != 'complete':
+            raise StageError(status.get('errorMessage') or status.get('status'))
+            
+        # Torrents can carry extras, the largest file is the payload
+        files = [f for f in status.get('files', []) if f.get('path') and f.get('selected', 'true') == 'true']
+        if not files:
+            raise StageError("download produced no file")
+        path = max(files, key=lambda f: int(f.get('length', 0)))['path']
+        await stage.report(f"`{format_bytes(os.path.getsize(path))}`")
+        return path
+    return run
+
+def probe_stage(client: Client, source):
+    """Check a fetched or local file is readable media, returns its path"""
+    async def run(stage: Stage, path=None):
+        path = path or source
+        try:
+            info = await client.probe_cache.probe(path)
+        except (ProbeError, OSError) as e:
+            raise StageError(f"not readable media: {e}")
+        kinds = [stream.get('codec_type', 'data') for stream in info.get('streams', [])]
+        await stage.report(", ".join(f"{kinds.count(kind)} {kind}" for kind in dict.fromkeys(kinds)))
+        return path
+    return run
+
+def mux_stage(client: Client, output_path, priority=0, consumed=(), work_dir=None, owner=None):
+    """Mux every probed input into the output on the shared mux pool
+    
+    Inputs at the indexes in consumed were fetched for this pipeline only and
+    are deleted once the output exists, but only when they live in work_dir,
+    a file that was already on disk is never touched. A lone matroska input
+    has nothing to mux and becomes the output through a rename or hardlink
+    instead of being rewritten.
+    """
+    def owned(path):
+        if not work_dir:
+            return False
+        folder = os.path.abspath(work_dir)
+        return os.path.commonpath([folder, os.path.abspath(path)]) == folder
+        
+    async def run(stage: Stage, video, *tracks):
+        inputs = [video, *tracks]
+        if not tracks and await is_matroska(client, video):
+            await pass_through(stage, video, 0 in consumed and owned(video))
+            return output_path
+        # A fetch can still end up named like the output, e.g. when the server picks the name
+        if os.path.abspath(output_path) in map(os.path.abspath, inputs):
+            raise StageError(f"{os.path.basename(output_path)} would overwrite a source, pick another name with -o")
+            
+        cmd = ['mkvmerge', '-o', output_path, *inputs]
+        started = None
+        # Set once mkvmerge runs, a cancelled job only removes an output it started writing
+        writing = False
+        
+        async def on_progress(percent):
+            elapsed = time.monotonic() - started
+            eta = elapsed * (100 - percent) / percent if percent else None
+            await stage.report(f"`{percent}%`, eta `{format_eta(eta)}`")
+            
+        async def admit():
+            # Reserved before queueing, a pipe waiting for space holds no mux worker
+            size = sum(os.path.getsize(path) for path in inputs)
+            
+            async def on_wait(position):
+                await stage.report(f"waiting for disk space at `{position}`")
+                
+            return await client.disk.reserve(os.path.dirname(output_path), size, os.path.basename(output_path), on_wait)
+            
+        def on_start(pid):
+            nonlocal writing
+            writing = True
+            
+        async def work():
+            nonlocal started
+            with client.disk.hold(output_path, *inputs):
+                started = time.monotonic()
+                await stage.report("running")
+                return await run_mkvmerge(cmd, on_progress, on_start)
+                
+        def on_position(job, position):
+            # The pool calls this synchronously, the report goes out like on_wait's
+            task = asyncio.create_task(stage.report(f"queued at `{position}`"))
+            _REPORTS.add(task)
+            task.add_done_callback(_REPORTS.discard)
+            
+        job = client.mux_pool.submit(work, f"pipe: {os.path.basename(output_path)}", priority, on_position, admit, owner)
+        try:
+            returncode, log = await job.wait()
+        except asyncio.CancelledError:
+            client.mux_pool.cancel(job.id)
+            if writing and os.path.exists(output_path):
+                os.remove(output_path)
+            raise
+        except DiskSpaceError as e:
+            raise StageError(str(e))
+            
+        # mkvmerge exits with 1 when it only emitted warnings
+        if returncode not in (0, 1) or not os.path.exists(output_path):
+            raise StageError(log.splitlines()[-1] if log else f"mkvmerge exited with {returncode}")
+        freed = remove_inputs([path for index, path in enumerate(inputs) if index in consumed and owned(path)])
+        detail = f"`{format_bytes(os.path.getsize(output_path))}`"
+        if freed:
+            detail += f", freed `{format_bytes(freed)}` of fetched sources"
+        await stage.report(detail)
+        return output_path
+        
+    async def pass_through(stage: Stage, video, consume):
+        if os.path.abspath(video) == os.path.abspath(output_path):
+            return
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        # A fetched file is moved into place, a local one stays where it is and gets a second name
+        if consume:
+            await asyncio.get_running_loop().run_in_executor(None, shutil.move, video, output_path)
+        else:
+            await asyncio.get_running_loop().run_in_executor(None, link_or_copy, video, output_path)
+        await stage.report(f"`{format_bytes(os.path.getsize(output_path))}`, nothing to mux, {'moved' if consume else 'linked'}")
+        
+    return run
+
+async def is_matroska(client: Client, path):
+    """Whether a file already is what mkvmerge would write"""
+    try:
+        info = await client.probe_cache.probe(path)
+    except (ProbeError, OSError):
+        return False
+    return 'matroska' in info.get('format', {}).get('format_name', '')
+
+def remove_inputs(paths):
+    """Delete fetched sources after a mux, returns the bytes that frees"""
+    freed = 0
+    for path in paths:
+        try:
+            size = entry_size(path)
+            os.remove(path)
+            freed += size
+        except OSError as e:
+            logger.error(f"error removing {path}: {e}")
+    return freed
+
+def upload_stage(client: Client):
+    """Copy the muxed file into the drive folder"""
+    async def run(stage: Stage, path):
+        remotes = await client.rclone.remotes()
+        if not remotes:
+            raise StageError("no rclone remotes found")
+        name = os.path.basename(path)
+        
+        async def on_stats(stats):
+            total = stats.get('totalBytes') or 0
+            if total:
+                await stage.report(
+                    f"`{stats.get('bytes', 0) * 100 // total}%` "
+                    f"at `{format_bytes(stats.get('speed', 0))}/s`"
+                )
+                
+        jobid = await client.rclone.start_job(
+            'operations/copyfile',
+            srcFs=os.path.dirname(os.path.abspath(path)),
+            srcRemote=name,
+            dstFs=f'{remotes[0]}:MuxBot',
+            dstRemote=name
+        )
+        status = await client.rclone.wait_job(jobid, on_stats)
+        if not status.get('success'):
+            raise StageError(str(status.get('error')))
+        task = asyncio.create_task(client.drive_index.update([name]))
+        _INDEX_UPDATES.add(task)
+        task.add_done_callback(_INDEX_UPDATES.discard)
+        await stage.report(f"`{remotes[0]}:MuxBot/{name}`")
+        return f"{remotes[0]}:MuxBot/{name}"
+    return run
+
+def send_stage(client: Client, status_msg: Message):
+    """Send the muxed file to the chat of the status message, split if too large"""
+    async def run(stage: Stage, path):
+        started = time.monotonic()
+        
+        async def on_progress(name, done, total):
+            speed = done / max(time.monotonic() - started, 0.001)
+            await stage.report(f"`{done * 100 // total}%` of `{name}` at `{format_bytes(speed)}/s`")
+            
+        try:
+            with client.disk.hold(path):
+                parts = await client.uploader.send(
+                    status_msg.chat.id, path, os.path.basename(path), status_msg.id, on_progress
+                )
+        except Exception as e:
+            raise StageError(str(e))
+        await stage.report(f"`{parts}` {'message' if parts == 1 else 'messages'}")
+        return parts
+    return run
+
+def pipeline_text(pipeline: Pipeline, output_name):
+    """Status message of a pipeline"""
+    titles = {
+        "waiting": "pipeline queued",
+        "running": "pipeline running",
+        "done": "pipeline completed",
+        "failed": "pipeline failed",
+        "cancelled": "pipeline cancelled"
+    }
+    text = f"**{titles.get(pipeline.state, 'pipeline')}**\n`{output_name}`\n\n{pipeline.render()}"
+    if pipeline.started:
+        text += f"\n\n**elapsed:** `{format_eta(time.monotonic() - pipeline.started)}`"
+    return text + f"\n**pipeline id:** `{pipeline.id}`"
+
+async def run_pipeline(progress: ProgressMessage, pipeline: Pipeline, output_name):
+    """Run a pipeline and leave its final state on the status message"""
+    try:
+        await pipeline.run()
+    except asyncio.CancelledError:
+        pass
+    except StageError as e:
+        logger.info(f"pipeline {pipeline.id} failed: {e}")
+    except Exception as e:
+        logger.error(f"pipeline {pipeline.id} error: {e}")
+    finally:
+        _PIPELINES.pop(pipeline.id, None)
+        text = pipeline_text(pipeline, output_name)
+        failed = [stage for stage in pipeline.stages.values() if stage.error]
+        if failed:
+            text += f"\n\n`{failed[0].error[:500]}`"
+        await progress.finish(text)
+
+@Client.on_message(filters.command("pipecancel"))
+@auth_required
+async def pipe_cancel_command(client: Client, message: Message):
+    """Cancel a running pipeline"""
+    
+    if len(message.command) < 2 or not message.command[1].isdigit():
+        await message.reply_text("usage: `/pipecancel <id>`")
+        return
+        
+    pipeline = _PIPELINES.get(int(message.command[1]))
+    if not pipeline:
+        await message.reply_text(f"no running pipeline with id `{message.command[1]}`")
+        return
+        
+    pipeline.cancel()
+    await message.reply_text(f"pipeline `{pipeline.id}` cancelled")
+
+def format_bytes(bytes_size):
+    """Format bytes to human readable format"""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if bytes_size < 1024.0:
+            return f"{bytes_size:.1f} {unit}"
+        bytes_size /= 1024.0
+    return f"{bytes_size:.1f} TB"
\ No newline at end of file
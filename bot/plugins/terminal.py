@@ -1,15 +1,22 @@
 """ run shell or python command(s) """
 
 import asyncio
+import ctypes
+import html
 import io
 import keyword
 import os
 import re
+import secrets
 import shlex
 import sys
+import tempfile
 import threading
 import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from contextvars import ContextVar
 from enum import Enum
 from getpass import getuser
 from shutil import which
@@ -37,15 +44,20 @@ except ImportError:
 
     setsid = None
 
+try:
+    import fcntl
+    import pty
+    import termios
+    from signal import SIGINT
+except ImportError:
+    pty = None
+
 from pyrogram.types.messages_and_media.message import Str
 from pyrogram import enums, filters, Client
 from pyrogram.types import Message
 from pyrogram.errors import MessageNotModified, MessageIdInvalid
 from bot.config import Config
 
-# Working directory management
-CURRENT_DIR = os.getcwd()
-
 def humanbytes(size: float) -> str:
     """Convert bytes to human readable format"""
     if not size:
@@ -74,6 +86,7 @@ class MessageWrapper:
         self.filtered_input_str = ""
         self.reply_to_message = message.reply_to_message
         self.chat = message.chat
+        self.from_user = message.from_user
         self.text = message.text
         self._parse_input()
         self._parse_flags()
@@ -111,6 +124,15 @@ class MessageWrapper:
         except (MessageNotModified, MessageIdInvalid):
             return await self._message.reply(text, parse_mode=parse_mode)
 
+    def schedule_edit(self, text, parse_mode=None):
+        return self._message._client.schedule_edit(self._message, text, parse_mode=parse_mode)
+
+    async def cancel_edits(self):
+        await self._message._client.cancel_edits(self._message)
+
+    async def send_file(self, file, filename="output.txt", caption=""):
+        await self._message.reply_document(file, file_name=filename, caption=caption)
+
     async def err(self, text):
         return await self.edit(f"**ERROR**: `{text}`")
 
@@ -132,15 +154,10 @@ class MessageWrapper:
     async def delete(self):
         return await self._message.delete()
 
-    def cancel_callback(self, callback):
-        class CancelContext:
-            def __init__(self, cb):
-                self.callback = cb
-            def __enter__(self):
-                return self
-            def __exit__(self, *args):
-                pass
-        return CancelContext(callback)
+    def cancel_callback(self, callback, kind="term", name=""):
+        """ register the running command with the job manager so /cancel can stop it """
+        return self._message._client.jobs.track(
+            kind, name or self.filtered_input_str[:40], self.from_user.id, cancel=callback)
 
 
 @Client.on_message(filters.command("exec") & filters.user(Config.OWNER_ID))
@@ -174,6 +191,8 @@ async def eval_command(client, message):
   `-l`: list all running eval tasks
   `-c`: cancel specific running eval task
   `-ca`: cancel all running eval tasks
+  `-t`: run in a worker thread with its own event loop, `-t[sec]` sets the timeout
+        (use `await call_main(coro)` for bot calls)
 **Usage**: `/eval [flag] [code lines OR reply to .txt | .py file]`
 **Examples**:
   `/eval print('Userge')`
@@ -184,6 +203,7 @@ async def eval_command(client, message):
   `/eval -n y = 'new_value'`
   `/eval -c2`
   `/eval -ca`
+  `/eval -t60 hashlib.sha256(open('big.mkv', 'rb').read()).hexdigest()`
   `/eval -l`"""
         await message.reply(help_text)
         return
@@ -335,6 +355,10 @@ async def eval_(message):
             return
 
     cmd = message.filtered_input_str
+    # -t is only read as the leading token, so code mentioning -t stays intact
+    thread_flag = re.match(r'-t(\d*)(?:\s+|$)', cmd or '')
+    if thread_flag:
+        cmd = cmd[thread_flag.end():]
     if not cmd:
         await message.err("Unable to Parse Input!")
         return
@@ -382,7 +406,9 @@ async def eval_(message):
         else:
             await msg.delete()
 
-    _g, _l = _context(context_type, message=message, replied=message.reply_to_message)
+    in_thread = thread_flag is not None
+    extra = {'call_main': _main_caller(asyncio.get_running_loop())} if in_thread else {}
+    _g, _l = _context(context_type, message=message, replied=message.reply_to_message, **extra)
     l_d = {}
     try:
         # nosec pylint: disable=W0122
@@ -393,16 +419,22 @@ async def eval_(message):
         return
 
     future = asyncio.get_running_loop().create_future()
-    asyncio.create_task(
-        _run_coro(
-            future,
-            l_d['__aexec'](
-                *_l.values()),
-            _callback))
+    if in_thread:
+        timeout = int(thread_flag.group(1) or Config.EVAL_TIMEOUT)
+        runner = _ThreadEval(l_d['__aexec'], tuple(_l.values()))
+        future.add_done_callback(lambda f: f.cancelled() and runner.cancel())
+        asyncio.create_task(_run_thread(future, runner, _callback, timeout))
+    else:
+        asyncio.create_task(
+            _run_coro(
+                future,
+                l_d['__aexec'](
+                    *_l.values()),
+                _callback))
     hint = cmd.split('\n')[0]
     _EVAL_TASKS[future] = hint[:25] + "..." if len(hint) > 25 else hint
 
-    with msg.cancel_callback(future.cancel):
+    with message.cancel_callback(future.cancel, "eval", _EVAL_TASKS[future]):
         try:
             await future
         except asyncio.CancelledError:
@@ -414,7 +446,6 @@ async def eval_(message):
 @input_checker
 async def term_(message):
     """ run commands in shell (terminal with live update) """
-    global CURRENT_DIR
     cmd = message.filtered_input_str
     as_raw = '-r' in message.flags
 
@@ -423,48 +454,51 @@ async def term_(message):
     except Exception as e:  # pylint: disable=broad-except
         await message.err(str(e))
         return
+    session = ShellSession.get(message.from_user.id)
+    cwd = session.cwd if session else os.getcwd()
     try:
-        t_obj = await Term.execute(parsed_cmd)  # type: Term
+        if session and not session.busy:
+            t_obj = await session.run(parsed_cmd)
+        else:
+            # a second command while the session is busy runs in its own shell
+            t_obj = await Term.execute(parsed_cmd, cwd)  # type: Term
     except Exception as t_e:  # pylint: disable=broad-except
         await message.err(str(t_e))
         return
 
     cur_user = "root"
-    current_dir_name = basename(CURRENT_DIR) or "~"
+    current_dir_name = basename(cwd) or "~"
 
     prefix = f"<b>{cur_user}:{current_dir_name}#</b>"
     output = f"{prefix} <pre>{cmd}</pre>\n"
-    
-    # Track if we've made the first edit to avoid duplicate messages
-    first_edit = True
 
-    with message.cancel_callback(t_obj.cancel):
+    with message.cancel_callback(t_obj.cancel, "term", cmd[:40]) as job:
+        job.update(pid=t_obj.pid)
         await t_obj.init()
         while not t_obj.finished:
-            try:
-                current_output = f"{output}<pre>{t_obj.line}</pre>"
-                if first_edit:
-                    await message.edit(current_output, parse_mode=enums.ParseMode.HTML)
-                    first_edit = False
-                else:
-                    await message.edit(current_output, parse_mode=enums.ParseMode.HTML)
-            except (MessageNotModified, MessageIdInvalid):
-                pass
-            await t_obj.wait(10)  # Increased timeout to avoid flood limits
+            message.schedule_edit(f"{output}<pre>{html.escape(t_obj.tail)}</pre>", parse_mode=enums.ParseMode.HTML)
+            await t_obj.wait(Config.PROGRESS_INTERVAL)
+        await message.cancel_edits()
         if t_obj.cancelled:
+            t_obj.close()
             await message.canceled(reply=True)
             return
 
-    # Handle directory changes from commands like cd
-    if cmd.strip().startswith('cd '):
-        try:
-            CURRENT_DIR = os.getcwd()
-        except:
-            pass
+    if session and t_obj.session is session:
+        prefix = f"<b>{cur_user}:{basename(session.cwd) or '~'}#</b>"
+    if t_obj.returncode:
+        prefix = f"<b>exit code:</b> <code>{t_obj.returncode}</code>\n{prefix}"
 
-    out_data = f"{output}<pre>{t_obj.output}</pre>\n{prefix}"
-    await message.edit_or_send_as_file(
-        out_data, as_raw=as_raw, parse_mode=enums.ParseMode.HTML, filename="term.txt", caption=cmd)
+    try:
+        if as_raw or t_obj.size > Config.MAX_MESSAGE_LENGTH:
+            # large output goes out as a file without being decoded into one string
+            await message.send_file(t_obj.output_file("term.txt"), filename="term.txt", caption=cmd)
+        else:
+            out_data = f"{output}<pre>{html.escape(t_obj.output)}</pre>\n{prefix}"
+            await message.edit_or_send_as_file(
+                out_data, as_raw=as_raw, parse_mode=enums.ParseMode.HTML, filename="term.txt", caption=cmd)
+    finally:
+        t_obj.close()
 
 
 def parse_py_template(cmd: str, msg):
@@ -533,19 +567,104 @@ async def _run_coro(future: asyncio.Future, coro: Awaitable[Any],
             future.set_result(None)
 
 
-_PROXIES = {}
+_EVAL_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="eval")
+
+
+def _main_caller(loop: asyncio.AbstractEventLoop) -> Callable[[Awaitable[Any]], Awaitable[Any]]:
+    def call_main(coro: Awaitable[Any]) -> Awaitable[Any]:
+        """ await a coroutine on the bot loop, pyrogram objects only work there """
+        return asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+    return call_main
+
+
+class _ThreadEval:
+    """ eval body running on its own event loop in a worker thread """
+
+    def __init__(self, func: Callable[..., Awaitable[Any]], args: tuple) -> None:
+        self._func = func
+        self._args = args
+        self._loop = None
+        self._task = None
+        self._ident = None
+        # held while _ident is read or cleared, so an interrupt never lands on a pooled
+        # thread that already moved on to another eval
+        self._ident_lock = threading.Lock()
+        self._cancelled = False
+
+    def run(self) -> Tuple[str, bool]:
+        with self._ident_lock:
+            self._ident = threading.get_ident()
+        try:
+            return asyncio.run(self._main())
+        finally:
+            with self._ident_lock:
+                self._ident = None
+
+    async def _main(self) -> Tuple[str, bool]:
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        if self._cancelled:
+            raise asyncio.CancelledError
+        ret, exc = None, None
+        with redirect() as out:
+            try:
+                ret = await self._func(*self._args)
+            except Exception:  # pylint: disable=broad-except
+                exc = traceback.format_exc().strip()
+            output = exc or out.getvalue()
+            if ret is not None:
+                output += str(ret)
+        return output, exc is not None
+
+    def cancel(self) -> None:
+        self._cancelled = True
+        if self._loop and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._task.cancel)
+        asyncio.get_running_loop().call_later(1, self._interrupt)
+
+    def _interrupt(self) -> None:
+        # code that never awaits can only be stopped by raising inside its thread
+        with self._ident_lock:
+            if self._ident:
+                ctypes.pythonapi.PyThreadState_SetAsyncExc(
+                    ctypes.c_ulong(self._ident), ctypes.py_object(asyncio.CancelledError))
+
+
+async def _run_thread(future: asyncio.Future, runner: _ThreadEval, callback: Callable[[str, bool], Awaitable[Any]],
+                      timeout: int) -> None:
+    try:
+        work = asyncio.get_running_loop().run_in_executor(_EVAL_EXECUTOR, runner.run)
+        work.add_done_callback(lambda f: f.cancelled() or f.exception())
+        try:
+            output, errored = await asyncio.wait_for(asyncio.shield(work), timeout or None)
+        except asyncio.TimeoutError:
+            runner.cancel()
+            output, errored = f"eval timed out after {timeout}s", True
+        except asyncio.CancelledError:
+            return
+        if not future.done():
+            await callback(output, errored)
+    finally:
+        if not future.done():
+            future.set_result(None)
+
+
+# capture target of the running eval, tasks and eval threads each see their own value
+_OUTPUT: ContextVar[Optional[io.StringIO]] = ContextVar('_OUTPUT', default=None)
 
 
 class _Wrapper:
     def __init__(self, original):
         self._original = original
 
+    def write(self, data: str) -> int:
+        return (_OUTPUT.get() or self._original).write(data)
+
+    def flush(self) -> None:
+        (_OUTPUT.get() or self._original).flush()
+
     def __getattr__(self, name: str):
-        return getattr(
-            _PROXIES.get(
-                threading.current_thread().ident,
-                self._original),
-            name)
+        return getattr(_OUTPUT.get() or self._original, name)
 
 
 sys.stdout = _Wrapper(sys.stdout)
@@ -556,23 +675,75 @@ sys.__stderr__ = _Wrapper(sys.__stderr__)
 
 @contextmanager
 def redirect() -> io.StringIO:
-    ident = threading.current_thread().ident
     source = io.StringIO()
-    _PROXIES[ident] = source
+    token = _OUTPUT.set(source)
     try:
         yield source
     finally:
-        del _PROXIES[ident]
+        _OUTPUT.reset(token)
         source.close()
 
 
+class _OutputBuffer:
+    """ append only byte store that spills to a temp file past a size limit """
+
+    def __init__(self, limit: int) -> None:
+        self._limit = limit
+        self._chunks = []
+        self._file = None
+        self._path = None
+        self.size = 0
+
+    def write(self, data: bytes) -> None:
+        self.size += len(data)
+        if self._file:
+            self._file.write(data)
+            return
+        self._chunks.append(data)
+        if self.size > self._limit:
+            os.makedirs(Config.TEMP_PATH, exist_ok=True)
+            fd, self._path = tempfile.mkstemp(prefix="term_", suffix=".txt", dir=Config.TEMP_PATH)
+            self._file = os.fdopen(fd, 'wb')
+            self._file.writelines(self._chunks)
+            self._chunks = []
+
+    def getvalue(self) -> bytes:
+        if self._file:
+            self._file.flush()
+            with open(self._path, 'rb') as f:
+                return f.read()
+        return b''.join(self._chunks)
+
+    def as_file(self, name: str):
+        """ path of the spilled file, or an in-memory file while under the limit """
+        if self._file:
+            self._file.flush()
+            return self._path
+        data = io.BytesIO(b''.join(self._chunks))
+        data.name = name
+        return data
+
+    def close(self) -> None:
+        self._chunks = []
+        if self._file:
+            self._file.close()
+            self._file = None
+            os.remove(self._path)
+
+
 class Term:
     """ live update term class """
 
-    def __init__(self, process: asyncio.subprocess.Process) -> None:
+    _TAIL_CHARS = 3000
+
+    def __init__(self, process: asyncio.subprocess.Process, session: Optional['ShellSession'] = None) -> None:
         self._process = process
+        self.session = session
+        self._returncode = None
         self._line = b''
-        self._output = b''
+        self._output = _OutputBuffer(Config.TERM_SPOOL_SIZE)
+        self._tail = deque()
+        self._tail_len = 0
         self._init = asyncio.Event()
         self._is_init = False
         self._cancelled = False
@@ -586,7 +757,31 @@ class Term:
 
     @property
     def output(self) -> str:
-        return self._by_to_str(self._output)
+        return self._by_to_str(self._output.getvalue())
+
+    @property
+    def tail(self) -> str:
+        return ''.join(self._tail)[-self._TAIL_CHARS:].strip()
+
+    @property
+    def size(self) -> int:
+        return self._output.size
+
+    @property
+    def pid(self) -> int:
+        return self._process.pid
+
+    @property
+    def returncode(self) -> Optional[int]:
+        if self._returncode is not None:
+            return self._returncode
+        return self._process.returncode
+
+    def output_file(self, name: str):
+        return self._output.as_file(name)
+
+    def close(self) -> None:
+        self._output.close()
 
     @staticmethod
     def _by_to_str(data: bytes) -> str:
@@ -617,16 +812,18 @@ class Term:
     def cancel(self) -> None:
         if self._cancelled or self._finished:
             return
-        killpg(getpgid(self._process.pid), SIGKILL)
+        if self.session:
+            self.session.interrupt()
+        else:
+            killpg(getpgid(self._process.pid), SIGKILL)
         self._cancelled = True
 
     @classmethod
-    async def execute(cls, cmd: str) -> 'Term':
-        global CURRENT_DIR
+    async def execute(cls, cmd: str, cwd: Optional[str] = None) -> 'Term':
         kwargs = dict(
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
-            cwd=CURRENT_DIR)  # Use current working directory
+            cwd=cwd)
         if setsid:
             kwargs['preexec_fn'] = setsid
         if sh := which(os.environ.get("USERGE_SHELL", "bash")):
@@ -661,7 +858,12 @@ class Term:
 
     def _append(self, line: bytes) -> None:
         self._line = line
-        self._output += line
+        self._output.write(line)
+        text = line.decode('utf-8', 'replace')
+        self._tail.append(text)
+        self._tail_len += len(text)
+        while self._tail_len > self._TAIL_CHARS and len(self._tail) > 1:
+            self._tail_len -= len(self._tail.popleft())
         self._check_init()
 
     def _check_init(self) -> None:
@@ -679,3 +881,176 @@ class Term:
             self._listener.set_result(None)
 
 
+def _controlling_tty() -> None:
+    setsid()
+    fcntl.ioctl(0, termios.TIOCSCTTY, 0)
+
+
+class ShellSession:
+    """ persistent pty backed bash per user, keeps cwd, env and shell state between commands """
+
+    _sessions: Dict[int, 'ShellSession'] = {}
+
+    def __init__(self, shell: str) -> None:
+        self.cwd = os.getcwd()
+        self._shell = shell
+        self._marker = f"__MUXBOT_{secrets.token_hex(8)}__".encode()
+        self._process = None
+        self._master = None
+        self._term = None
+        self._pending = b''
+        self._blank = False
+        self._starting = False
+
+    @classmethod
+    def get(cls, user_id: int) -> Optional['ShellSession']:
+        if user_id not in cls._sessions:
+            shell = which("bash")
+            if not pty or not shell:
+                return None
+            cls._sessions[user_id] = cls(shell)
+        return cls._sessions[user_id]
+
+    @property
+    def alive(self) -> bool:
+        return self._process is not None and self._process.returncode is None and self._master is not None
+
+    @property
+    def busy(self) -> bool:
+        return self._term is not None or self._starting
+
+    async def run(self, cmd: str) -> Term:
+        if self.busy:
+            raise RuntimeError("shell session is busy")
+        if not self.alive:
+            self._starting = True
+            try:
+                await self._spawn()
+            finally:
+                self._starting = False
+        return await self._send(cmd)
+
+    def interrupt(self) -> None:
+        """ send SIGINT to the foreground job, kill it if it ignores that """
+        if not self.alive:
+            return
+        try:
+            pgrp = os.tcgetpgrp(self._master)
+            os.killpg(pgrp, SIGINT)
+        except OSError:
+            return
+        term = self._term
+        asyncio.get_running_loop().call_later(5, self._kill, term, pgrp)
+
+    def _kill(self, term: Term, pgrp: int) -> None:
+        if term is not self._term or not self.alive:
+            return
+        try:
+            # the shell itself is only killed when it is the one not answering
+            killpg(pgrp, SIGKILL)
+        except OSError:
+            pass
+
+    async def _spawn(self) -> None:
+        master, slave = pty.openpty()
+        attrs = termios.tcgetattr(slave)
+        attrs[1] &= ~termios.ONLCR
+        attrs[3] &= ~(termios.ECHO | termios.ICANON)
+        termios.tcsetattr(slave, termios.TCSANOW, attrs)
+        env = dict(os.environ, PS1='', PS2='', TERM='dumb', HISTFILE='/dev/null')
+        try:
+            self._process = await asyncio.create_subprocess_exec(
+                self._shell, '--noprofile', '--norc', '--noediting', '-i',
+                stdin=slave, stdout=slave, stderr=slave,
+                cwd=self.cwd if isdir(self.cwd) else None,
+                env=env, preexec_fn=_controlling_tty)
+        finally:
+            os.close(slave)
+        self._master = master
+        self._pending = b''
+        os.set_blocking(master, False)
+        asyncio.get_running_loop().add_reader(master, self._on_readable)
+
+        # the banner and anything else bash prints before the first marker is dropped
+        boot = await self._send(":")
+        await boot.wait(10)
+        if not boot.finished:
+            self._close()
+            raise RuntimeError("shell session did not start")
+
+    async def _send(self, cmd: str) -> Term:
+        self._term = Term(self._process, self)
+        self._blank = False
+        marker = self._marker.decode()
+        # the command comes in through a quoted heredoc so no quoting or line limit applies,
+        # and the marker is on its own line so it still runs after the line is interrupted
+        script = (f"IFS= read -r -d '' __muxbot_cmd <<'{marker}'\n{cmd}\n{marker}\n"
+                  f"eval \"$__muxbot_cmd\" < /dev/null\n"
+                  f"printf '\\n%s %s %s\\n' '{marker}' \"$?\" \"$PWD\"\n")
+        data = script.encode()
+        while data:
+            try:
+                data = data[os.write(self._master, data):]
+            except BlockingIOError:
+                await asyncio.sleep(0.01)
+        return self._term
+
+    def _on_readable(self) -> None:
+        try:
+            data = os.read(self._master, 65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._close()
+            return
+        lines = (self._pending + data).split(b'\n')
+        self._pending = lines.pop()
+        for line in lines:
+            if line.startswith(self._marker):
+                self._done(line)
+            elif not line:
+                # the marker is printed after a newline, hold one blank line back
+                if self._blank:
+                    self._emit(b'\n')
+                self._blank = True
+            else:
+                if self._blank:
+                    self._emit(b'\n')
+                    self._blank = False
+                self._emit(line + b'\n')
+        # flush partial lines like progress bars unless they may be the marker
+        if self._pending and not self._marker.startswith(self._pending[:len(self._marker)]):
+            if self._blank:
+                self._emit(b'\n')
+                self._blank = False
+            self._emit(self._pending)
+            self._pending = b''
+
+    def _emit(self, data: bytes) -> None:
+        if self._term:
+            self._term._append(data)
+
+    def _done(self, line: bytes) -> None:
+        _, code, cwd = line.decode('utf-8', 'replace').split(' ', 2)
+        self.cwd = cwd.rstrip('\r')
+        self._release(int(code) if code.isdigit() else None)
+
+    def _release(self, code: Optional[int]) -> None:
+        term, self._term = self._term, None
+        if term:
+            term._returncode = code
+            term._finish()
+
+    def _close(self) -> None:
+        if self._master is not None:
+            asyncio.get_running_loop().remove_reader(self._master)
+            os.close(self._master)
+            self._master = None
+        if self._process and self._process.returncode is None:
+            try:
+                self._process.kill()
+            except ProcessLookupError:
+                pass
+        self._release(None)
@@ -0,0 +1,94 @@
+"""
+Telegram upload plugin
+"""
+
+import asyncio
+import logging
+import os
+import time
+from pyrogram import Client, filters
+from pyrogram.types import Message
+
+from bot.config import Config
+from bot.progress import ProgressMessage, progress_text
+
+logger = logging.getLogger(__name__)
+
+# Keep references to background uploads so they aren't garbage collected
+_UPLOADS = set()
+
+def auth_required(func):
+    """Decorator to check authorization"""
+    async def wrapper(client: Client, message: Message):
+        if not client.is_authorized(message.from_user.id, message.chat.id):
+            await message.reply_text("unauthorized access")
+            return
+        return await func(client, message)
+    return wrapper
+
+@Client.on_message(filters.command("tgup"))
+@auth_required
+async def telegram_upload_command(client: Client, message: Message):
+    """Send a local file to this chat"""
+    
+    if len(message.command) < 2:
+        await message.reply_text(
+            "usage: `/tgup <file_path>`\n\n"
+            f"files above `{format_bytes(Config.TG_UPLOAD_LIMIT)}` are split into parts"
+        )
+        return
+        
+    path = message.text.split(None, 1)[1].strip()
+    if not os.path.isfile(path):
+        await message.reply_text(f"file not found: `{path}`")
+        return
+        
+    status_msg = await message.reply_text(f"preparing upload...\n`{os.path.basename(path)}`")
+    # The upload runs in the background so the handler worker is free for /jobs and /cancel
+    task = asyncio.create_task(client.jobs.run(
+        lambda job: telegram_upload(client, path, status_msg, job),
+        "upload", os.path.basename(path), message.from_user.id
+    ))
+    _UPLOADS.add(task)
+    task.add_done_callback(_UPLOADS.discard)
+
+async def telegram_upload(client: Client, path, status_msg: Message, job):
+    """Upload a file over the pooled media sessions and report progress on the status message"""
+    
+    name = os.path.basename(path)
+    file_size = os.path.getsize(path)
+    job.update(bytes_total=file_size)
+    progress = ProgressMessage(client, status_msg)
+    started = time.monotonic()
+    
+    async def on_progress(part, done, total):
+        job.update(bytes_done=done)
+        speed = done / max(time.monotonic() - started, 0.001)
+        await progress.update(progress_text("uploading to telegram...", part, done, total, speed))
+        
+    try:
+        with client.disk.hold(path):
+            parts = await client.uploader.send(status_msg.chat.id, path, name, status_msg.id, on_progress)
+    except asyncio.CancelledError:
+        await client.schedule_edit(status_msg, f"upload cancelled\n`{name}`")
+        raise
+    except Exception as e:
+        await progress.finish(f"upload error: `{str(e)}`")
+        return
+        
+    elapsed = max(time.monotonic() - started, 0.001)
+    await progress.finish(
+        f"**upload completed**\n\n"
+        f"**file:** `{name}`\n"
+        f"**size:** `{format_bytes(file_size)}`\n"
+        f"**parts:** `{parts}`\n"
+        f"**speed:** `{format_bytes(file_size / elapsed)}/s`"
+    )
+
+def format_bytes(bytes_size):
+    """Format bytes to human readable format"""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if bytes_size < 1024.0:
+            return f"{bytes_size:.1f} {unit}"
+        bytes_size /= 1024.0
+    return f"{bytes_size:.1f} TB"
\ No newline at end of file
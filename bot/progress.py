@@ -0,0 +1,84 @@
+"""
+Progress rendering and throttled status messages
+"""
+
+import logging
+import time
+from typing import Optional
+
+from pyrogram import Client
+from pyrogram.types import Message
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+def format_bytes(bytes_size):
+    """Format bytes to human readable format"""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if bytes_size < 1024.0:
+            return f"{bytes_size:.1f} {unit}"
+        bytes_size /= 1024.0
+    return f"{bytes_size:.1f} TB"
+
+def format_eta(seconds):
+    """Format remaining seconds as a short duration"""
+    if seconds is None or seconds < 0:
+        return "unknown"
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return f"{hours}h {minutes}m"
+    if minutes:
+        return f"{minutes}m {seconds}s"
+    return f"{seconds}s"
+
+def progress_bar(current, total, length=20):
+    """Render a progress bar using the configured characters"""
+    if not total:
+        return Config.UNFINISHED_PROGRESS * length
+    filled = min(length, int(length * current / total))
+    return Config.FINISHED_PROGRESS * filled + Config.UNFINISHED_PROGRESS * (length - filled)
+
+def progress_text(title, name, current, total, speed=0, eta=None):
+    """Build a status block for a transfer"""
+    percentage = current * 100 / total if total else 0
+    if eta is None and speed and total:
+        eta = (total - current) / speed
+    return (
+        f"**{title}**\n"
+        f"`{name}`\n\n"
+        f"`{progress_bar(current, total)}` `{percentage:.1f}%`\n"
+        f"**done:** `{format_bytes(current)}` of `{format_bytes(total)}`\n"
+        f"**speed:** `{format_bytes(speed)}/s`\n"
+        f"**eta:** `{format_eta(eta)}`"
+    )
+
+class ProgressMessage:
+    """Status message that is only edited when its text changes"""
+    
+    def __init__(self, client: Client, message: Message, interval: Optional[float] = None):
+        self.client = client
+        self.message = message
+        self.interval = Config.PROGRESS_INTERVAL if interval is None else interval
+        self._last_text = None
+        self._last_edit = 0.0
+        
+    async def update(self, text: str):
+        """Edit the message if the text changed and the interval elapsed"""
+        if text == self._last_text:
+            return
+        if time.monotonic() - self._last_edit < self.interval:
+            return
+        self._edit(text)
+        
+    async def finish(self, text: str):
+        """Edit the message unconditionally with a final text"""
+        if text != self._last_text:
+            await self._edit(text)
+            
+    def _edit(self, text: str):
+        self._last_text = text
+        self._last_edit = time.monotonic()
+        return self.client.schedule_edit(self.message, text)
\ No newline at end of file
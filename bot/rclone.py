@@ -0,0 +1,151 @@
+"""
+rclone remote control daemon manager
+"""
+
+import asyncio
+import logging
+import secrets
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, List, Optional
+
+import aiohttp
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+class RcloneError(Exception):
+    """Error returned by the rclone rc API"""
+
+class Rclone:
+    """Long-lived `rclone rcd` process driven over its HTTP rc API"""
+    
+    def __init__(self, session: aiohttp.ClientSession):
+        self.session = session
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.auth = aiohttp.BasicAuth("muxbot", secrets.token_hex(16))
+        self.url = f"http://127.0.0.1:{Config.RCLONE_RC_PORT}"
+        
+    async def start(self):
+        """Spawn the rc daemon and wait for it to answer"""
+        cmd = [
+            'rclone',
+            'rcd',
+            '--rc-addr', f'127.0.0.1:{Config.RCLONE_RC_PORT}',
+            '--rc-user', self.auth.login,
+            '--rc-pass', self.auth.password,
+            '--transfers', str(Config.RCLONE_TRANSFERS),
+            '--checkers', str(Config.RCLONE_CHECKERS),
+            '--drive-chunk-size', Config.RCLONE_DRIVE_CHUNK_SIZE,
+            # Streamed uploads hold one request open for the whole transfer
+            '--rc-server-read-timeout', '24h',
+            '--rc-server-write-timeout', '24h',
+            '--log-level', 'ERROR'
+        ]
+        
+        self.process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        
+        for _ in range(50):
+            if self.process.returncode is not None:
+                break
+            try:
+                version = await self.call("core/version")
+                logger.info(f"rclone {version.get('version')} rc listening on port {Config.RCLONE_RC_PORT}")
+                return
+            except (aiohttp.ClientError, RcloneError):
+                await asyncio.sleep(0.2)
+                
+        raise RcloneError("rclone rc daemon failed to start")
+        
+    async def stop(self):
+        """Shut the rc daemon down"""
+        if not self.process or self.process.returncode is not None:
+            return
+        try:
+            await self.call("core/quit")
+            await asyncio.wait_for(self.process.wait(), timeout=10)
+        except Exception:
+            self.process.kill()
+            await self.process.wait()
+        logger.info("rclone daemon stopped")
+        
+    @property
+    def running(self) -> bool:
+        """Whether the daemon process is alive"""
+        return self.process is not None and self.process.returncode is None
+        
+    async def call(self, path: str, **params) -> Dict[str, Any]:
+        """Invoke an rc endpoint"""
+        async with self.session.post(f"{self.url}/{path}", json=params, auth=self.auth) as resp:
+            data = await resp.json(content_type=None)
+            if resp.status != 200:
+                raise RcloneError(data.get("error", f"http {resp.status}"))
+        return data
+        
+    async def upload_stream(self, fs: str, remote: str, name: str, chunks: AsyncIterable[bytes]) -> Dict[str, Any]:
+        """Upload a byte stream of any length as one file, rclone rcats it to the remote as it arrives"""
+        with aiohttp.MultipartWriter('form-data') as writer:
+            part = writer.append(chunks)
+            part.set_content_disposition('form-data', quote_fields=False, name='file0', filename=name)
+            
+        async with self.session.post(
+            f"{self.url}/operations/uploadfile",
+            params={'fs': fs, 'remote': remote},
+            data=writer,
+            auth=self.auth,
+            timeout=aiohttp.ClientTimeout(total=None)
+        ) as resp:
+            data = await resp.json(content_type=None)
+            if resp.status != 200:
+                raise RcloneError(data.get("error", f"http {resp.status}"))
+        return data
+        
+    async def remotes(self) -> List[str]:
+        """Names of the configured remotes"""
+        return (await self.call("config/listremotes")).get("remotes") or []
+        
+    async def start_job(self, path: str, **params) -> int:
+        """Run an rc operation in the background and return its job id"""
+        return (await self.call(path, _async=True, **params))["jobid"]
+        
+    async def stop_job(self, jobid: int):
+        """Cancel a background job"""
+        try:
+            await self.call("job/stop", jobid=jobid)
+        except RcloneError:
+            pass
+            
+    async def stats(self, group: str) -> Dict[str, Any]:
+        """Transfer statistics of a stats group"""
+        return await self.call("core/stats", group=group)
+        
+    async def wait_job(self, jobid: int, on_stats: Optional[Callable[[Dict[str, Any]], Awaitable]] = None,
+                       interval: float = 1) -> Dict[str, Any]:
+        """Poll a background job until it finishes, reporting its transfer stats"""
+        return (await self.wait_jobs([jobid], f"job/{jobid}", on_stats, interval))[0]
+        
+    async def wait_jobs(self, jobids: List[int], group: str,
+                        on_stats: Optional[Callable[[Dict[str, Any]], Awaitable]] = None,
+                        interval: float = 1) -> List[Dict[str, Any]]:
+        """Poll jobs sharing a stats group until all finish, reporting the aggregate stats"""
+        results: Dict[int, Dict[str, Any]] = {}
+        try:
+            while True:
+                for jobid in jobids:
+                    if jobid not in results:
+                        status = await self.call("job/status", jobid=jobid)
+                        if status.get("finished"):
+                            results[jobid] = status
+                if len(results) == len(jobids):
+                    return [results[jobid] for jobid in jobids]
+                if on_stats:
+                    await on_stats(await self.stats(group))
+                await asyncio.sleep(interval)
+        except asyncio.CancelledError:
+            for jobid in jobids:
+                if jobid not in results:
+                    await self.stop_job(jobid)
+            raise
\ No newline at end of file
@@ -0,0 +1,165 @@
+"""
+Rate limited, coalescing message edit scheduler
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from pyrogram.errors import FloodWait, MessageNotModified, MessageIdInvalid
+from pyrogram.types import Message
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """Token bucket rate limiter"""
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+        
+    def consume(self):
+        """Take one token"""
+        self.tokens -= 1
+
+class PendingEdit:
+    """Latest text waiting to be written to a message"""
+    
+    def __init__(self, message: Message, text: str, kwargs: dict, future: asyncio.Future):
+        self.message = message
+        self.text = text
+        self.kwargs = kwargs
+        self.future = future
+        
+    def resolve(self, sent: bool):
+        """Tell the waiter whether this text reached telegram"""
+        if not self.future.done():
+            self.future.set_result(sent)
+
+class EditScheduler:
+    """Sends status edits under per-chat and global rate limits"""
+    
+    def __init__(self):
+        self._pending: "OrderedDict[Tuple[int, int], PendingEdit]" = OrderedDict()
+        self._inflight: Dict[Tuple[int, int], asyncio.Task] = {}
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._global_bucket = TokenBucket(Config.EDIT_GLOBAL_RATE, Config.EDIT_GLOBAL_RATE)
+        self._hold_until: Dict[int, float] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        
+    def start(self):
+        """Start the dispatch loop"""
+        self._task = asyncio.create_task(self._run())
+        
+    async def stop(self):
+        """Stop the dispatch loop and drop pending edits"""
+        if self._task:
+            self._task.cancel()
+        for edit in self._pending.values():
+            edit.resolve(False)
+        self._pending.clear()
+        if self._inflight:
+            await asyncio.gather(*self._inflight.values(), return_exceptions=True)
+            
+    def schedule(self, message: Message, text: str, **kwargs) -> asyncio.Future:
+        """Queue an edit, replacing any older pending text for the message"""
+        key = (message.chat.id, message.id)
+        future = asyncio.get_running_loop().create_future()
+        
+        previous = self._pending.get(key)
+        if previous:
+            previous.resolve(False)
+        self._pending[key] = PendingEdit(message, text, kwargs, future)
+        
+        self._wakeup.set()
+        return future
+        
+    async def discard(self, message: Message):
+        """Drop pending edits for a message and wait for one in flight"""
+        key = (message.chat.id, message.id)
+        previous = self._pending.pop(key, None)
+        if previous:
+            previous.resolve(False)
+        task = self._inflight.get(key)
+        if task:
+            await asyncio.gather(task, return_exceptions=True)
+            
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(Config.EDIT_CHAT_RATE / 60, 3)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+        
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            delay = self._dispatch()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+                
+    def _dispatch(self) -> Optional[float]:
+        """Start every edit whose limits allow it, return the next wake up"""
+        now = time.monotonic()
+        wait = None
+        
+        for key, edit in list(self._pending.items()):
+            if key in self._inflight:
+                continue
+                
+            chat_id = key[0]
+            bucket = self._bucket(chat_id)
+            delay = max(self._hold_until.get(chat_id, 0) - now, bucket.delay(now))
+            if delay <= 0:
+                delay = self._global_bucket.delay(now)
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+                
+            bucket.consume()
+            self._global_bucket.consume()
+            self._hold_until.pop(chat_id, None)
+            del self._pending[key]
+            self._inflight[key] = asyncio.create_task(self._send(key, edit))
+            
+        return wait
+        
+    async def _send(self, key: Tuple[int, int], edit: PendingEdit):
+        try:
+            await edit.message.edit_text(edit.text, **edit.kwargs)
+            edit.resolve(True)
+        except FloodWait as e:
+            logger.warning(f"flood wait of {e.value}s while editing in chat {key[0]}")
+            self._hold_until[key[0]] = time.monotonic() + e.value
+            # Retry unless a newer text was queued in the meantime
+            if key in self._pending:
+                edit.resolve(False)
+            else:
+                self._pending[key] = edit
+        except MessageNotModified:
+            edit.resolve(True)
+        except MessageIdInvalid:
+            edit.resolve(False)
+        except Exception as e:
+            logger.error(f"status edit failed: {e}")
+            edit.resolve(False)
+        finally:
+            self._inflight.pop(key, None)
+            self._wakeup.set()
\ No newline at end of file
@@ -0,0 +1,417 @@
+"""
+Parallel telegram media transfers over several media sessions
+"""
+
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import os
+import shutil
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from pyrogram import raw
+from pyrogram.errors import AuthBytesInvalid
+from pyrogram.file_id import FileId, FileType
+from pyrogram.session import Session
+from pyrogram.session.auth import Auth
+
+from .config import Config
+from .ffprobe import ProbeError, run_ffprobe
+from .mkvmerge import split_name, split_parts
+
+logger = logging.getLogger(__name__)
+
+# Telegram serves files in parts of at most 1 MiB at 1 MiB aligned offsets
+PART_SIZE = 1024 * 1024
+
+# Uploaded parts are at most 512 KiB, files above 10 MiB go through the big file methods
+UPLOAD_PART_SIZE = 512 * 1024
+BIG_FILE_SIZE = 10 * 1024 * 1024
+
+class TransferError(Exception):
+    """A part could not be fetched through the media sessions"""
+
+class CdnRedirect(TransferError):
+    """The file is only served by a CDN datacenter"""
+
+def file_location(file_id: FileId):
+    """Raw input location of a decoded file id"""
+    if file_id.file_type == FileType.PHOTO:
+        return raw.types.InputPhotoFileLocation(
+            id=file_id.media_id,
+            access_hash=file_id.access_hash,
+            file_reference=file_id.file_reference,
+            thumb_size=file_id.thumbnail_size
+        )
+    return raw.types.InputDocumentFileLocation(
+        id=file_id.media_id,
+        access_hash=file_id.access_hash,
+        file_reference=file_id.file_reference,
+        thumb_size=file_id.thumbnail_size
+    )
+
+def preallocate(path: str, size: int):
+    """Create a file of its final size so parts can be written at their offsets in any order"""
+    with open(path, 'wb') as f:
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+        except (AttributeError, OSError):
+            f.truncate(size)
+
+def md5_file(path: str) -> str:
+    """md5 of a small file, telegram checks it for files sent in one piece"""
+    with open(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+async def make_thumbnail(path: str, output: str, duration: float) -> Optional[str]:
+    """Grab a frame a tenth into a video as a 320px jpeg, None when ffmpeg fails"""
+    cmd = [
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-ss', f'{duration / 10:.2f}', '-i', path,
+        '-frames:v', '1', '-vf', 'scale=320:-2', output
+    ]
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+    try:
+        await process.wait()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+    return output if process.returncode == 0 and os.path.exists(output) else None
+
+class SessionPool:
+    """Media sessions per datacenter, opened once and shared by every transfer
+    
+    pyrogram opens a fresh session for each file and pulls its parts one by
+    one over it. Keeping TG_TRANSFER_SESSIONS connections per datacenter lets
+    several parts be in flight at once without paying for the handshake on
+    every file. Sessions to a foreign datacenter share one auth key that is
+    authorized once.
+    """
+    
+    def __init__(self, client):
+        self.client = client
+        self._sessions: Dict[int, List[Session]] = {}
+        self._lock = asyncio.Lock()
+        
+    async def get(self, dc_id: int) -> List[Session]:
+        """Started sessions to a datacenter, opening them on first use"""
+        async with self._lock:
+            if dc_id in self._sessions:
+                return self._sessions[dc_id]
+                
+            storage = self.client.storage
+            test_mode = await storage.test_mode()
+            home = dc_id == await storage.dc_id()
+            auth_key = await storage.auth_key() if home else await Auth(self.client, dc_id, test_mode).create()
+            
+            sessions = []
+            try:
+                for _ in range(max(1, Config.TG_TRANSFER_SESSIONS)):
+                    session = Session(self.client, dc_id, auth_key, test_mode, is_media=True)
+                    await session.start()
+                    sessions.append(session)
+                if not home:
+                    await self._authorize(sessions[0], dc_id)
+            except BaseException:
+                for session in sessions:
+                    await session.stop()
+                raise
+                
+            logger.info(f"opened {len(sessions)} media sessions to dc {dc_id}")
+            self._sessions[dc_id] = sessions
+            return sessions
+            
+    async def stop(self):
+        """Close every session"""
+        async with self._lock:
+            for sessions in self._sessions.values():
+                for session in sessions:
+                    try:
+                        await session.stop()
+                    except Exception as e:
+                        logger.error(f"error closing media session: {e}")
+            self._sessions.clear()
+            
+    async def _authorize(self, session: Session, dc_id: int):
+        for _ in range(3):
+            exported = await self.client.invoke(raw.functions.auth.ExportAuthorization(dc_id=dc_id))
+            try:
+                await session.invoke(raw.functions.auth.ImportAuthorization(id=exported.id, bytes=exported.bytes))
+                return
+            except AuthBytesInvalid:
+                continue
+        raise AuthBytesInvalid
+
+class MediaDownloader:
+    """Fetches telegram media parts concurrently, one worker per pooled session
+    
+    Full downloads go into a preallocated file, each part written at its own
+    offset as soon as it arrives. Streams keep a window of parts in flight
+    and yield them in order. Files telegram hands to a CDN fall back to the
+    sequential pyrogram download.
+    """
+    
+    def __init__(self, client, sessions: SessionPool):
+        self.client = client
+        self.sessions = sessions
+        
+    async def download(self, message, media, path: str,
+                       on_progress: Optional[Callable[[int, int], Awaitable]] = None) -> str:
+        """Download media to path and return it, on_progress gets (done, total) after every part"""
+        size = getattr(media, 'file_size', 0) or 0
+        if not size:
+            return await self.client.download_media(message, file_name=path)
+            
+        file_id = FileId.decode(media.file_id)
+        location = file_location(file_id)
+        sessions = await self.sessions.get(file_id.dc_id)
+        loop = asyncio.get_running_loop()
+        
+        temp_path = path + ".temp"
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        await loop.run_in_executor(None, preallocate, temp_path, size)
+        
+        parts = deque(range((size + PART_SIZE - 1) // PART_SIZE))
+        done = 0
+        
+        async def worker(session: Session):
+            nonlocal done
+            while parts:
+                offset = parts.popleft() * PART_SIZE
+                chunk = await self._part(session, location, offset)
+                if len(chunk) != min(PART_SIZE, size - offset):
+                    raise TransferError(f"short part at {offset}: {len(chunk)} bytes")
+                await loop.run_in_executor(None, os.pwrite, fd, chunk, offset)
+                done += len(chunk)
+                if on_progress:
+                    await on_progress(done, size)
+                    
+        fd = os.open(temp_path, os.O_WRONLY)
+        workers = [asyncio.create_task(worker(session)) for session in sessions]
+        started = time.monotonic()
+        redirected = False
+        try:
+            await asyncio.gather(*workers)
+        except CdnRedirect:
+            redirected = True
+        finally:
+            # One failed part stops the others, a partial file is never left behind
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            os.close(fd)
+            if done < size:
+                os.remove(temp_path)
+                
+        if redirected:
+            logger.info(f"{media.file_unique_id} is served by a cdn, downloading sequentially")
+            return await self.client.download_media(message, file_name=path)
+            
+        os.replace(temp_path, path)
+        elapsed = max(time.monotonic() - started, 0.001)
+        logger.info(f"downloaded {media.file_unique_id} over {len(sessions)} sessions at {size / elapsed / PART_SIZE:.1f} MiB/s")
+        return path
+        
+    async def stream(self, message, media, ahead: int) -> AsyncIterator[bytes]:
+        """Yield media parts in order while up to ahead parts are fetched concurrently"""
+        size = getattr(media, 'file_size', 0) or 0
+        if not size:
+            async for chunk in self.client.stream_media(message):
+                yield chunk
+            return
+            
+        file_id = FileId.decode(media.file_id)
+        location = file_location(file_id)
+        sessions = await self.sessions.get(file_id.dc_id)
+        count = (size + PART_SIZE - 1) // PART_SIZE
+        ahead = max(ahead, len(sessions))
+        pending = deque()
+        index = 0
+        yielded = False
+        
+        try:
+            while pending or index < count:
+                while index < count and len(pending) < ahead:
+                    session = sessions[index % len(sessions)]
+                    pending.append(asyncio.create_task(self._part(session, location, index * PART_SIZE)))
+                    index += 1
+                try:
+                    chunk = await pending.popleft()
+                except CdnRedirect:
+                    if yielded:
+                        raise TransferError("cdn redirect in the middle of a stream")
+                    logger.info(f"{media.file_unique_id} is served by a cdn, streaming sequentially")
+                    async for chunk in self.client.stream_media(message):
+                        yield chunk
+                    return
+                yielded = True
+                yield chunk
+        finally:
+            for task in pending:
+                task.cancel()
+                
+    async def _part(self, session: Session, location, offset: int) -> bytes:
+        result = await session.invoke(
+            raw.functions.upload.GetFile(location=location, offset=offset, limit=PART_SIZE),
+            sleep_threshold=30
+        )
+        if isinstance(result, raw.types.upload.FileCdnRedirect):
+            raise CdnRedirect
+        return result.bytes
+
+class MediaUploader:
+    """Uploads files to telegram with their parts spread over the pooled sessions
+    
+    Parts are read positionally and saved through every session to the home
+    datacenter at once. Files above TG_UPLOAD_LIMIT are split at key frames
+    by mkvmerge and each piece is sent while the next one is being written.
+    Videos get their duration, size and a thumbnail attached.
+    """
+    
+    def __init__(self, client, sessions: SessionPool):
+        self.client = client
+        self.sessions = sessions
+        
+    async def upload(self, path: str, on_progress: Optional[Callable[[int, int], Awaitable]] = None):
+        """Save a file to telegram and return its raw input file, on_progress gets (done, total)"""
+        size = os.path.getsize(path)
+        if not size:
+            raise TransferError(f"{os.path.basename(path)} is empty")
+        count = (size + UPLOAD_PART_SIZE - 1) // UPLOAD_PART_SIZE
+        big = size > BIG_FILE_SIZE
+        file_id = self.client.rnd_id()
+        sessions = await self.sessions.get(await self.client.storage.dc_id())
+        loop = asyncio.get_running_loop()
+        parts = deque(range(count))
+        done = 0
+        
+        async def worker(session: Session):
+            nonlocal done
+            while parts:
+                index = parts.popleft()
+                chunk = await loop.run_in_executor(None, os.pread, fd, UPLOAD_PART_SIZE, index * UPLOAD_PART_SIZE)
+                if big:
+                    query = raw.functions.upload.SaveBigFilePart(file_id=file_id, file_part=index, file_total_parts=count, bytes=chunk)
+                else:
+                    query = raw.functions.upload.SaveFilePart(file_id=file_id, file_part=index, bytes=chunk)
+                if not await session.invoke(query, sleep_threshold=30):
+                    raise TransferError(f"part {index} of {os.path.basename(path)} was not saved")
+                done += len(chunk)
+                if on_progress:
+                    await on_progress(done, size)
+                    
+        fd = os.open(path, os.O_RDONLY)
+        workers = [asyncio.create_task(worker(session)) for session in sessions]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            os.close(fd)
+            
+        name = os.path.basename(path)
+        if big:
+            return raw.types.InputFileBig(id=file_id, parts=count, name=name)
+        md5 = await loop.run_in_executor(None, md5_file, path)
+        return raw.types.InputFile(id=file_id, parts=count, name=name, md5_checksum=md5)
+        
+    async def send(self, chat_id: int, path: str, caption: str = "", reply_to: Optional[int] = None,
+                   on_progress: Optional[Callable[[str, int, int], Awaitable]] = None) -> int:
+        """Send a file to a chat, split when too large, returns the number of messages sent
+        
+        on_progress gets (part name, bytes sent of the whole file, file size).
+        """
+        size = os.path.getsize(path)
+        offset = 0
+        
+        async def report(name, done):
+            if on_progress:
+                await on_progress(name, offset + done, size)
+                
+        if size <= Config.TG_UPLOAD_LIMIT:
+            await self._send_one(chat_id, path, caption, reply_to, lambda done, _: report(os.path.basename(path), done))
+            return 1
+            
+        # Only media can be cut into playable parts, anything else is refused before mkvmerge sees it
+        try:
+            info = await self.client.probe_cache.probe(path)
+        except (ProbeError, OSError):
+            info = {}
+        if not any(stream.get('codec_type') in ('video', 'audio') for stream in info.get('streams', [])):
+            raise TransferError(f"{os.path.basename(path)} is too large to send and is not media that could be split")
+            
+        # mkvmerge only cuts before a key frame, leave room for the last one
+        limit = Config.TG_UPLOAD_LIMIT - Config.TG_UPLOAD_LIMIT // 50
+        folder = os.path.join(Config.TEMP_PATH, f"split_{self.client.rnd_id()}")
+        output = os.path.join(folder, f"{os.path.splitext(os.path.basename(path))[0]}.mkv")
+        reservation = await self.client.disk.reserve(Config.TEMP_PATH, size, os.path.basename(output))
+        sent = 0
+        try:
+            os.makedirs(folder, exist_ok=True)
+            with self.client.disk.hold(path, folder):
+                async for part in split_parts(path, output, limit):
+                    name = os.path.basename(part)
+                    await self._send_one(
+                        chat_id, part, f"{caption}\n\npart {sent + 1}".strip(), reply_to,
+                        lambda done, _: report(name, done), cache=False
+                    )
+                    offset += os.path.getsize(part)
+                    sent += 1
+                    # Sent pieces make room for the ones mkvmerge is still writing
+                    os.remove(part)
+                    reservation.update(offset)
+        finally:
+            reservation.release()
+            shutil.rmtree(folder, ignore_errors=True)
+        return sent
+        
+    async def _send_one(self, chat_id: int, path: str, caption: str, reply_to: Optional[int], on_progress,
+                        cache: bool = True):
+        name = os.path.basename(path)
+        attributes = [raw.types.DocumentAttributeFilename(file_name=name)]
+        thumb = None
+        
+        # Split parts are deleted right after sending, caching their probes would only leave stale entries
+        try:
+            info = await (self.client.probe_cache.probe(path) if cache else run_ffprobe(path))
+        except (ProbeError, OSError):
+            info = {}
+        video = next((stream for stream in info.get('streams', []) if stream.get('codec_type') == 'video'), None)
+        if video:
+            duration = float(info.get('format', {}).get('duration') or 0)
+            attributes.append(raw.types.DocumentAttributeVideo(
+                duration=int(duration),
+                w=int(video.get('width') or 0),
+                h=int(video.get('height') or 0),
+                supports_streaming=True
+            ))
+            os.makedirs(Config.TEMP_PATH, exist_ok=True)
+            thumb_path = await make_thumbnail(path, os.path.join(Config.TEMP_PATH, f"thumb_{self.client.rnd_id()}.jpg"), duration)
+            if thumb_path:
+                try:
+                    thumb = await self.upload(thumb_path)
+                finally:
+                    os.remove(thumb_path)
+                    
+        file = await self.upload(path, on_progress)
+        await self.client.invoke(raw.functions.messages.SendMedia(
+            peer=await self.client.resolve_peer(chat_id),
+            media=raw.types.InputMediaUploadedDocument(
+                file=file,
+                mime_type=mimetypes.guess_type(name)[0] or 'application/octet-stream',
+                attributes=attributes,
+                thumb=thumb
+            ),
+            message=caption,
+            random_id=self.client.rnd_id(),
+            reply_to_msg_id=reply_to
+        ))
\ No newline at end of file
@@ -0,0 +1,205 @@
+"""
+Bounded priority worker pool for cpu and disk heavy jobs
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+def is_rotational(path: str) -> Optional[bool]:
+    """Check whether a path lives on a spinning disk, None if unknown"""
+    try:
+        dev = os.stat(path).st_dev
+        block = f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}"
+        for queue in (f"{block}/queue/rotational", f"{block}/../queue/rotational"):
+            if os.path.exists(queue):
+                with open(queue) as f:
+                    return f.read().strip() == "1"
+    except (OSError, ValueError):
+        pass
+    return None
+
+def default_workers(path: str) -> int:
+    """Pick a worker count from the core count and the disk type"""
+    cores = os.cpu_count() or 1
+    if is_rotational(path):
+        # Parallel streams make a single spindle seek constantly
+        return max(1, min(2, cores // 4))
+    return max(1, cores // 2)
+
+class PoolJob:
+    """A unit of work queued on a WorkerPool"""
+    
+    _ids = itertools.count(1)
+    
+    def __init__(self, func: Callable[[], Awaitable[Any]], name: str, priority: int = 0,
+                 on_position: Optional[Callable[['PoolJob', int], Any]] = None, owner: Optional[int] = None):
+        self.id = next(self._ids)
+        self.func = func
+        self.name = name
+        self.priority = priority
+        self.owner = owner
+        self.on_position = on_position
+        self.state = "queued"
+        self.task: Optional[asyncio.Task] = None
+        self.future: Optional[asyncio.Future] = None
+        # What admission handed out, e.g. a disk reservation, released when the job ends
+        self.admission: Any = None
+        
+    async def wait(self) -> Any:
+        """Wait for the job to finish and return its result"""
+        return await self.future
+
+class WorkerPool:
+    """Runs at most `size` jobs at once, highest priority first then FIFO"""
+    
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = max(1, size)
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._running: Dict[int, PoolJob] = {}
+        self._admitting: Dict[int, PoolJob] = {}
+        
+    def submit(self, func: Callable[[], Awaitable[Any]], name: str, priority: int = 0,
+               on_position: Optional[Callable[['PoolJob', int], Any]] = None,
+               admit: Optional[Callable[[], Awaitable[Any]]] = None, owner: Optional[int] = None) -> PoolJob:
+        """Queue a coroutine function, returns the job handle
+        
+        admit is awaited before the job joins the queue, so a job waiting on
+        something else, such as disk space, does not hold a worker. Its
+        result is kept on job.admission and released once the job ends.
+        """
+        job = PoolJob(func, name, priority, on_position, owner)
+        job.future = asyncio.get_running_loop().create_future()
+        if admit:
+            job.state = "admitting"
+            self._admitting[job.id] = job
+            job.task = asyncio.create_task(admit())
+            job.task.add_done_callback(lambda task: self._admitted(job, task))
+            return job
+        heapq.heappush(self._heap, (-priority, next(self._seq), job))
+        self._fill()
+        return job
+        
+    @property
+    def running(self) -> List[PoolJob]:
+        """Jobs currently executing"""
+        return list(self._running.values())
+        
+    @property
+    def admitting(self) -> List[PoolJob]:
+        """Jobs still waiting to be admitted to the queue"""
+        return list(self._admitting.values())
+        
+    @property
+    def queued(self) -> List[PoolJob]:
+        """Waiting jobs in the order they will start"""
+        return [entry[2] for entry in sorted(self._heap)]
+        
+    def get(self, job_id: int) -> Optional[PoolJob]:
+        """Find a running, queued or admitting job by id"""
+        if job_id in self._running:
+            return self._running[job_id]
+        if job_id in self._admitting:
+            return self._admitting[job_id]
+        for entry in self._heap:
+            if entry[2].id == job_id:
+                return entry[2]
+        return None
+        
+    def position(self, job: PoolJob) -> int:
+        """1-based queue position, 0 once the job has started"""
+        for index, queued in enumerate(self.queued, 1):
+            if queued is job:
+                return index
+        return 0
+        
+    def cancel(self, job_id: int) -> bool:
+        """Cancel a queued or running job"""
+        job = self.get(job_id)
+        if not job:
+            return False
+        if job.state in ("running", "admitting"):
+            job.task.cancel()
+            return True
+        self._heap = [entry for entry in self._heap if entry[2] is not job]
+        heapq.heapify(self._heap)
+        self._end(job, "cancelled")
+        job.future.cancel()
+        self._notify()
+        return True
+        
+    def set_priority(self, job_id: int, priority: int) -> bool:
+        """Move a queued job up or down the queue"""
+        if job_id in self._admitting:
+            # Takes effect once the job joins the queue
+            self._admitting[job_id].priority = priority
+            return True
+        for index, entry in enumerate(self._heap):
+            if entry[2].id == job_id:
+                job = entry[2]
+                job.priority = priority
+                self._heap[index] = (-priority, entry[1], job)
+                heapq.heapify(self._heap)
+                self._notify()
+                return True
+        return False
+        
+    def _fill(self):
+        while self._heap and len(self._running) < self.size:
+            job = heapq.heappop(self._heap)[2]
+            job.state = "running"
+            self._running[job.id] = job
+            job.task = asyncio.create_task(job.func())
+            job.task.add_done_callback(lambda task, job=job: self._finished(job, task))
+        self._notify()
+        
+    def _notify(self):
+        for index, job in enumerate(self.queued, 1):
+            if job.on_position:
+                try:
+                    job.on_position(job, index)
+                except Exception as e:
+                    logger.error(f"{self.name} pool position callback failed: {e}")
+                    
+    def _admitted(self, job: PoolJob, task: asyncio.Task):
+        self._admitting.pop(job.id, None)
+        if task.cancelled():
+            job.state = "cancelled"
+            job.future.cancel()
+        elif task.exception():
+            job.state = "failed"
+            job.future.set_exception(task.exception())
+        else:
+            job.admission = task.result()
+            job.state = "queued"
+            heapq.heappush(self._heap, (-job.priority, next(self._seq), job))
+            self._fill()
+            
+    def _end(self, job: PoolJob, state: str):
+        job.state = state
+        if job.admission is not None:
+            try:
+                job.admission.release()
+            except Exception as e:
+                logger.error(f"{self.name} pool failed to release {job.name}: {e}")
+            job.admission = None
+            
+    def _finished(self, job: PoolJob, task: asyncio.Task):
+        self._running.pop(job.id, None)
+        if task.cancelled():
+            self._end(job, "cancelled")
+            job.future.cancel()
+        elif task.exception():
+            self._end(job, "failed")
+            job.future.set_exception(task.exception())
+        else:
+            self._end(job, "done")
+            job.future.set_result(task.result())
+        self._fill()
\ No newline at end of file
@@ -0,0 +1,101 @@
+"""
+Episode matching for /batchmux
+"""
+
+import os
+
+import pytest
+
+from bot.plugins.mux import episode_key, pair_episodes
+
+
+@pytest.mark.parametrize("name, key", [
+    ("Show.S01E03.1080p.WEB-DL.DDP5.1.H.264-GRP.mkv", (1, 3)),
+    ("Show.2019.S01E12.1080p.x265.10bit.mkv", (1, 12)),
+    ("Show_S02E05_720p.mkv", (2, 5)),
+    ("Show - S01E05 - Title.mkv", (1, 5)),
+    ("Show.S01E04.HDR10.DTS-HD.MA.5.1.mkv", (1, 4)),
+    ("[Group] Show - 12 (1080p) [ABCD1234].mkv", (0, 12)),
+    ("Show - 05v2.mkv", (0, 5)),
+    ("Show - 05 [E-AC3].mkv", (0, 5)),
+    ("Show - 05 [1080p HEVC Hi10P AAC 2ch].mkv", (0, 5)),
+    ("Show Season 2 - 07 [FLAC].mkv", (0, 7)),
+    ("86 - 05.ass", (0, 5)),
+    ("show.05.AAC2.0.mka", (0, 5)),
+    ("Show - 05.en.srt", (0, 5)),
+    ("Show Episode 9.srt", (0, 9)),
+    ("05.srt", (0, 5)),
+])
+def test_episode_key(name, key):
+    assert episode_key(name) == key
+
+
+@pytest.mark.parametrize("name", [
+    "Show S01E01E02.mkv",
+    "Show.S01E01-02.mkv",
+    "Show.S01E05.E06.mkv",
+    "Show_S01E05_E06_720p.mkv",
+    "Show - 05 - 06.mkv",
+    "Show 2 05.mkv",
+    "Show.mkv",
+])
+def test_episode_key_ambiguous(name):
+    assert episode_key(name) is None
+
+
+def make_files(folder, names):
+    folder.mkdir(exist_ok=True)
+    for name in names:
+        (folder / name).write_bytes(b"")
+    return str(folder)
+
+
+def test_pair_episodes(tmp_path):
+    videos = make_files(tmp_path / "videos", [
+        "Show_S01E01_1080p.mkv",
+        "Show_S01E02_1080p.mkv",
+        "Show_S01E03_1080p.mkv",
+        "notes.txt",
+    ])
+    tracks = make_files(tmp_path / "subs", [
+        "Show - 01.en.srt",
+        "Show - 01.es.srt",
+        "show.02.AAC2.0.mka",
+        "Show - 07.ass",
+    ])
+    pairs, unmatched = pair_episodes(videos, tracks)
+    
+    assert [(label, os.path.basename(video), sorted(map(os.path.basename, paths))) for label, video, paths in pairs] == [
+        ("S01E01", "Show_S01E01_1080p.mkv", ["Show - 01.en.srt", "Show - 01.es.srt"]),
+        ("S01E02", "Show_S01E02_1080p.mkv", ["show.02.AAC2.0.mka"]),
+    ]
+    assert sorted(unmatched) == ["Show - 07.ass", "Show_S01E03_1080p.mkv"]
+
+
+def test_pair_episodes_leaves_conflicts_unmatched(tmp_path):
+    videos = make_files(tmp_path / "videos", [
+        "Show - 05.mkv",
+        "Show - 05v2.mkv",
+        "Show - 06.mkv",
+        "Show S01E07E08.mkv",
+    ])
+    tracks = make_files(tmp_path / "subs", [
+        "Show - 05.srt",
+        "Show - 06.srt",
+        "Show - 06 - 07.srt",
+    ])
+    pairs, unmatched = pair_episodes(videos, tracks)
+    
+    assert [(label, os.path.basename(video)) for label, video, _ in pairs] == [("E06", "Show - 06.mkv")]
+    assert sorted(unmatched) == [
+        "Show - 05.mkv", "Show - 05.srt", "Show - 05v2.mkv", "Show - 06 - 07.srt", "Show S01E07E08.mkv"
+    ]
+
+
+def test_pair_episodes_ignores_season_on_unique_episode(tmp_path):
+    videos = make_files(tmp_path / "videos", ["Show.S02E03.mkv", "Show.S02E04.mkv"])
+    tracks = make_files(tmp_path / "subs", ["Show - 03.srt", "Show.S01E04.srt"])
+    pairs, unmatched = pair_episodes(videos, tracks)
+    
+    assert [label for label, _, _ in pairs] == ["S02E03", "S02E04"]
+    assert unmatched == []
\ No newline at end of file
@@ -0,0 +1,200 @@
+"""
+Disk space admission, eviction and pins
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import time
+from collections import namedtuple
+
+import pytest
+
+from bot.config import Config
+from bot.diskspace import DiskManager, DiskSpaceError
+from bot.workers import WorkerPool
+
+MiB = 1024 * 1024
+Usage = namedtuple("Usage", "total used free")
+
+
+@pytest.fixture
+def disk(tmp_path, monkeypatch):
+    """A 100 MiB disk whose free space shrinks with the files written under tmp_path"""
+    downloads, temp, cache = tmp_path / "downloads", tmp_path / "temp", tmp_path / "cache"
+    for folder in (downloads, temp, cache):
+        folder.mkdir()
+    monkeypatch.setattr(Config, "DOWNLOAD_PATH", str(downloads))
+    monkeypatch.setattr(Config, "TEMP_PATH", str(temp))
+    monkeypatch.setattr(Config, "CACHE_PATH", str(cache))
+    monkeypatch.setattr(Config, "DISK_RESERVE", 0)
+    monkeypatch.setattr(Config, "DISK_WAIT_TIMEOUT", 5)
+    monkeypatch.setattr(Config, "DISK_EVICT_AGE", 3600)
+    monkeypatch.setattr(Config, "DISK_EVICT_DOWNLOADS", 0)
+    
+    def disk_usage(path):
+        used = sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, files in os.walk(tmp_path) for name in files
+        )
+        return Usage(100 * MiB, used, 100 * MiB - used)
+        
+    monkeypatch.setattr(shutil, "disk_usage", disk_usage)
+    return tmp_path
+
+
+def write(path, size, age=0):
+    with open(path, "wb") as f:
+        f.truncate(size)
+    if age:
+        used = time.time() - age
+        os.utime(path, (used, used))
+    return str(path)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_reserve_admits_in_order_once_space_is_released(disk):
+    async def main():
+        manager = DiskManager()
+        manager.start()
+        first = await manager.reserve(Config.DOWNLOAD_PATH, 70 * MiB, "first")
+        positions = []
+        
+        async def on_wait(position):
+            positions.append(position)
+            
+        second = asyncio.create_task(manager.reserve(Config.DOWNLOAD_PATH, 50 * MiB, "second", on_wait))
+        await asyncio.sleep(0.05)
+        assert not second.done()
+        assert positions == [1]
+        assert [reservation.name for reservation in manager.waiting] == ["second"]
+        
+        first.release()
+        reservation = await asyncio.wait_for(second, 2)
+        assert reservation.size == 50 * MiB
+        assert manager.available(Config.DOWNLOAD_PATH) == 50 * MiB
+        manager.stop()
+        
+    run(main())
+
+
+def test_written_bytes_stop_counting_against_the_reservation(disk):
+    async def main():
+        manager = DiskManager()
+        reservation = await manager.reserve(Config.TEMP_PATH, 40 * MiB, "job")
+        write(os.path.join(Config.TEMP_PATH, "part"), 10 * MiB)
+        reservation.update(10 * MiB)
+        assert manager.available(Config.TEMP_PATH) == 60 * MiB
+        reservation.release()
+        assert manager.available(Config.TEMP_PATH) == 90 * MiB
+        
+    run(main())
+
+
+def test_job_larger_than_the_disk_fails_at_once(disk):
+    with pytest.raises(DiskSpaceError):
+        run(DiskManager().reserve(Config.DOWNLOAD_PATH, 200 * MiB, "huge"))
+
+
+def test_wait_times_out(disk, monkeypatch):
+    monkeypatch.setattr(Config, "DISK_WAIT_TIMEOUT", 0.05)
+    
+    async def main():
+        manager = DiskManager()
+        await manager.reserve(Config.DOWNLOAD_PATH, 80 * MiB, "first")
+        with pytest.raises(DiskSpaceError):
+            await manager.reserve(Config.DOWNLOAD_PATH, 80 * MiB, "second")
+        assert manager.waiting == []
+        
+    run(main())
+
+
+def test_evicts_old_temp_files_but_not_pinned_held_or_downloads(disk):
+    old_temp = write(disk / "temp" / "old.bin", 30 * MiB, age=7200)
+    pinned = write(disk / "temp" / "pinned.bin", 30 * MiB, age=7200)
+    held = write(disk / "temp" / "held.bin", 10 * MiB, age=7200)
+    fresh = write(disk / "temp" / "fresh.bin", 10 * MiB)
+    download = write(disk / "downloads" / "show.mkv", 10 * MiB, age=7200)
+    
+    async def main():
+        manager = DiskManager()
+        manager.pin(pinned)
+        with manager.hold(held):
+            assert [path for _, _, path in manager.evictable()] == [old_temp]
+            await manager.reserve(Config.TEMP_PATH, 30 * MiB, "job")
+            
+    run(main())
+    assert not os.path.exists(old_temp)
+    assert all(os.path.exists(path) for path in (pinned, held, fresh, download))
+
+
+def test_download_eviction_is_opt_in(disk, monkeypatch):
+    download = write(disk / "downloads" / "show.mkv", 10 * MiB, age=7200)
+    assert DiskManager().evictable() == []
+    monkeypatch.setattr(Config, "DISK_EVICT_DOWNLOADS", 3600)
+    assert [path for _, _, path in DiskManager().evictable()] == [download]
+
+
+def test_pins_survive_a_restart(disk):
+    path = write(disk / "downloads" / "keep.mkv", MiB)
+    manager = DiskManager()
+    manager.pin(path)
+    with open(manager.pins_path, encoding="utf-8") as f:
+        assert json.load(f) == [os.path.abspath(path)]
+        
+    async def main():
+        restarted = DiskManager()
+        restarted.start()
+        assert restarted.pinned(path)
+        assert restarted.unpin(path)
+        assert not restarted.unpin(path)
+        restarted.stop()
+        
+    run(main())
+
+
+def test_pool_admission_holds_no_worker(disk):
+    async def main():
+        manager = DiskManager()
+        manager.start()
+        pool = WorkerPool("test", 1)
+        blocker = await manager.reserve(Config.TEMP_PATH, 90 * MiB, "blocker")
+        
+        big = pool.submit(
+            lambda: asyncio.sleep(0, "big"), "big",
+            admit=lambda: manager.reserve(Config.TEMP_PATH, 50 * MiB, "big")
+        )
+        small = pool.submit(lambda: asyncio.sleep(0, "small"), "small")
+        assert await asyncio.wait_for(small.wait(), 1) == "small"
+        assert [job.name for job in pool.admitting] == ["big"]
+        
+        blocker.release()
+        assert await asyncio.wait_for(big.wait(), 2) == "big"
+        # The admission is released with the job
+        assert manager.available(Config.TEMP_PATH) == 100 * MiB
+        manager.stop()
+        
+    run(main())
+
+
+def test_cancelled_admission_gives_nothing_back(disk):
+    async def main():
+        manager = DiskManager()
+        pool = WorkerPool("test", 1)
+        await manager.reserve(Config.TEMP_PATH, 90 * MiB, "blocker")
+        job = pool.submit(
+            lambda: asyncio.sleep(0), "job",
+            admit=lambda: manager.reserve(Config.TEMP_PATH, 50 * MiB, "job")
+        )
+        await asyncio.sleep(0.05)
+        assert pool.cancel(job.id)
+        with pytest.raises(asyncio.CancelledError):
+            await job.wait()
+        assert job.state == "cancelled"
+        assert manager.waiting == []
+        
+    run(main())
\ No newline at end of file
@@ -0,0 +1,111 @@
+"""
+Content addressed file store
+"""
+
+import asyncio
+import json
+import os
+
+import pytest
+
+from bot import filestore
+from bot.config import Config
+from bot.ffprobe import ProbeCache
+from bot.filestore import FileStore, normalize_url
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "STORE_PATH", str(tmp_path / "store"))
+    monkeypatch.setattr(Config, "STORE_SIZE", 1024 * 1024)
+    monkeypatch.setattr(filestore, "SAVE_DELAY", 0)
+    return FileStore()
+
+
+def write(path, content):
+    with open(path, "wb") as f:
+        f.write(content)
+    return str(path)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_same_content_under_two_keys_is_stored_once(store, tmp_path):
+    async def main():
+        first = await store.add("url:a", write(tmp_path / "a.mkv", b"episode"))
+        second = await store.add("tg:b", write(tmp_path / "b.mkv", b"episode"), "b.mkv")
+        other = await store.add("tg:c", write(tmp_path / "c.mkv", b"another"))
+        assert first == second != other
+        assert store.keys == {"url:a": first, "tg:b": first, "tg:c": other}
+        assert len(store.objects) == 2
+        assert store.lookup("url:a")["name"] == "b.mkv"
+        
+    run(main())
+
+
+def test_materialize_links_a_fresh_copy_unless_reused(store, tmp_path):
+    async def main():
+        await store.add("tg:a", write(tmp_path / "a.mkv", b"episode"))
+        job = tmp_path / "job"
+        first = await store.materialize("tg:a", str(job))
+        second = await store.materialize("tg:a", str(job))
+        reused = await store.materialize("tg:a", str(job), reuse=True)
+        assert first == str(job / "a.mkv")
+        assert second == str(job / "a.1.mkv")
+        assert reused == first
+        assert os.path.samefile(first, second)
+        assert await store.materialize("tg:missing", str(job)) is None
+        
+    run(main())
+
+
+def test_modified_object_is_dropped(store, tmp_path):
+    async def main():
+        await store.add("tg:a", write(tmp_path / "a.mkv", b"episode"))
+        path = await store.materialize("tg:a", str(tmp_path / "job"))
+        # Writing through the hardlink changes the stored object too
+        with open(path, "ab") as f:
+            f.write(b" with extra bytes")
+        assert store.lookup("tg:a") is None
+        assert store.keys == {} and store.objects == {}
+        
+    run(main())
+
+
+def test_least_recently_used_objects_are_evicted(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "STORE_SIZE", 10)
+    
+    async def main():
+        await store.add("tg:a", write(tmp_path / "a.mkv", b"aaaaaa"))
+        await store.add("tg:b", write(tmp_path / "b.mkv", b"bbbbbb"))
+        assert list(store.keys) == ["tg:b"]
+        assert store.size == 6
+        
+    run(main())
+
+
+def test_index_is_saved_and_loaded(store, tmp_path):
+    async def main():
+        digest = await store.add("tg:a", write(tmp_path / "a.mkv", b"episode"))
+        await store.stop()
+        await asyncio.sleep(0.05)
+        with open(store.index_path, encoding="utf-8") as f:
+            assert json.load(f)["keys"] == {"tg:a": digest}
+            
+        restarted = FileStore()
+        restarted.start()
+        assert restarted.lookup("tg:a")["sha256"] == digest
+        
+    run(main())
+
+
+def test_url_keys_ignore_spelling_and_are_shared_with_the_probe_cache():
+    headers = {"ETag": '"v1"'}
+    key = FileStore.url_key("HTTPS://Example.com:443/show.mkv?b=2&a=1#part", headers)
+    assert key == FileStore.url_key("https://example.com/show.mkv?a=1&b=2", headers)
+    assert key == ProbeCache.url_key("https://example.com/show.mkv?a=1&b=2", headers)
+    assert key == 'url:https://example.com/show.mkv?a=1&b=2:"v1"'
+    assert FileStore.url_key("https://example.com/show.mkv", {}) is None
+    assert normalize_url("http://example.com:8080") == "http://example.com:8080/"
\ No newline at end of file
@@ -0,0 +1,142 @@
+"""
+Job registry and resume after a restart
+"""
+
+import asyncio
+import json
+
+import pytest
+
+from bot import jobs
+from bot.config import Config
+from bot.jobs import JobManager, JobStore
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "CACHE_PATH", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def resumers(monkeypatch):
+    registry = {}
+    monkeypatch.setattr(jobs, "RESUMERS", registry)
+    return registry
+
+
+def stored(cache):
+    with open(cache / "jobs.json", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_descriptor_is_stored_until_the_job_finishes(cache):
+    async def main():
+        manager = JobManager()
+        job = manager.register("mux", "show.mkv", descriptor={"chat_id": 1})
+        key = job.descriptor["key"]
+        manager.persist(job, stage="muxed")
+        await manager.store.flush()
+        assert stored(cache) == [{"chat_id": 1, "key": key, "kind": "mux", "stage": "muxed"}]
+        
+        manager.finish(job)
+        await manager.store.flush()
+        assert stored(cache) == []
+        
+    run(main())
+
+
+def test_suspended_jobs_stay_stored(cache):
+    async def main():
+        manager = JobManager()
+        job = manager.register("mux", "show.mkv", descriptor={})
+        await manager.suspend()
+        manager.persist(job, stage="ignored")
+        manager.finish(job, "cancelled")
+        await manager.store.flush()
+        assert [descriptor["key"] for descriptor in stored(cache)] == [job.descriptor["key"]]
+        assert "stage" not in stored(cache)[0]
+        
+    run(main())
+
+
+def test_resume_hands_descriptors_to_their_resumer(cache, resumers):
+    async def main():
+        first = JobManager()
+        job = first.register("mux", "show.mkv", descriptor={"chat_id": 1})
+        await first.suspend()
+        
+        restarted = JobManager()
+        done = asyncio.Event()
+        
+        @jobs.resumable("mux")
+        async def resume_mux(client, descriptor):
+            async def work(job):
+                await done.wait()
+            await restarted.run(work, "mux", "show.mkv", descriptor=descriptor)
+            
+        await restarted.resume("client")
+        await asyncio.sleep(0.05)
+        resumed = restarted.list()
+        assert [resumed_job.descriptor["key"] for resumed_job in resumed] == [job.descriptor["key"]]
+        assert resumers == {"mux": resume_mux}
+        
+        done.set()
+        await asyncio.sleep(0.05)
+        await restarted.store.flush()
+        assert restarted.list() == []
+        assert stored(cache) == []
+        
+    run(main())
+
+
+def test_descriptors_nobody_picks_up_are_forgotten(cache, resumers):
+    async def main():
+        first = JobManager()
+        first.register("gone", "old", descriptor={})
+        first.register("broken", "old", descriptor={})
+        await first.suspend()
+        
+        @jobs.resumable("broken")
+        async def resume_broken(client, descriptor):
+            raise ValueError("bad descriptor")
+            
+        restarted = JobManager()
+        await restarted.resume("client")
+        await asyncio.sleep(0.05)
+        await restarted.store.flush()
+        assert stored(cache) == []
+        
+    run(main())
+
+
+def test_store_uses_the_database_when_configured(cache):
+    class FakeDb:
+        def __init__(self):
+            self.jobs = {}
+            
+        async def get_jobs(self):
+            return list(self.jobs.values())
+            
+        async def save_job(self, key, descriptor):
+            self.jobs[key] = descriptor
+            
+        async def delete_job(self, key):
+            del self.jobs[key]
+            
+    async def main():
+        db = FakeDb()
+        store = JobStore(db)
+        store.put({"key": "a", "kind": "mux"})
+        store.put({"key": "b", "kind": "pipe"})
+        store.delete("a")
+        await store.flush()
+        assert db.jobs == {"b": {"key": "b", "kind": "pipe"}}
+        assert await JobStore(db).load() == [{"key": "b", "kind": "pipe"}]
+        assert not (cache / "jobs.json").exists()
+        
+    run(main())
\ No newline at end of file
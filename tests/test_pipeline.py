@@ -0,0 +1,126 @@
+"""
+Stage graph runner
+"""
+
+import asyncio
+
+import pytest
+
+from bot.pipeline import Pipeline, StageError
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_stages_start_once_their_dependencies_are_done():
+    async def main():
+        events = []
+        
+        def stage(name, delay=0):
+            async def work(stage, *inputs):
+                events.append(("start", name, inputs))
+                await asyncio.sleep(delay)
+                events.append(("end", name))
+                return name
+            return work
+            
+        pipeline = Pipeline("show")
+        pipeline.add("video", stage("video", 0.05))
+        pipeline.add("subs", stage("subs"))
+        pipeline.add("mux", stage("mux"), deps=["video", "subs"])
+        pipeline.add("upload", stage("upload"), deps=["mux"])
+        
+        results = await pipeline.run()
+        assert results == {"video": "video", "subs": "subs", "mux": "mux", "upload": "upload"}
+        # Independent downloads overlap, the mux gets its inputs in declaration order
+        assert events[:2] == [("start", "video", ()), ("start", "subs", ())]
+        assert events[3:] == [
+            ("end", "video"), ("start", "mux", ("video", "subs")), ("end", "mux"),
+            ("start", "upload", ("mux",)), ("end", "upload")
+        ]
+        assert pipeline.state == "done"
+        
+    run(main())
+
+
+def test_unknown_dependency_is_rejected():
+    pipeline = Pipeline("show")
+    with pytest.raises(ValueError):
+        pipeline.add("mux", None, deps=["video"])
+
+
+def test_failed_stage_aborts_the_rest():
+    async def main():
+        async def fail(stage):
+            raise StageError("no such file")
+            
+        async def slow(stage):
+            await asyncio.sleep(5)
+            
+        async def mux(stage, *inputs):
+            raise AssertionError("mux ran without its inputs")
+            
+        pipeline = Pipeline("show")
+        pipeline.add("video", fail, label="download video")
+        pipeline.add("subs", slow)
+        pipeline.add("mux", mux, deps=["video", "subs"])
+        
+        with pytest.raises(StageError, match="download video: no such file"):
+            await asyncio.wait_for(pipeline.run(), 1)
+        assert {name: stage.state for name, stage in pipeline.stages.items()} == {
+            "video": "failed", "subs": "cancelled", "mux": "cancelled"
+        }
+        assert pipeline.state == "failed"
+        
+    run(main())
+
+
+def test_restore_skips_stages_done_before_a_restart():
+    async def main():
+        ran = []
+        
+        def stage(name):
+            async def work(stage, *inputs):
+                ran.append(name)
+                return f"{name}{inputs}"
+            return work
+            
+        pipeline = Pipeline("show")
+        pipeline.add("video", stage("video"))
+        pipeline.add("subs", stage("subs"))
+        pipeline.add("mux", stage("mux"), deps=["video", "subs"])
+        # The mux result is not trusted without both of its inputs
+        pipeline.restore({"video": "video.mkv", "mux": "old.mkv"})
+        assert pipeline.stages["video"].state == "done"
+        assert pipeline.stages["mux"].state == "waiting"
+        
+        results = await pipeline.run()
+        assert ran == ["subs", "mux"]
+        assert results["mux"] == "mux('video.mkv', 'subs()')"
+        
+    run(main())
+
+
+def test_cancelling_the_run_cancels_every_stage():
+    async def main():
+        updates = []
+        
+        async def on_update(pipeline):
+            updates.append(pipeline.state)
+            
+        async def slow(stage):
+            await asyncio.sleep(5)
+            
+        pipeline = Pipeline("show", on_update)
+        pipeline.add("video", slow)
+        pipeline.add("mux", slow, deps=["video"])
+        task = asyncio.create_task(pipeline.run())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert pipeline.state == "cancelled"
+        assert updates[0] == "running" and updates[-1] == "cancelled"
+        
+    run(main())
\ No newline at end of file
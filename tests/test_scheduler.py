@@ -0,0 +1,129 @@
+"""
+Coalescing status edit scheduler
+"""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+from pyrogram.errors import FloodWait, MessageNotModified
+
+from bot.scheduler import EditScheduler
+
+
+class FakeMessage:
+    """Records the texts written to it, raising queued errors first"""
+    
+    def __init__(self, chat_id=1, message_id=1, errors=()):
+        self.chat = SimpleNamespace(id=chat_id)
+        self.id = message_id
+        self.errors = list(errors)
+        self.started = asyncio.Event()
+        self.gate = None
+        self.texts = []
+        self.times = []
+        
+    async def edit_text(self, text, **kwargs):
+        self.started.set()
+        if self.gate:
+            await self.gate.wait()
+        await asyncio.sleep(0)
+        self.times.append(time.monotonic())
+        if self.errors:
+            raise self.errors.pop(0)
+        self.texts.append(text)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_newer_text_replaces_pending_edit():
+    async def main():
+        scheduler = EditScheduler()
+        message = FakeMessage()
+        first = scheduler.schedule(message, "10%")
+        second = scheduler.schedule(message, "20%")
+        third = scheduler.schedule(message, "30%")
+        scheduler.start()
+        assert await asyncio.wait_for(third, 1) is True
+        assert first.result() is False
+        assert second.result() is False
+        assert message.texts == ["30%"]
+        await scheduler.stop()
+        
+    run(main())
+
+
+def test_messages_are_coalesced_separately():
+    async def main():
+        scheduler = EditScheduler()
+        scheduler.start()
+        one, two = FakeMessage(message_id=1), FakeMessage(message_id=2)
+        results = await asyncio.wait_for(asyncio.gather(
+            scheduler.schedule(one, "a"), scheduler.schedule(two, "b")
+        ), 1)
+        assert results == [True, True]
+        assert one.texts == ["a"] and two.texts == ["b"]
+        await scheduler.stop()
+        
+    run(main())
+
+
+def test_not_modified_counts_as_sent():
+    async def main():
+        scheduler = EditScheduler()
+        scheduler.start()
+        message = FakeMessage(errors=[MessageNotModified()])
+        assert await asyncio.wait_for(scheduler.schedule(message, "same"), 1) is True
+        await scheduler.stop()
+        
+    run(main())
+
+
+def test_flood_wait_holds_the_chat_and_retries():
+    async def main():
+        scheduler = EditScheduler()
+        scheduler.start()
+        message = FakeMessage(errors=[FloodWait(value=1)])
+        other = FakeMessage(chat_id=2)
+        edit = scheduler.schedule(message, "50%")
+        await asyncio.sleep(0.1)
+        # Other chats keep going while this one is held
+        assert await asyncio.wait_for(scheduler.schedule(other, "ok"), 0.5) is True
+        assert not edit.done()
+        
+        assert await asyncio.wait_for(edit, 3) is True
+        assert message.texts == ["50%"]
+        assert message.times[1] - message.times[0] >= 0.9
+        await scheduler.stop()
+        
+    run(main())
+
+
+def test_flood_wait_drops_text_replaced_meanwhile():
+    async def main():
+        scheduler = EditScheduler()
+        scheduler.start()
+        message = FakeMessage(errors=[FloodWait(value=1)])
+        message.gate = asyncio.Event()
+        old = scheduler.schedule(message, "50%")
+        await asyncio.wait_for(message.started.wait(), 1)
+        new = scheduler.schedule(message, "60%")
+        message.gate.set()
+        assert await asyncio.wait_for(old, 1) is False
+        assert await asyncio.wait_for(new, 3) is True
+        assert message.texts == ["60%"]
+        await scheduler.stop()
+        
+    run(main())
+
+
+def test_stop_resolves_pending_edits():
+    async def main():
+        scheduler = EditScheduler()
+        edit = scheduler.schedule(FakeMessage(), "queued")
+        await scheduler.stop()
+        assert edit.result() is False
+        
+    run(main())
\ No newline at end of file
@@ -0,0 +1,123 @@
+"""
+Priority worker pool
+"""
+
+import asyncio
+
+import pytest
+
+from bot.workers import WorkerPool
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_runs_highest_priority_first_then_fifo():
+    async def main():
+        pool = WorkerPool("test", 1)
+        gate = asyncio.Event()
+        order = []
+        
+        def job(name):
+            async def work():
+                await gate.wait()
+                order.append(name)
+                return name
+            return work
+            
+        jobs = [
+            pool.submit(job("first"), "first"),
+            pool.submit(job("low"), "low", priority=-1),
+            pool.submit(job("normal"), "normal"),
+            pool.submit(job("high"), "high", priority=5),
+            pool.submit(job("normal2"), "normal2"),
+        ]
+        assert [job.name for job in pool.running] == ["first"]
+        assert [job.name for job in pool.queued] == ["high", "normal", "normal2", "low"]
+        gate.set()
+        assert await jobs[3].wait() == "high"
+        await asyncio.gather(*(job.wait() for job in jobs))
+        return order
+        
+    assert run(main()) == ["first", "high", "normal", "normal2", "low"]
+
+
+def test_never_runs_more_than_size():
+    async def main():
+        pool = WorkerPool("test", 2)
+        active = peak = 0
+        
+        async def work():
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            
+        await asyncio.gather(*(pool.submit(work, str(index)).wait() for index in range(6)))
+        return peak
+        
+    assert run(main()) == 2
+
+
+def test_reports_queue_positions():
+    async def main():
+        pool = WorkerPool("test", 1)
+        gate = asyncio.Event()
+        positions = {}
+        
+        def on_position(job, position):
+            positions[job.name] = position
+            
+        pool.submit(gate.wait, "running")
+        pool.submit(gate.wait, "a", on_position=on_position)
+        pool.submit(gate.wait, "b", on_position=on_position)
+        assert positions == {"a": 1, "b": 2}
+        assert pool.set_priority(pool.queued[1].id, 3)
+        assert positions == {"a": 2, "b": 1}
+        gate.set()
+        
+    run(main())
+
+
+def test_cancel_queued_and_running():
+    async def main():
+        pool = WorkerPool("test", 1)
+        running = pool.submit(lambda: asyncio.sleep(10), "running")
+        queued = pool.submit(lambda: asyncio.sleep(0, "done"), "queued")
+        later = pool.submit(lambda: asyncio.sleep(0, "later"), "later")
+        await asyncio.sleep(0)
+        
+        assert pool.cancel(queued.id)
+        assert queued.state == "cancelled"
+        with pytest.raises(asyncio.CancelledError):
+            await queued.wait()
+            
+        assert pool.cancel(running.id)
+        with pytest.raises(asyncio.CancelledError):
+            await running.wait()
+        assert running.state == "cancelled"
+        
+        # The freed worker picks the next job up
+        assert await later.wait() == "later"
+        assert not pool.cancel(later.id)
+        
+    run(main())
+
+
+def test_failed_job_frees_its_worker():
+    async def main():
+        pool = WorkerPool("test", 1)
+        
+        async def fail():
+            raise ValueError("broken")
+            
+        failed = pool.submit(fail, "fail")
+        after = pool.submit(lambda: asyncio.sleep(0, "ok"), "after")
+        with pytest.raises(ValueError):
+            await failed.wait()
+        assert failed.state == "failed"
+        assert await after.wait() == "ok"
+        
+    run(main())
\ No newline at end of file